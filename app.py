@@ -11,10 +11,10 @@ import hashlib
 import zipfile
 from io import BytesIO
 # 匯入新的資料管理器
-from data_manager import get_data_manager, load_data, save_data
+from data_manager import get_data_manager, reset_data_manager, load_data, save_data
 # 匯入 schema 單一來源
 from schema import (
-    COLUMNS, empty_frame, compute_mass_balance, threshold_color,
+    COLUMNS, empty_frame, threshold_color, display_frame,
     SCAN_STAGES, DATA_TIER_OPTIONS, ELV_CLOSEDLOOP_OPTIONS, MATERIAL_TYPE_OPTIONS,
     STAGE_FACTORY_OUT, STAGE_BACKEND_IN, STAGE_RECYCLE, STAGE_PRODUCT,
     STAGE_TRANSPORT, STAGE_SALE, EU_THRESHOLD_LOW, EU_THRESHOLD_HIGH,
@@ -532,19 +532,19 @@ def show_scan_interface():
         if default_qr_id:
             st.success(f"🔍 已從QR碼掃描自動填入: {default_qr_id}")
         
-        # 驗證QR碼是否存在
-        df = load_data()
-        valid_qr = qr_id_input in df['qr_id'].values if qr_id_input else False
+        # 驗證QR碼是否存在(只查這一個 qr_id 的列;SQLite 儲存時為索引查詢)
+        qr_history = get_data_manager().get_qr_history(qr_id_input) if qr_id_input else empty_frame()
+        valid_qr = not qr_history.empty
         
         if qr_id_input and valid_qr:
             st.success(f"✅ QR碼 {qr_id_input} 驗證成功")
             
             # 顯示歷史記錄
-            history = df[df['qr_id'] == qr_id_input].sort_values('timestamp', ascending=False)
+            history = qr_history.sort_values('timestamp', ascending=False)
             st.subheader("歷史記錄")
             if not history.empty:
                 st.dataframe(
-                    history[['stage', 'timestamp', 'operator', 'weight_kg', 'recycled_ratio']].astype(str),
+                    display_frame(history[['stage', 'timestamp', 'operator', 'weight_kg', 'recycled_ratio']]),
                     use_container_width=True)
         elif qr_id_input and not valid_qr:
             st.error("❌ QR碼不存在，請檢查輸入")
@@ -555,7 +555,7 @@ def show_scan_interface():
 
             # stage 選擇放在 form 外:選不同 stage → 立即重繪對應欄位(stage 驅動表單)。
             # 加分:此 QR 已登過「出廠」→ 預設跳到下一步「後端機構接收」,減少選錯。
-            hist_stages = set(df[df['qr_id'] == qr_id_input]['stage'])
+            hist_stages = set(qr_history['stage'])
             default_idx = (SCAN_STAGES.index(STAGE_BACKEND_IN)
                            if STAGE_FACTORY_OUT in hist_stages else 0)
             stage = st.selectbox("處理階段", SCAN_STAGES, index=default_idx, key="scan_stage")
@@ -581,7 +581,7 @@ def show_scan_interface():
                     if operator:
                         new_record = {
                             'qr_id': qr_id_input,
-                            'batch_name': df[df['qr_id'] == qr_id_input]['batch_name'].iloc[0],
+                            'batch_name': qr_history['batch_name'].iloc[0],
                             'stage': stage,
                             'operator': operator,
                             'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -728,8 +728,9 @@ def show_system_overview():
     with col2:
         # QR 碼狀態
         st.markdown("#### 🏷️ QR 碼狀態")
-        qr_codes = df[df['stage'] == '初始建立']['qr_id'].nunique()
-        active_qrs = df[df['stage'] != '初始建立']['qr_id'].nunique()
+        # 讀每個 qr_id 的目前狀態表(新增記錄時增量更新),不再每次 nunique 整份資料
+        summary = get_data_manager().get_qr_state_summary()
+        qr_codes, active_qrs = summary['created'], summary['active']
         
         st.markdown(f"""
         <div class="custom-card">
@@ -741,6 +742,10 @@ def show_system_overview():
                 <span>活躍 QR 碼</span>
                 <span style="font-weight: 600; color: #059669;">{active_qrs}</span>
             </div>
+            <div style="display: flex; justify-content: space-between; margin-bottom: 1rem;">
+                <span>未掃描 QR 碼</span>
+                <span style="font-weight: 600; color: #f59e0b;">{summary['idle']}</span>
+            </div>
             <div style="display: flex; justify-content: space-between;">
                 <span>使用率</span>
                 <span style="font-weight: 600; color: #3b82f6;">{(active_qrs/qr_codes*100) if qr_codes > 0 else 0:.1f}%</span>
@@ -752,16 +757,14 @@ def show_recent_activities():
     """顯示最近活動"""
     st.markdown("### 📱 最近活動")
     
-    df = load_data()
+    # 最近 5 筆記錄(目前狀態表隨新增記錄維護,不必整表排序)
+    recent = get_data_manager().list_recent_events(5)
     
-    if df.empty:
+    if not recent:
         st.info("📭 暫無活動記錄")
         return
     
-    # 取最近 5 筆記錄
-    recent_df = df.sort_values('timestamp', ascending=False).head(5)
-    
-    for _, row in recent_df.iterrows():
+    for row in recent:
         time_str = row['timestamp']
         stage_colors = {
             '初始建立': '#10b981',
@@ -924,18 +927,20 @@ def show_qr_management():
             # 下載功能區域
             st.markdown("### 📥 下載 QR 碼")
             
-            # 選擇要下載的QR碼
+            # 選擇要下載的QR碼(qr_id → 批次先建成 dict,format_func 逐選項查表不再篩整表)
+            first = qr_codes.drop_duplicates('qr_id')
+            qr_batches = dict(zip(first['qr_id'], first['batch_name']))
             selected_qr = st.selectbox(
                 "選擇要下載的QR碼", 
                 options=qr_codes['qr_id'].tolist(),
-                format_func=lambda x: f"{x} - {qr_codes[qr_codes['qr_id']==x]['batch_name'].iloc[0]}"
+                format_func=lambda x: f"{x} - {qr_batches[x]}"
             )
             
             col_a, col_b = st.columns(2)
             
             with col_a:
                 if selected_qr:
-                    _bn = qr_codes[qr_codes['qr_id'] == selected_qr]['batch_name'].iloc[0]
+                    _bn = qr_batches[selected_qr]
                     try:
                         _lbl = generate_qr_label_pdf(selected_qr, _bn)
                         st.download_button(
@@ -1026,10 +1031,11 @@ def _fmt_kg(v):
     return "—" if v is None else f"{v:g} kg"
 
 
-def render_mass_balance(df, batch):
+def render_mass_balance(batch):
     """依 batch 呈現質量平衡:放大的「成品再生含量 %」主數字 + 歐盟門檻顏色 + tier 標記
-    + 進料→產出・損耗 流向。語意由 schema.compute_mass_balance 統一計算。"""
-    mb = compute_mass_balance(df, batch)
+    + 進料→產出・損耗 流向。語意同 schema.compute_mass_balance,數值讀 DataManager
+    的每批次物化檢視(新增記錄時增量更新,不再每次 rerun 由原始列重算)。"""
+    mb = get_data_manager().get_mass_balance(batch)
 
     # 空狀態:資料不足
     if mb['recycled_content'] is None and mb['feed_kg'] is None and mb['output_kg'] is None:
@@ -1122,11 +1128,17 @@ def show_query_interface():
         with col2:
             st.subheader("查詢結果")
             
-            # 篩選資料
-            filtered_df = df.copy()
-            
-            if selected_qr != "全部":
-                filtered_df = filtered_df[filtered_df['qr_id'] == selected_qr]
+            # 篩選資料(日期篩選先做:本地分片儲存只讀與區間重疊的月份分片;
+            # 未篩日期時單一 QR 直接走索引查詢,不掃整表)
+            dm = get_data_manager()
+            if date_filter and 'start_date' in locals() and 'end_date' in locals():
+                filtered_df = dm.load_range(start_date, end_date)
+                if selected_qr != "全部":
+                    filtered_df = filtered_df[filtered_df['qr_id'] == selected_qr]
+            elif selected_qr != "全部":
+                filtered_df = dm.get_qr_history(selected_qr)
+            else:
+                filtered_df = df.copy()
             
             if selected_stages:
                 filtered_df = filtered_df[filtered_df['stage'].isin(selected_stages)]
@@ -1134,33 +1146,25 @@ def show_query_interface():
             if selected_materials:
                 filtered_df = filtered_df[filtered_df['material_type'].isin(selected_materials)]
 
-            if date_filter and 'start_date' in locals() and 'end_date' in locals():
-                filtered_df['date'] = pd.to_datetime(filtered_df['timestamp']).dt.date
-                filtered_df = filtered_df[
-                    (filtered_df['date'] >= start_date) & 
-                    (filtered_df['date'] <= end_date)
-                ]
-            
             # 顯示結果
             if not filtered_df.empty:
                 st.dataframe(
-                    filtered_df.sort_values('timestamp', ascending=False).astype(str),
+                    display_frame(filtered_df.sort_values('timestamp', ascending=False)),
                     use_container_width=True
                 )
                 
                 # 質量平衡檢視(依該 QR 對應的 batch)
                 if selected_qr != "全部":
-                    batch = df[df['qr_id'] == selected_qr]['batch_name']
-                    batch = batch.iloc[0] if not batch.empty else None
+                    batch = dm.get_qr_batch(selected_qr)
                     if batch:
                         st.subheader(f"⚖️ 質量平衡 — 批次「{batch}」")
-                        render_mass_balance(df, batch)
+                        render_mass_balance(batch)
 
                 # 履歷視覺化
                 if selected_qr != "全部":
                     st.subheader(f"QR碼 {selected_qr} 的完整履歷")
 
-                    qr_data = filtered_df[filtered_df['qr_id'] == selected_qr].sort_values('timestamp')
+                    qr_data = filtered_df.sort_values('timestamp')
 
                     for idx, row in qr_data.iterrows():
                         ratio_name = "再生料來源純度" if row['stage'] == STAGE_FACTORY_OUT else "成品再生含量"
@@ -1206,6 +1210,21 @@ def show_download_interface():
             st.subheader("各階段統計")
             for stage, count in stage_counts.items():
                 st.write(f"**{stage}：** {count} 筆")
+
+            # 各批次質量平衡(讀物化檢視,不逐批次重算)
+            balances = [mb for mb in get_data_manager().list_mass_balances() if mb['batch']]
+            if balances:
+                st.subheader("各批次質量平衡")
+                st.dataframe(pd.DataFrame([{
+                    '批次': mb['batch'],
+                    '記錄數': mb['records'],
+                    '進料(kg)': mb['feed_kg'],
+                    '產出(kg)': mb['output_kg'],
+                    '損耗(kg)': mb['loss_kg'],
+                    '回收率(%)': mb['recovery_rate'],
+                    '成品再生含量(%)': mb['recycled_content'],
+                    '資料可信度': mb['data_tier'] or '',
+                } for mb in balances]), hide_index=True, use_container_width=True)
         
         with col2:
             st.subheader("下載選項")
@@ -1306,9 +1325,21 @@ def show_admin_interface():
                 st.success("✅ Google Sheets 已連接")
                 if storage_info.get("sheet_url"):
                     st.markdown(f"📊 [開啟試算表]({storage_info['sheet_url']})")
+            elif storage_info.get("sheets_connecting"):
+                st.info("⏳ Google Sheets 連線中，暫以本地儲存服務")
             else:
                 st.error("❌ Google Sheets 未連接")
                 st.info("請檢查認證設定或網路連線")
+
+            outbox = storage_info.get("outbox")
+            if outbox:
+                st.write("**待送出佇列：**")
+                if outbox["depth"]:
+                    st.info(f"📤 {outbox['depth']} 筆待送出，最舊一筆已等待 {outbox['oldest_age']:.0f} 秒")
+                else:
+                    st.success("✅ 佇列已清空")
+                if outbox["last_error"]:
+                    st.warning(f"⚠️ 送出失敗 {outbox['failures']} 次，{outbox['retry_in']:.0f} 秒後重試：{outbox['last_error']}")
             
             st.write("**本地備份狀態：**")
             if storage_info["backup_available"]:
@@ -1366,6 +1397,11 @@ def show_admin_interface():
                 else:
                     st.error("❌ Google Sheets 不可用")
             
+            # 立即重送待送佇列
+            if storage_info.get("outbox") and st.button("📤 立即重送待送佇列"):
+                dm.flush_outbox()
+                st.success("✅ 已通知背景送出")
+
             # 手動同步
             if st.button("🔄 同步本地資料到 Google Sheets"):
                 if storage_info["backup_available"]:
@@ -1376,15 +1412,21 @@ def show_admin_interface():
             # 重新初始化
             if st.button("🔁 重新初始化 Google Sheets"):
                 try:
-                    # 重新獲取資料管理器
-                    global data_manager
-                    data_manager = None  # 清除快取
+                    # 丟掉共用連線與資料管理器,重新在背景連線
+                    reset_data_manager()
                     dm_new = get_data_manager()
                     st.success("✅ Google Sheets 已重新初始化")
                     st.rerun()
                 except Exception as e:
                     st.error(f"❌ 重新初始化失敗: {str(e)}")
         
+        # API 呼叫統計(配額控管)
+        if storage_info.get("sheets_metrics"):
+            with st.expander("📈 Google Sheets API 呼叫統計"):
+                st.caption("client 端節流:讀 / 寫各依每分鐘配額限速;throttled = 本地排隊等待次數，"
+                           "rate_limited_429 = 伺服器回 429 後退避重試次數，merged = 併入同時進行的讀取次數")
+                st.dataframe(pd.DataFrame(storage_info["sheets_metrics"]), hide_index=True)
+
         # 設定說明
         st.markdown("---")
         st.subheader("Google Sheets 設定說明")
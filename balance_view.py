@@ -0,0 +1,67 @@
+"""
+每批次質量平衡的物化檢視(不 import streamlit,方便 headless 單元測試)。
+
+compute_mass_balance 的規則是「每個節點取時間最新一筆」,一筆新記錄只可能改變
+它自己批次的節點值。這裡為每個批次保存各節點(schema.BALANCE_NODES)目前最新的
+一列與列數:apply(record) 新增一筆時 O(1) 更新它所屬的批次,sync(df) 查詢前與整份
+資料對齊(見 projection.Projection);get(batch) / all() 回傳與 compute_mass_balance /
+compute_mass_balance_all 相同的 dict。
+
+本身只在記憶體;持久化由 event_store 的快照連同其他投影一起負責。
+"""
+
+from projection import Projection
+from schema import (BALANCE_FIELDS, BALANCE_NODES, COLUMNS, balance_from_nodes,
+                    latest_balance_rows, to_cell, to_float)
+
+
+class BatchBalanceView(Projection):
+    """thread-safe;同一儲存在 process 內共用一個即可。"""
+
+    def _reset(self):
+        self.batches = {}    # batch -> {'records': n, 節點: {BALANCE_FIELDS...}}
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def _fold(self, cells):
+        """一列折進所屬批次。同一 timestamp 後到者為準(同 stable 排序)。"""
+        row = dict(zip(COLUMNS, cells))
+        state = self.batches.setdefault(row['batch_name'], {'records': 0})
+        state['records'] += 1
+        for node, stages in BALANCE_NODES.items():
+            if row['stage'] not in stages:
+                continue
+            if node == 'content' and to_float(row['recycled_ratio']) is None:
+                continue
+            current = state.get(node)
+            if current is None or row['timestamp'] >= current['timestamp']:
+                state[node] = {col: row[col] for col in BALANCE_FIELDS}
+
+    def _rebuild(self, df):
+        """向量化,見 schema.latest_balance_rows。"""
+        nodes, records = latest_balance_rows(df)
+        for batch, count in records.items():
+            state = self.batches[to_cell(batch)] = {'records': count}
+            for node, rows in nodes.items():
+                if batch in rows:
+                    state[node] = {col: to_cell(v) for col, v in rows[batch].items()}
+
+    # ─── 快照(見 event_store) ────────────────────────────────────────
+    def _state(self):
+        # 各批次狀態複製一份;節點 dict 只會被整個換掉,不必深拷貝
+        return {'batches': {batch: dict(state) for batch, state in self.batches.items()}}
+
+    def _restore_state(self, data):
+        self.batches = data['batches']
+
+    # ─── 查詢 ────────────────────────────────────────────────────
+    def get(self, batch):
+        """同 compute_mass_balance(df, batch);沒有資料的批次 records=0、其餘 None。"""
+        with self._lock:
+            state = self.batches.get(batch, {})
+            return balance_from_nodes(batch, state, state.get('records', 0))
+
+    def all(self):
+        """所有批次(依首次出現順序),同 compute_mass_balance_all(df)。"""
+        with self._lock:
+            return {batch: balance_from_nodes(batch, state, state['records'])
+                    for batch, state in self.batches.items()}
@@ -0,0 +1,417 @@
+"""
+效能基準(手動執行,不進 pytest;不 import streamlit):
+    python bench.py                 # 跑全部
+    python bench.py snapshot        # 只跑指定項目
+    python bench.py --rows 1000000  # 調整資料量
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from schema import COLUMNS, SCAN_STAGES, STAGE_INITIAL, MATERIAL_TYPE_OPTIONS, DATA_TIER_OPTIONS
+
+BENCHES = {}
+
+
+def bench(name):
+    def register(fn):
+        BENCHES[name] = fn
+        return fn
+    return register
+
+
+def synthetic_frame(rows, seed=0):
+    """產生與真實資料形狀相近的 16 欄字串 frame(每批約 50 列、每 QR 約 5 個事件)。"""
+    rng = np.random.default_rng(seed)
+    qr = rng.integers(0, max(rows // 5, 1), rows)
+    ts = pd.Timestamp('2025-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 3e7, rows)), unit='s')
+    df = pd.DataFrame({c: [''] * rows for c in COLUMNS})
+    df['qr_id'] = [f'{q:08X}' for q in qr]
+    df['batch_name'] = [f'批次-{q // 10:05d}' for q in qr]
+    df['stage'] = rng.choice([STAGE_INITIAL] + SCAN_STAGES, rows)
+    df['operator'] = rng.choice(['王小明', '李大華', '陳美玲'], rows)
+    df['timestamp'] = ts.strftime('%Y-%m-%d %H:%M:%S')
+    df['weight_kg'] = np.where(rng.random(rows) < 0.2, '',
+                               (rng.integers(1, 20000, rows) / 10).astype(str))
+    df['recycled_ratio'] = np.where(rng.random(rows) < 0.5, '',
+                                    (rng.integers(0, 1000, rows) / 10).astype(str))
+    df['material_type'] = rng.choice(MATERIAL_TYPE_OPTIONS, rows)
+    df['data_tier'] = rng.choice(DATA_TIER_OPTIONS, rows)
+    df['notes'] = 'QR碼已建立'
+    return df
+
+
+def timed(label, fn, repeat=3):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    print(f'  {label:<40s} {best * 1000:10.1f} ms')
+    return result
+
+
+@bench('snapshot')
+def bench_snapshot(rows):
+    """冷啟動:整檔解析 CSV vs 讀欄式快照 + CSV 尾段。"""
+    from csv_store import CsvTailReader
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'data.csv')
+        snap = os.path.join(tmp, 'data.snapshot.parquet')
+        synthetic_frame(rows).to_csv(csv_path, index=False, encoding='utf-8-sig')
+        CsvTailReader(csv_path, snap).read()
+        print(f'  CSV {os.path.getsize(csv_path) / 1e6:.1f} MB, '
+              f'snapshot {os.path.getsize(snap) / 1e6:.1f} MB')
+        timed('cold load: full CSV parse', lambda: CsvTailReader(csv_path).read())
+        timed('cold load: snapshot + tail', lambda: CsvTailReader(csv_path, snap).read())
+
+
+@bench('append')
+def bench_append(rows, burst=30):
+    """卡車到場:burst 個 thread 同時各送一筆。逐筆 pandas append vs group commit journal。"""
+    import threading
+    from csv_store import AppendJournal, format_record
+
+    records = synthetic_frame(burst).to_dict('records')
+
+    def run_burst(write_one):
+        threads = [threading.Thread(target=write_one, args=(r,)) for r in records]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.csv')
+        synthetic_frame(rows).to_csv(path, index=False, encoding='utf-8-sig')
+        lock = threading.Lock()
+
+        def pandas_append(record):
+            with lock:   # 舊路徑:每筆讀表頭 + 建單列 DataFrame + to_csv(無 fsync)
+                pd.read_csv(path, nrows=0, encoding='utf-8-sig')
+                pd.DataFrame([record], columns=COLUMNS).to_csv(
+                    path, mode='a', header=False, index=False, encoding='utf-8-sig')
+
+        journal = AppendJournal(path)
+        timed(f'{burst} concurrent appends: pandas', lambda: run_burst(pandas_append))
+        timed(f'{burst} concurrent appends: journal+fsync',
+              lambda: run_burst(lambda r: journal.append(format_record(r))))
+        print(f'  journal flushes: {journal.flushes} for {journal.records} records')
+
+
+@bench('sheets')
+def bench_sheets(rows, latency=0.05):
+    """Sheets 路徑的 load / append / save(fake_sheets.FakeClient,每個請求模擬 latency 秒往返)。"""
+    from streamlit.logger import set_log_level
+    from fake_sheets import FakeClient
+    from google_sheets_manager import GoogleSheetsManager
+    from quota import QuotaGuard
+
+    set_log_level('error')
+    rows = min(rows, 100_000)   # 記憶體內的 fake,量大只是拖慢建表
+    client = FakeClient(latency=latency)
+    quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6)   # 只量 API 往返,不量 client 端節流
+    manager = GoogleSheetsManager('bench', quiet=True, client=client, cache_path=None, quota=quota)
+    ws = client.open('bench').worksheet(manager.worksheet_name)
+    df = synthetic_frame(rows)
+    ws.append_rows(df.values.tolist())
+    print(f'  {rows:,} rows, {latency * 1000:.0f} ms per request')
+
+    def counted(label, fn, repeat=1):
+        before = sum(client.requests.values())
+        result = timed(label, fn, repeat=repeat)
+        print(f'  {"":<40s} {sum(client.requests.values()) - before:10d} requests')
+        return result
+
+    counted('load: get_all_records (old)', ws.get_all_records)
+    counted('load: cold (get_values)', lambda: (manager.mirror.reset(), manager.load_data()))
+    counted('load: unchanged (revision check)', manager.load_data)
+    new_rows = synthetic_frame(10, seed=1).values.tolist()
+    ws.append_rows(new_rows)
+    counted('load: +10 rows (incremental)', manager.load_data)
+
+    burst = synthetic_frame(50, seed=2).values.tolist()
+    counted('append 50: append_row x50 (old)', lambda: [ws.append_row(r) for r in burst])
+    counted('append 50: one append_rows', lambda: manager.append_rows(burst))
+
+    edited = manager.load_data().copy()
+    edited.loc[edited.index[:10], 'notes'] = '已修正'
+    counted('save: delta (10 changed rows)', lambda: manager.save_data(edited))
+    counted('save: full rewrite', lambda: manager.save_data(edited, full=True))
+
+
+def _backend_openers(tmp, latency):
+    """後端名稱 -> 開啟函式;同一個名稱每次開啟都指向同一份儲存(第二次開啟即冷啟動)。"""
+    from fake_sheets import FakeClient
+    from quota import QuotaGuard
+    from shard_store import ShardedCsvStore
+    from sqlite_store import SqliteStore
+    from storage_backend import CsvBackend, SheetsBackend
+
+    client = FakeClient(latency=latency)
+
+    def sheets():
+        from google_sheets_manager import GoogleSheetsManager
+        quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6)
+        return SheetsBackend(GoogleSheetsManager('bench', quiet=True, client=client,
+                                                 cache_path=None, quota=quota))
+
+    return {
+        'csv': lambda: CsvBackend(os.path.join(tmp, 'data.csv')),
+        'sqlite': lambda: SqliteStore(os.path.join(tmp, 'data.db')),
+        'sharded': lambda: ShardedCsvStore(os.path.join(tmp, 'shards')),
+        'sheets': sheets,
+    }
+
+
+@bench('backends')
+def bench_backends(rows, latency=0.0):
+    """每個 StorageBackend 跑同一組工作量(與 test_storage_backend.py 的後端清單相同)。
+
+    Sheets 為記憶體內的 FakeClient(預設不模擬延遲、最多 100k 列),量的是 client 端成本。
+    """
+    from streamlit.logger import set_log_level
+
+    set_log_level('error')
+    df = synthetic_frame(rows)
+    records = df.to_dict('records')
+    singles = synthetic_frame(100, seed=1).to_dict('records')
+    qr_ids = df['qr_id'].drop_duplicates().head(50).tolist()
+    batches = df['batch_name'].drop_duplicates().head(50).tolist()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, open_backend in _backend_openers(tmp, latency).items():
+            n = min(rows, 100_000) if name == 'sheets' else rows
+            print(f'  -- {name} ({n:,} rows)')
+            backend = open_backend()
+            timed(f'append_many {n:,}', lambda: backend.append_many(records[:n]), repeat=1)
+            timed('load: cold (new instance)', lambda: open_backend().load(), repeat=1)
+            timed('load: warm', backend.load)
+            cursor = backend.load_since()['cursor']
+            timed('append x100 (one by one)', lambda: [backend.append(r) for r in singles],
+                  repeat=1)
+            timed('load_since after 100 appends', lambda: backend.load_since(cursor), repeat=1)
+            timed('lookup_by_qr x50', lambda: [backend.lookup_by_qr(q) for q in qr_ids])
+            timed('lookup_by_batch x50', lambda: [backend.lookup_by_batch(b) for b in batches])
+            print(f'  stats: {backend.stats()}')
+
+
+@bench('shards')
+def bench_shards(rows):
+    """一年份資料查一個月:單檔 CSV(整檔讀再篩)vs 按月分片(只開重疊的分片),皆為冷啟動。"""
+    from shard_store import ShardedCsvStore
+    from storage_backend import CsvBackend
+
+    df = synthetic_frame(rows)   # timestamp 約涵蓋 2025 整年
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, 'data.csv')
+        shard_dir = os.path.join(tmp, 'data')
+        df.to_csv(csv_path, index=False, encoding='utf-8-sig')
+        ShardedCsvStore(shard_dir).replace_all(df)
+        stats = ShardedCsvStore(shard_dir).stats()
+        print(f'  CSV {os.path.getsize(csv_path) / 1e6:.1f} MB; {stats["shards"]} shards '
+              f'({stats["compressed"]} compressed) {stats["bytes"] / 1e6:.1f} MB')
+        query = ('2025-06-01', '2025-06-30')
+        timed('one month: single CSV', lambda: CsvBackend(csv_path).load_range(*query))
+        timed('one month: monthly shards', lambda: ShardedCsvStore(shard_dir).load_range(*query))
+        timed('full load: single CSV', lambda: CsvBackend(csv_path).load())
+        timed('full load: monthly shards', lambda: ShardedCsvStore(shard_dir).load())
+
+
+@bench('memory')
+def bench_memory(rows):
+    """每列記憶體:object 欄(pandas 2 預設)/ 字串欄(目前 ensure_schema)/ typed 模式。"""
+    from schema import display_frame, ensure_schema
+
+    strings = ensure_schema(synthetic_frame(rows))
+    frames = [('object columns (pandas 2 default)', strings.astype(object)),
+              ('string columns: ensure_schema(df)', strings)]
+    typed = timed('ensure_schema(df, typed=True)', lambda: ensure_schema(strings, typed=True))
+    frames.append(('typed: ensure_schema(df, typed=True)', typed))
+    timed('display_frame(typed)', lambda: display_frame(typed))
+    for label, frame in frames:
+        per_row = frame.memory_usage(deep=True).sum() / len(frame)
+        print(f'  {label:<40s} {per_row:10.0f} bytes/row')
+    print('  typed per column (bytes/row):')
+    for col, size in typed.memory_usage(deep=True, index=False).items():
+        before = strings[col].memory_usage(deep=True, index=False)
+        print(f'    {col:<20s} {before / len(typed):8.1f} -> {size / len(typed):8.1f}')
+
+
+@bench('schema')
+def bench_schema(rows, batches=50):
+    """ensure_schema:未標記 frame(完整正規化)vs 已正規化 frame(快速路徑);
+    compute_mass_balance 逐批次迴圈(以前每次呼叫都重新正規化整份資料)vs 全批次一次算完。"""
+    from schema import SCHEMA_MARK, compute_mass_balance, compute_mass_balance_all, ensure_schema
+
+    strings = ensure_schema(synthetic_frame(rows)).astype(object)
+    strings.attrs[SCHEMA_MARK] = 'str'
+    raw = strings.copy()
+    raw.attrs.clear()
+    timed('ensure_schema(unmarked object frame)', lambda: ensure_schema(raw))
+    timed('ensure_schema(conforming frame)', lambda: ensure_schema(strings))
+    names = list(strings['batch_name'].unique()[:batches])
+    for label, frame in (('unmarked', raw), ('conforming', strings)):
+        timed(f'compute_mass_balance x{len(names)} ({label})',
+              lambda: [compute_mass_balance(frame, name) for name in names])
+    balances = timed('compute_mass_balance_all (all batches)',
+                     lambda: compute_mass_balance_all(strings))
+    print(f'  {len(balances):,} batches')
+
+
+@bench('to_float')
+def bench_to_float(rows):
+    """數值欄轉型:逐格 to_float vs to_float_series(weight_kg 重複值多;另一欄幾乎每格不同)。"""
+    from schema import to_float, to_float_series
+
+    weights = synthetic_frame(rows)['weight_kg']
+    distinct = pd.Series(np.random.default_rng(1).random(rows).astype(str))
+    for label, column in (('weight_kg', weights), ('distinct values', distinct)):
+        timed(f'{label}: map(to_float)', lambda: column.map(to_float), repeat=1)
+        timed(f'{label}: to_float_series', lambda: to_float_series(column))
+
+
+@bench('index')
+def bench_index(rows, lookups=200):
+    """單一 qr_id / batch 查詢:整表布林篩選 vs RecordIndex(建一次後 dict 命中 + iloc)。"""
+    from record_index import RecordIndex
+    from schema import ensure_schema
+
+    df = ensure_schema(synthetic_frame(rows))
+    qrs = df['qr_id'].sample(lookups, random_state=0).tolist()
+    batches = df['batch_name'].sample(lookups, random_state=0).tolist()
+    index = timed('RecordIndex build', lambda: RecordIndex(df), repeat=1)
+    timed(f'qr_id mask x{lookups}', lambda: [df[df['qr_id'] == q] for q in qrs], repeat=1)
+    timed(f'qr_id index x{lookups}', lambda: [df.iloc[index.qr_positions(df, q)] for q in qrs])
+    timed(f'batch mask x{lookups}', lambda: [df[df['batch_name'] == b] for b in batches], repeat=1)
+    timed(f'batch index x{lookups}',
+          lambda: [df.iloc[index.batch_positions(df, b)] for b in batches])
+
+
+@bench('history')
+def bench_history(rows, lookups=50):
+    """掃描頁單點查詢:CSV 冷載入 + 篩選 vs CSV 旁的 qr_id 索引(QrOffsetIndex)。
+
+    資料量從 rows/100 長到 rows,索引查詢的延遲應大致持平。
+    """
+    from csv_store import CsvTailReader
+    from qr_index import QrOffsetIndex
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in (rows // 100, rows // 10, rows):
+            path = os.path.join(tmp, f'data-{n}.csv')
+            df = synthetic_frame(n)
+            df.to_csv(path, index=False, encoding='utf-8-sig')
+            # 最小那一份可能不到 lookups 列:不夠時可重複抽
+            qrs = df['qr_id'].sample(lookups, replace=n < lookups, random_state=0).tolist()
+            print(f'  -- {n:,} rows')
+            index = QrOffsetIndex(path)
+            timed('index build (first refresh)', index.refresh, repeat=1)
+            timed('load + mask x1 (cold)',
+                  lambda: (lambda d: d[d['qr_id'] == qrs[0]])(CsvTailReader(path).read()),
+                  repeat=1)
+            timed(f'get_history x{lookups}', lambda: [index.history(q) for q in qrs])
+
+
+@bench('qrstate')
+def bench_qr_state(rows, widgets=50):
+    """儀表板計數:每次 nunique / 排序整份資料 vs QrStateTable(建一次後 apply / summary)。"""
+    from qr_state import QrStateTable
+    from schema import STAGE_INITIAL, ensure_schema
+
+    df = ensure_schema(synthetic_frame(rows))
+    singles = synthetic_frame(100, seed=1).to_dict('records')
+
+    def widgets_from_log():
+        return (df[df['stage'] == STAGE_INITIAL]['qr_id'].nunique(),
+                df[df['stage'] != STAGE_INITIAL]['qr_id'].nunique(), df['qr_id'].nunique(),
+                df.sort_values('timestamp', ascending=False).head(5))
+
+    table = timed('QrStateTable build', lambda: QrStateTable(df), repeat=1)
+    timed(f'widgets from event log x{widgets}', lambda: [widgets_from_log() for _ in range(widgets)],
+          repeat=1)
+    timed(f'summary + recent x{widgets}',
+          lambda: [(table.summary(), table.recent(5)) for _ in range(widgets)])
+    timed('apply x100', lambda: [table.apply(r) for r in singles], repeat=1)
+
+
+@bench('events')
+def bench_events(rows, tail=1000):
+    """冷啟動時建立衍生狀態(索引、質量平衡、QR 狀態):整份重建 vs 讀快照 + 重播快照後的 tail 筆。"""
+    from event_store import EventStore
+    from schema import ensure_schema
+
+    df = ensure_schema(synthetic_frame(rows))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.state.json')
+        timed('rebuild from full log', lambda: EventStore().sync(df), repeat=1)
+        timed(f'snapshot write (seq {rows - tail:,})',
+              lambda: EventStore(path).sync(df.iloc[:rows - tail]), repeat=1)
+        print(f'  snapshot size: {os.path.getsize(path) / 1e6:.1f} MB')
+        timed(f'restart: snapshot + replay {tail:,}', lambda: EventStore(path).sync(df), repeat=1)
+
+
+@bench('startup')
+def bench_startup(rows, handshake=1.5):
+    """冷啟動到掃描頁第一次渲染完成(AppTest,headless)。
+
+    以 sleep 模擬 Google 認證 + 開試算表的網路往返(handshake 秒,之後連線失敗、改用本地);
+    對照同步連線(舊行為)與背景連線。rows 筆資料先寫進暫存目錄的本地 CSV。
+    """
+    from streamlit.logger import set_log_level
+    from streamlit.testing.v1 import AppTest
+    import data_manager
+    import google_sheets_manager as gsm
+
+    set_log_level('error')
+    app = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app.py')
+    original_setup = gsm.GoogleSheetsManager.setup_credentials
+
+    def slow_setup(self):
+        time.sleep(handshake)
+        return False
+
+    def first_render():
+        data_manager.reset_data_manager()
+        at = AppTest.from_file(app, default_timeout=60)
+        at.query_params['page'] = 'scan'
+        at.query_params['qr_id'] = '00000001'
+        at.run()
+        assert not at.exception, at.exception
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        synthetic_frame(rows).to_csv(os.path.join(tmp, 'plastic_trace_data.csv'),
+                                     index=False, encoding='utf-8-sig')
+        os.chdir(tmp)
+        gsm.GoogleSheetsManager.setup_credentials = slow_setup
+        try:
+            first_render()   # 暖身:import、AppTest 本身的開銷
+            for label, background in (('synchronous Sheets connect', False),
+                                      ('background Sheets connect', True)):
+                gsm.SheetsConnection.background = background
+                timed(f'first render: {label}', first_render, repeat=1)
+        finally:
+            gsm.GoogleSheetsManager.setup_credentials = original_setup
+            gsm.SheetsConnection.background = True
+            data_manager.reset_data_manager()
+            os.chdir(cwd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('names', nargs='*', help=f'可選:{", ".join(BENCHES)}')
+    parser.add_argument('--rows', type=int, default=300_000)
+    args = parser.parse_args()
+    for name in args.names or BENCHES:
+        print(f'[{name}] rows={args.rows:,}')
+        BENCHES[name](args.rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,76 +1,321 @@
 """
 統一的資料管理器
-自動選擇使用 Google Sheets 或本地 CSV，提供無縫的資料存取
+自動選擇使用 Google Sheets 或本地儲存(CSV / SQLite)，提供無縫的資料存取
 """
 
 import pandas as pd
 import os
+import threading
+import time
 import streamlit as st
-from google_sheets_manager import get_sheets_manager, is_sheets_available
-from schema import COLUMNS, ensure_schema, empty_frame
+from google_sheets_manager import get_sheets_connection, reset_sheets_connection
+from schema import COLUMNS, copy_on_write, ensure_schema, empty_frame, to_cell
+from csv_store import CsvTailReader, AppendJournal
+from sqlite_store import SqliteStore
+from shard_store import ShardedCsvStore
+from storage_backend import CsvBackend, filter_date_range, snapshot_path
+from sheets_outbox import SheetsOutbox
+from sheets_sync import reconcile
+from event_store import EventStore, state_snapshot_path
+from qr_index import QrOffsetIndex, qr_index_path
+
+# ─── 跨 session 共用的 load_data 快取 ─────────────────────────────
+# 每次 rerun 各頁面 + 狀態列會呼叫 load_data() 七次以上;同一 process 的所有 session
+# 共用這份快取,以「資料版本」為 key:本 process 的寫入 revision + CSV (mtime, size);
+# Sheets 另加 SHEETS_CACHE_TTL 秒的時間桶,讓其他 replica 的寫入最晚一個 TTL 後可見。
+SHEETS_CACHE_TTL = 30
+_cache_lock = threading.Lock()
+_frame_cache = {}   # storage key -> (version, frame)
+_revisions = {}     # storage key -> 本 process 寫入次數
+_tail_readers = {}  # CSV 絕對路徑 -> CsvTailReader(增量讀取狀態同樣跨 session 共用)
+_journals = {}      # CSV 絕對路徑 -> AppendJournal(同一檔所有 session 的 append 一起 group commit)
+_outboxes = {}      # outbox 絕對路徑 -> SheetsOutbox(每個 process 一條背景送出 thread)
+_shard_stores = {}  # 分片目錄絕對路徑 -> ShardedCsvStore(各分片的增量讀取 / journal 共用)
+_event_stores = {}  # storage key -> EventStore(事件序號 + 索引 / 質量平衡 / QR 狀態投影與快照)
+_qr_indexes = {}    # CSV 絕對路徑 -> QrOffsetIndex(CSV 旁的 qr_id → byte 範圍索引)
+
+
+def _hand_out(frame):
+    """交給 caller 的快取 frame:Copy-on-Write 下淺拷貝即可(caller 改欄/改值不會污染
+    共用快取);pandas 2.x 沒開 Copy-on-Write 時給深拷貝。不改全域 pandas 設定。"""
+    return frame.copy(deep=not copy_on_write())
+
+
+def _get_tail_reader(path):
+    path = os.path.abspath(path)
+    with _cache_lock:
+        reader = _tail_readers.get(path)
+        if reader is None:
+            reader = _tail_readers[path] = CsvTailReader(path, snapshot_path(path))
+        return reader
+
+
+def _get_journal(path):
+    path = os.path.abspath(path)
+    with _cache_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = _journals[path] = AppendJournal(path)
+        return journal
+
+
+def _get_qr_index(path):
+    path = os.path.abspath(path)
+    with _cache_lock:
+        index = _qr_indexes.get(path)
+        if index is None:
+            index = _qr_indexes[path] = QrOffsetIndex(path)
+        return index
+
+
+def _get_outbox(path):
+    path = os.path.abspath(path)
+    with _cache_lock:
+        outbox = _outboxes.get(path)
+        if outbox is None:
+            outbox = _outboxes[path] = SheetsOutbox(path)
+        return outbox
+
+
+def _get_shard_store(directory):
+    directory = os.path.abspath(directory)
+    with _cache_lock:
+        store = _shard_stores.get(directory)
+        if store is None:
+            store = _shard_stores[directory] = ShardedCsvStore(directory)
+        return store
+
+
+def _local_backend_setting():
+    """本地儲存種類 'csv' / 'sqlite' / 'sharded'(按月分片 CSV)。
+
+    來源優先序:st.secrets[storage][backend] > 環境變數 APP_STORAGE_BACKEND > 'csv'。
+    """
+    try:
+        value = st.secrets["storage"]["backend"] if "storage" in st.secrets else ''
+    except Exception:
+        value = ''
+    value = str(value or os.getenv("APP_STORAGE_BACKEND", "")).strip().lower()
+    return value if value in ('csv', 'sqlite', 'sharded') else 'csv'
+
 
 class DataManager:
     def __init__(self):
         self.csv_file = "plastic_trace_data.csv"
+        self.db_file = "plastic_trace_data.db"
+        self.shard_dir = "data"
+        self.outbox_file = "sheets_outbox.jsonl"
+        self.local_backend = _local_backend_setting()
+        self.sqlite_store = None
+        self.shard_store = None
         self.use_sheets = False
         self.sheets_manager = None
+        self.sheets_conn = None
+        self.outbox = None
         self.initialize()
     
     def initialize(self):
         """初始化資料管理器"""
-        # 嘗試使用 Google Sheets
+        if self.local_backend == 'sqlite':
+            try:
+                self.sqlite_store = SqliteStore(self.db_file)
+                # 第一次切到 SQLite:把既有 CSV 一次性匯入(資料庫非空則不動)
+                migrated = self.sqlite_store.migrate_from_csv(self.csv_file)
+                if migrated:
+                    st.sidebar.info(f"🗄️ 已從本地 CSV 匯入 {migrated} 筆到 SQLite")
+            except Exception as e:
+                st.sidebar.warning(f"⚠️ SQLite 無法開啟，改用本地 CSV: {str(e)}")
+                self.local_backend = 'csv'
+                self.sqlite_store = None
+        elif self.local_backend == 'sharded':
+            try:
+                self.shard_store = _get_shard_store(self.shard_dir)
+                # 第一次切到分片:把既有單檔 CSV 依月份拆開(已有分片則不動)
+                migrated = self.shard_store.migrate_from_csv(self.csv_file)
+                if migrated:
+                    st.sidebar.info(f"🗂️ 已從本地 CSV 依月份拆分 {migrated} 筆到 {self.shard_dir}/")
+            except Exception as e:
+                st.sidebar.warning(f"⚠️ 分片目錄無法開啟，改用本地 CSV: {str(e)}")
+                self.local_backend = 'csv'
+                self.shard_store = None
+
+        # Google Sheets 在背景連線(所有 session 共用一份),不擋第一次渲染:
+        # 連上前先用本地儲存,期間的新增列照樣排進 outbox,連上後補送
         try:
-            self.sheets_manager = get_sheets_manager()
-            self.use_sheets = is_sheets_available()
-            
-            if self.use_sheets:
-                st.sidebar.success("🌐 使用 Google Sheets 存儲")
-                # 顯示 Google Sheets 連結
-                if hasattr(self.sheets_manager, 'get_sheet_url'):
-                    sheet_url = self.sheets_manager.get_sheet_url()
-                    if sheet_url:
-                        st.sidebar.markdown(f"📊 [查看資料表]({sheet_url})")
-            else:
-                st.sidebar.info("💾 使用本地 CSV 存儲")
-                
+            self.sheets_conn = get_sheets_connection()
+            self.outbox = _get_outbox(self.outbox_file)
+            self._poll_sheets()
+            if self.sheets_conn is not None and not self.use_sheets:
+                st.sidebar.info(f"💾 使用{self._local_label()}存儲(Google Sheets 連線中…)")
         except Exception as e:
             st.sidebar.warning(f"⚠️ Google Sheets 不可用，使用本地存儲: {str(e)}")
+            self.sheets_conn = None
             self.use_sheets = False
+
+    def _poll_sheets(self):
+        """背景連線有結果了就接手:成功切到 Sheets,失敗則維持本地儲存。
+
+        在 script thread 呼叫,連線過程的訊息在這裡才顯示(背景 thread 不能呼叫 st.*)。
+        """
+        conn = self.sheets_conn
+        if self.use_sheets or conn is None or conn.state == 'pending':
+            return
+        for level, text in conn.take_messages():
+            getattr(st.sidebar, level)(text)
+        if not conn.ready:
+            st.sidebar.info(f"💾 使用{self._local_label()}存儲")
+            self.sheets_conn = None
+            return
+        self.sheets_manager = conn.manager
+        self.use_sheets = True
+        self._start_outbox()
+        self._invalidate_cache()
+        st.sidebar.success("🌐 使用 Google Sheets 存儲")
+        # 顯示 Google Sheets 連結
+        sheet_url = self.sheets_manager.get_sheet_url()
+        if sheet_url:
+            st.sidebar.markdown(f"📊 [查看資料表]({sheet_url})")
+
+    def _sheets_expected(self):
+        """Sheets 已連上或仍在連線中:新增列要排進 outbox。"""
+        return self.use_sheets or self.sheets_conn is not None
     
-    def load_data(self):
-        """載入資料。所有 return 出口都過 ensure_schema(),保證舊資料補齊新欄、
+    def _start_outbox(self):
+        """Sheets 寫入改走磁碟 outbox + 背景 thread;重新初始化時換成新的 manager。"""
+        self.outbox = _get_outbox(self.outbox_file)
+        self.outbox.send = self.sheets_manager.append_rows
+        self.outbox.on_sent = self._invalidate_cache
+        self.outbox.start()
+
+    def _local_label(self):
+        if self.sqlite_store:
+            return "本地 SQLite "
+        return "本地分片 CSV " if self.shard_store else "本地 CSV "
+
+    def _local_key(self):
+        if self.sqlite_store:
+            return ('sqlite', os.path.abspath(self.db_file))
+        if self.shard_store:
+            return ('sharded', os.path.abspath(self.shard_dir))
+        return ('csv', os.path.abspath(self.csv_file))
+
+    def _storage_key(self):
+        if self.use_sheets and self.sheets_manager:
+            return ('sheets', self.sheets_manager.spreadsheet_name)
+        return self._local_key()
+
+    def _data_version(self, key):
+        """目前資料版本;與快取內版本不同即視為失效。"""
+        revision = _revisions.get(key, 0)
+        if key[0] == 'sheets':
+            return (revision, int(time.time() // SHEETS_CACHE_TTL))
+        if key[0] == 'sqlite':
+            return (revision, self.sqlite_store.version())
+        if key[0] == 'sharded':
+            return (revision, self.shard_store.version())
+        try:
+            st_ = os.stat(self.csv_file)
+            return (revision, st_.st_mtime_ns, st_.st_size)
+        except OSError:
+            return (revision, None)
+
+    def _invalidate_cache(self):
+        """寫入後呼叫:bump revision,讓所有 session 下次 load_data 重讀。"""
+        with _cache_lock:
+            for key in {self._storage_key(), self._local_key()}:
+                _revisions[key] = _revisions.get(key, 0) + 1
+                _frame_cache.pop(key, None)
+
+    def load_data(self, typed=False):
+        """載入資料(經跨 session 快取,同一資料版本只讀一次儲存層)。
+
+        回傳的是快取 frame 的拷貝(Copy-on-Write 下為淺拷貝):caller 改欄/改值都不會
+        污染共用快取。typed=True 回傳型別化 frame(ensure_schema(typed=True)):由快取的
+        字串 frame 當場轉換、不另外快取,同一份資料不在記憶體裡存兩份;顯示前以
+        schema.display_frame 還原成字串。
+        """
+        if typed:
+            return ensure_schema(self._cached_frame(), typed=True)   # 轉換本身產生新 frame
+        return _hand_out(self._cached_frame())
+
+    def _cached_frame(self):
+        """跨 session 共用的快取 frame 本身(不拷貝):只給本模組內唯讀的呼叫端
+        (投影 sync、iloc 依位置取列本來就產生新 frame),對外一律經 load_data() 拿拷貝。"""
+        self._poll_sheets()
+        key = self._storage_key()
+        # 先取版本再讀:讀取期間若有寫入,下次呼叫版本不符會再讀一次,不會漏
+        version = self._data_version(key)
+        with _cache_lock:
+            hit = _frame_cache.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+
+        df = self._load_uncached()
+        with _cache_lock:
+            _frame_cache[key] = (version, df)
+        return df
+
+    def _load_uncached(self):
+        """實際讀儲存層。所有 return 出口都過 ensure_schema(),保證舊資料補齊新欄、
         欄位順序一致(修 review C2:避免某條路徑漏接 migration → KeyError)。"""
         try:
             if self.use_sheets and self.sheets_manager:
                 # 從 Google Sheets 載入
                 df = self.sheets_manager.load_data()
                 if not df.empty:
-                    return ensure_schema(df)
+                    return self._with_pending(ensure_schema(df))
                 else:
-                    # 如果 Google Sheets 為空，嘗試從本地 CSV 載入並同步
-                    if os.path.exists(self.csv_file):
-                        df_csv = ensure_schema(pd.read_csv(self.csv_file, encoding='utf-8-sig'))
-                        if not df_csv.empty:
-                            st.info("📤 正在將本地資料同步到 Google Sheets...")
-                            self.sheets_manager.save_data(df_csv)
-                            return df_csv
-
-            # 使用本地 CSV
-            return self._load_csv()
+                    # 如果 Google Sheets 為空，嘗試從本地儲存載入並同步(對帳後只補缺的列)
+                    df_local = self._load_local()
+                    if not df_local.empty:
+                        st.info("📤 正在將本地資料同步到 Google Sheets...")
+                        self._reconcile_to_sheets(df_local)
+                        return df_local
+
+            # 使用本地儲存
+            return self._load_local()
 
         except Exception as e:
             st.warning(f"⚠️ 載入資料時發生錯誤，使用本地備份: {str(e)}")
-            return self._load_csv()
+            return self._load_local()
     
-    def save_data(self, df):
-        """儲存資料"""
+    def _reconcile_to_sheets(self, df_local):
+        """雜湊對帳後只把 Sheets 缺的列一次 append_rows 補上;回傳對帳結果(見 sheets_sync)。
+
+        outbox 中尚未送出的列視同已在 Sheets:先讀 outbox 再讀 Sheets,送出途中的列
+        兩邊都看得到也不會被補送第二次。試算表沒有標準表頭(全空或舊欄位表)時無法
+        逐列對帳,退回 save_data(寫表頭 + 差異寫入),回傳 None。
+        """
+        pending = self.outbox.pending_rows() if self.outbox else []
+        remote = self.sheets_manager.fetch_data()
+        if not self.sheets_manager.has_standard_header():
+            self.sheets_manager.save_data(df_local)
+            return None
+        if pending:
+            remote = pd.concat([remote, pd.DataFrame(pending, columns=COLUMNS)], ignore_index=True)
+        plan = reconcile(df_local, remote)
+        if not plan['to_append'].empty:
+            self.sheets_manager.append_rows(plan['to_append'].astype(str).values.tolist())
+        return plan
+
+    def _with_pending(self, df):
+        """Sheets 資料 + outbox 中尚未送出的列:剛登錄的列在送達 Sheets 前也查得到。"""
+        pending = self.outbox.pending_rows() if self.outbox else []
+        if not pending:
+            return df
+        return ensure_schema(pd.concat([df, pd.DataFrame(pending, columns=COLUMNS)],
+                                       ignore_index=True))
+
+    def save_data(self, df, full=False):
+        """儲存資料(Sheets 預設只送變動的列;full=True 整表重寫)"""
+        self._poll_sheets()
         try:
             # 總是先儲存到本地作為備份
-            self._save_csv(df)
+            self._save_local(df)
             
             # 如果可用，也儲存到 Google Sheets
             if self.use_sheets and self.sheets_manager:
-                success = self.sheets_manager.save_data(df)
+                success = self.sheets_manager.save_data(df, full=full)
                 if success:
                     return True
                 else:
@@ -81,6 +326,9 @@ class DataManager:
         except Exception as e:
             st.error(f"❌ 儲存資料失敗: {str(e)}")
             return False
+        finally:
+            self._invalidate_cache()
+            self._reset_event_stores()
     
     def append_record(self, record_dict):
         """新增單筆記錄——以「單列 append」而非「load 整表→覆寫」寫入。
@@ -88,47 +336,157 @@ class DataManager:
         修 review A1(P0 critical):整表覆寫在多人同時掃碼時會後寫覆蓋前寫、掉資料,
         且每筆 O(n)。改用單列 append:Sheets 走 worksheet.append_row(原子)、本地 CSV
         走檔尾 append,兩者都不重寫既有列。試辦多方手機並行掃碼的常態下不再掉資料。
+
+        Sheets 那一側不在這裡等 API:列寫進磁碟 outbox(fsync)就返回,由背景 thread
+        合併送出、失敗退避重試,配額錯誤不再讓列永遠到不了 Sheets。
         """
+        self._poll_sheets()
         # 只取 schema 內欄位、補齊缺欄,順序固定
         record = {col: record_dict.get(col, '') for col in COLUMNS}
         ok = True
-        # 1) 本地 CSV 備份(單列 append)
+        # 1) 本地備份(CSV 檔尾 append / SQLite 單列 INSERT)
         try:
-            self._append_csv(record)
+            self._append_local(record)
         except Exception as e:
             st.error(f"❌ 寫入本地備份失敗: {str(e)}")
             ok = False
-        # 2) Google Sheets 單列 append
-        if self.use_sheets and self.sheets_manager:
+        # 2) Google Sheets:排入 outbox,背景送出(連線中也先排隊,連上後補送)
+        if self._sheets_expected() and self.outbox:
             try:
-                if not self.sheets_manager.append_record(record):
-                    st.warning("⚠️ Google Sheets 寫入失敗，已存本地備份")
+                self.outbox.enqueue([[to_cell(record[col]) for col in COLUMNS]])
             except Exception as e:
-                st.warning(f"⚠️ Google Sheets 寫入失敗，已存本地備份: {str(e)}")
+                st.warning(f"⚠️ Google Sheets 佇列寫入失敗，已存本地備份: {str(e)}")
+        # 兩邊都寫完才失效,避免中間有 load 把「Sheets 尚無此列」的版本快取起來
+        self._invalidate_cache()
+        if ok:
+            self._apply_to_event_stores(record)
         return ok
 
-    def _append_csv(self, record):
-        """把單列 append 到本地 CSV。若既有檔仍是舊欄位,先一次性 migration 補欄重寫。"""
-        row_df = pd.DataFrame([record], columns=COLUMNS)
-        if not os.path.exists(self.csv_file):
-            row_df.to_csv(self.csv_file, header=True, index=False, encoding='utf-8-sig')
-            return
-        existing_cols = pd.read_csv(self.csv_file, nrows=0, encoding='utf-8-sig').columns.tolist()
-        if existing_cols != COLUMNS:
-            # 舊檔欄位不符 → 一次性補欄重寫後再含新列
-            migrated = ensure_schema(pd.read_csv(self.csv_file, encoding='utf-8-sig'))
-            pd.concat([migrated, row_df], ignore_index=True).to_csv(
-                self.csv_file, header=True, index=False, encoding='utf-8-sig')
-        else:
-            row_df.to_csv(self.csv_file, mode='a', header=False, index=False, encoding='utf-8-sig')
-    
+    # ─── 事件記錄的衍生狀態(見 event_store) ──────────────────────────
+    def _event_store(self):
+        """目前儲存的 EventStore(跨 session 共用);本地儲存的快照存在資料旁,Sheets 只在記憶體。"""
+        key = self._storage_key()
+        with _cache_lock:
+            store = _event_stores.get(key)
+            if store is None:
+                path = None if key[0] == 'sheets' else state_snapshot_path(key[1])
+                store = _event_stores[key] = EventStore(path)
+        return store
+
+    def _projections(self, df=None):
+        """與目前資料(df 預設為共用快取 frame,不拷貝)對齊後的 EventStore:快照之後的
+        事件才重播。"""
+        store = self._event_store()
+        store.sync(self._cached_frame() if df is None else df)
+        return store
+
+    def _apply_to_event_stores(self, record):
+        """新增一筆:已建立的 EventStore 各投影 O(1) 更新;下次查詢時 sync 會驗證。"""
+        with _cache_lock:
+            stores = [_event_stores.get(key) for key in {self._storage_key(), self._local_key()}]
+        for store in stores:
+            if store is not None:
+                store.apply(record)
+
+    def _reset_event_stores(self):
+        """整表改寫後丟掉投影與快照檔,下次查詢時重建。"""
+        with _cache_lock:
+            stores = [_event_stores.pop(key, None) for key in {self._storage_key(), self._local_key()}]
+        for store in stores:
+            if store is not None:
+                store.reset()
+
+    def get_mass_balance(self, batch):
+        """某批次的質量平衡(同 schema.compute_mass_balance),讀物化檢視。"""
+        return self._projections().balance.get(batch)
+
+    def list_mass_balances(self):
+        """所有批次的質量平衡(依批次首次出現順序),讀物化檢視。"""
+        return list(self._projections().balance.all().values())
+
+    def _local_store(self):
+        """本地儲存的 StorageBackend:SQLite、月分片 CSV,或共用 tail reader / journal 的單檔 CSV。"""
+        if self.sqlite_store:
+            return self.sqlite_store
+        if self.shard_store:
+            return self.shard_store
+        return CsvBackend(self.csv_file, _get_tail_reader(self.csv_file),
+                          _get_journal(self.csv_file), _get_qr_index(self.csv_file))
+
+    def _append_local(self, record):
+        """CSV(或當月分片)檔尾 append(group commit,返回時已落盤)/ SQLite 單列 INSERT。"""
+        self._local_store().append(record)
+
+    def _load_local(self):
+        if not (self.sqlite_store or self.shard_store):
+            return self._load_csv()
+        try:
+            return self._local_store().load()
+        except Exception as e:
+            st.error(f"❌ 讀取{self._local_label()}失敗: {str(e)}")
+            return empty_frame()
+
+    def _save_local(self, df):
+        if not (self.sqlite_store or self.shard_store):
+            return self._save_csv(df)
+        try:
+            self._local_store().replace_all(df)
+            return True
+        except Exception as e:
+            st.error(f"❌ 儲存{self._local_label()}失敗: {str(e)}")
+            return False
+
+    def load_range(self, start, end):
+        """timestamp 日期落在 [start, end](含)的列。本地分片為主儲存時只讀重疊月份的分片。"""
+        self._poll_sheets()
+        if self.shard_store and not self.use_sheets:
+            return self.shard_store.load_range(start, end)
+        return filter_date_range(self.load_data(), start, end)
+
+    def get_qr_history(self, qr_id):
+        """某 qr_id 的全部列(依寫入順序)。
+
+        本地儲存為主時走儲存層的 get_history(SQLite qr_id 索引 / CSV 旁的 byte 範圍索引),
+        只讀這個 QR 的列、不載入整份資料。Sheets 為主時以 Sheets 資料(含 outbox 待送列,
+        見 _with_pending)的 RecordIndex 回答:本地備份可能只有本 deployment 寫過的幾列
+        (容器重建、其他 replica 寫入),不能拿來當 QR 的完整歷程。
+        """
+        self._poll_sheets()
+        if not (self.use_sheets and self.sheets_manager):
+            return self._local_store().get_history(qr_id)
+        df = self._cached_frame()
+        return df.iloc[self._projections(df).index.qr_positions(df, qr_id)]
+
+    def get_qr_batch(self, qr_id):
+        """qr_id 所屬批次(該 QR 第一筆記錄的 batch_name);不存在回 None。
+        查詢路徑同 get_qr_history。"""
+        self._poll_sheets()
+        if not (self.use_sheets and self.sheets_manager):
+            rows = self._local_store().get_history(qr_id)
+            return rows['batch_name'].iloc[0] if len(rows) else None
+        df = self._cached_frame()
+        return self._projections(df).index.batch_of(df, qr_id)
+
+    # ─── 每個 qr_id 的目前狀態(儀表板用,見 qr_state) ─────────────────
+    def get_qr_state_summary(self):
+        """{'records', 'qrs', 'created', 'active', 'idle', 'by_stage'}:儀表板的計數,常數時間。"""
+        return self._projections().qr_state.summary()
+
+    def list_recent_events(self, n=5):
+        """時間最新的 n 筆事件(新到舊),給「最近活動」。"""
+        return self._projections().qr_state.recent(n)
+
     def _load_csv(self):
-        """從本地 CSV 載入資料(出口統一過 ensure_schema)"""
+        """從本地 CSV 載入資料(出口統一過 ensure_schema)。
+
+        經 CsvTailReader 增量讀取:append 之後只解析新增的列,成本與新列數成正比;
+        冷啟動則讀欄式快照 + 快照之後的 CSV 尾段。
+        """
         if not os.path.exists(self.csv_file):
             return empty_frame()
 
         try:
-            return ensure_schema(pd.read_csv(self.csv_file, encoding='utf-8-sig'))
+            return self._local_store().load()
         except Exception as e:
             st.error(f"❌ 讀取本地 CSV 失敗: {str(e)}")
             return empty_frame()
@@ -136,7 +494,14 @@ class DataManager:
     def _save_csv(self, df):
         """儲存到本地 CSV(整表;統一過 ensure_schema 保證 16 欄)"""
         try:
-            ensure_schema(df).to_csv(self.csv_file, index=False, encoding='utf-8-sig')
+            with _get_journal(self.csv_file).exclusive():
+                ensure_schema(df, copy=False).to_csv(self.csv_file, index=False, encoding='utf-8-sig')
+            _get_tail_reader(self.csv_file).reset()
+            if os.path.exists(qr_index_path(self.csv_file)):
+                _get_qr_index(self.csv_file).reset()
+            # 整表重寫後舊快照必然過期(讀取端也會驗證,這裡直接刪省一次比對)
+            if os.path.exists(snapshot_path(self.csv_file)):
+                os.remove(snapshot_path(self.csv_file))
             return True
         except Exception as e:
             st.error(f"❌ 儲存本地 CSV 失敗: {str(e)}")
@@ -144,33 +509,54 @@ class DataManager:
     
     def get_storage_info(self):
         """獲取存儲資訊"""
+        self._poll_sheets()
         info = {
-            "storage_type": "Google Sheets" if self.use_sheets else "本地 CSV",
-            "backup_available": os.path.exists(self.csv_file),
-            "sheets_available": self.use_sheets
+            "storage_type": "Google Sheets" if self.use_sheets else self._local_label().strip(),
+            "backup_available": os.path.exists(
+                self.db_file if self.sqlite_store else self.shard_dir if self.shard_store
+                else self.csv_file),
+            "sheets_available": self.use_sheets,
+            "sheets_connecting": not self.use_sheets and self.sheets_conn is not None,
         }
         
         if self.use_sheets and self.sheets_manager:
             info["sheet_url"] = self.sheets_manager.get_sheet_url()
+            info["sheets_metrics"] = self.sheets_manager.get_call_metrics()
+        if self.outbox and self._sheets_expected():
+            info["outbox"] = self.outbox.stats()
         
         return info
     
+    def flush_outbox(self):
+        """取消退避,讓背景 thread 立刻重送 outbox。"""
+        if self.outbox:
+            self.outbox.retry_now()
+
     def sync_to_sheets(self):
-        """手動同步本地資料到 Google Sheets"""
+        """手動同步本地資料到 Google Sheets(雜湊對帳,只補缺的列)"""
+        self._poll_sheets()
         if not self.use_sheets:
             st.error("❌ Google Sheets 不可用")
             return False
         
         try:
-            df = self._load_csv()
+            df = self._load_local()
             if not df.empty:
-                success = self.sheets_manager.save_data(df)
-                if success:
+                # 雜湊對帳:只補 Sheets 缺的列,不清表、不重寫既有列
+                try:
+                    plan = self._reconcile_to_sheets(df)
+                finally:
+                    self._invalidate_cache()
+                if plan is None:
                     st.success("✅ 資料已成功同步到 Google Sheets")
                     return True
-                else:
-                    st.error("❌ 同步到 Google Sheets 失敗")
-                    return False
+                st.success(f"✅ 對帳完成：補上 {len(plan['to_append'])} 筆到 Google Sheets，"
+                           f"{plan['matched']} 筆兩邊一致")
+                missing = plan['missing_local']
+                if not missing.empty:
+                    st.warning(f"⚠️ Google Sheets 有 {len(missing)} 筆本地沒有的記錄(未自動寫回本地)")
+                    st.dataframe(missing, hide_index=True)
+                return True
             else:
                 st.info("ℹ️ 沒有本地資料需要同步")
                 return True
@@ -189,11 +575,17 @@ def get_data_manager():
         data_manager = DataManager()
     return data_manager
 
+def reset_data_manager():
+    """重新初始化:丟掉共用的 Sheets 連線與資料管理器,下次取用時重建"""
+    global data_manager
+    reset_sheets_connection()
+    data_manager = None
+
 # 相容性函數（保持與原有程式碼的相容性）
 def load_data():
     """載入資料 - 相容性函數"""
     return get_data_manager().load_data()
 
-def save_data(df):
+def save_data(df, full=False):
     """儲存資料 - 相容性函數"""
-    return get_data_manager().save_data(df)
+    return get_data_manager().save_data(df, full=full)
@@ -0,0 +1,121 @@
+"""
+事件儲存:序號 + 衍生狀態的定期快照(不 import streamlit,方便 headless 單元測試)。
+
+資料模型本來就是只 append 的事件記錄:每個階段事件一列,由 append_record 寫入;
+只有 save_data(含管理頁「清空所有資料」)會整表改寫。這裡把它正式化:
+- 序號:事件依寫入順序編號,第 n 筆的 seq 為 n(SQLite 的 seq 欄、CSV 的列位置都
+  依此遞增)。EventStore.seq 是已套用的最後一個事件的序號。
+- 投影:由事件推導、隨新增事件增量更新的狀態(projection.Projection 的子類),共同介面為
+  apply(record) / sync(df, fold_limit) / rebuild(df) / to_snapshot() / restore(data):
+      index     record_index.RecordIndex   qr_id / batch_name → 列位置
+      balance   balance_view.BatchBalanceView  每批次質量平衡
+      qr_state  qr_state.QrStateTable      每個 qr_id 目前狀態
+- 快照:第一次建立、距上次快照累積 SNAPSHOT_EVERY 個事件、或某個投影剛整份重建後,把所有投影
+  寫成資料旁的一個 JSON(plastic_trace_data.state.json;分片目錄為 data/state.json)。
+  啟動時讀回,sync(df) 時各投影以自己記得的 (列數, 最後一列) 驗證快照仍是這份記錄的
+  前綴,只重播快照之後的事件;記錄被改寫過就照常整份重建。
+
+整表改寫後呼叫 reset():丟掉投影與快照檔,下次 sync 時重建。
+"""
+
+import json
+import os
+import threading
+
+from balance_view import BatchBalanceView
+from qr_state import QrStateTable
+from record_index import RecordIndex
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_EVERY = 5000   # 累積這麼多個新事件才重寫快照(整份重建後一定寫)
+REPLAY_LIMIT = 2 * SNAPSHOT_EVERY   # 快照之後的事件在這個數以內就逐筆重播,超過才整份重建
+
+
+def state_snapshot_path(data_path):
+    """資料檔 / 目錄旁的快照檔:plastic_trace_data.csv → plastic_trace_data.state.json;
+    分片目錄 data → data/state.json。"""
+    if os.path.isdir(data_path):
+        return os.path.join(data_path, 'state.json')
+    return os.path.splitext(os.path.abspath(data_path))[0] + '.state.json'
+
+
+class EventStore:
+    """thread-safe;同一儲存在 process 內共用一個即可。path 為 None 時不寫快照(例如 Sheets)。"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._clear()
+        self._read()
+
+    def _clear(self):
+        self.index = RecordIndex()
+        self.balance = BatchBalanceView()
+        self.qr_state = QrStateTable()
+        self.seq = 0            # 已套用的最後一個事件序號
+        self.snapshot_seq = 0   # 最近一次快照時的序號
+        self._saved = False     # 是否已有對應目前記錄的快照(讀回或寫過)
+
+    @property
+    def projections(self):
+        return {'index': self.index, 'balance': self.balance, 'qr_state': self.qr_state}
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def apply(self, record):
+        """新增一個事件(append_record 成功後呼叫):所有投影 O(1) 更新,seq +1。"""
+        with self._lock:
+            for projection in self.projections.values():
+                projection.apply(record)
+            self.seq += 1
+
+    def sync(self, df):
+        """與整份事件記錄 df(寫入順序)對齊,回傳 {投影名稱: 'current' / 'folded' / 'rebuilt'}。
+        還沒有快照、有投影整份重建過,或距上次快照已累積 SNAPSHOT_EVERY 個事件就寫快照。"""
+        with self._lock:
+            limit = REPLAY_LIMIT if self._saved else 0   # 沒有快照可接:直接向量化重建
+            statuses = {name: projection.sync(df, fold_limit=limit)
+                        for name, projection in self.projections.items()}
+            self.seq = len(df)
+            if (not self._saved or 'rebuilt' in statuses.values()
+                    or abs(self.seq - self.snapshot_seq) >= SNAPSHOT_EVERY):
+                self.snapshot()
+            return statuses
+
+    def reset(self):
+        """整表改寫後呼叫:丟掉投影與快照檔,下次 sync 重建。"""
+        with self._lock:
+            self._clear()
+            if self.path and os.path.exists(self.path):
+                os.remove(self.path)
+
+    # ─── 快照 ────────────────────────────────────────────────────
+    def snapshot(self):
+        """把所有投影寫進快照檔。先寫暫存檔再 os.replace,其他 process 不會讀到半份。"""
+        with self._lock:
+            self.snapshot_seq, self._saved = self.seq, True
+            if not self.path:
+                return
+            data = {'format': SNAPSHOT_FORMAT, 'seq': self.seq,
+                    'projections': {name: projection.to_snapshot()
+                                    for name, projection in self.projections.items()}}
+        tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':'))   # 比 json.dump 逐段寫檔快數倍
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+    def _read(self):
+        """讀回快照;不存在、格式不符或損毀就從空投影開始(下次 sync 重建)。"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('format') != SNAPSHOT_FORMAT:
+                return
+            for name, projection in self.projections.items():
+                projection.restore(data['projections'][name])
+            self.seq = self.snapshot_seq = data['seq']
+            self._saved = True
+        except (OSError, ValueError, KeyError, TypeError):
+            self._clear()
@@ -0,0 +1,291 @@
+"""
+記憶體內的 Google Sheets 替身(不 import streamlit;不需網路 / Google 帳號)。
+
+實作 GoogleSheetsManager 與 SheetsMirror 用到的 gspread 子集:
+    FakeClient.open / create
+    FakeSpreadsheet.worksheet / add_worksheet / get_lastUpdateTime / id / url
+    FakeWorksheet.append_row(s) / get_all_records / get_values / batch_get / update /
+                  batch_update / resize / clear / acell / row_count / col_count / id / title
+
+行為盡量貼近真的 Sheets:有格線(row_count),讀寫超出格線回 400;append 會剛好
+長到需要的列數;讀取去掉尾端空列、空格;找不到試算表 / 工作表丟 gspread 的例外。
+另可設定每次 API 呼叫的人工延遲與配額(每分鐘請求數,超過丟 429 APIError),
+供離線 benchmark 與測試:GoogleSheetsManager(client=FakeClient(...))。
+"""
+
+import collections
+import datetime
+import itertools
+import json
+import random
+import threading
+import time
+
+from gspread.cell import Cell
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+from gspread.utils import a1_range_to_grid_range, a1_to_rowcol, numericise_all
+
+
+class _Response:
+    """給 gspread APIError 用的最小 response(它會呼叫 .json()['error'])。"""
+
+    def __init__(self, code, message, status):
+        self.status_code = code
+        self._error = {'code': code, 'message': message, 'status': status}
+        self.text = json.dumps({'error': self._error})
+
+    def json(self):
+        return {'error': self._error}
+
+
+def api_error(code, message, status):
+    return APIError(_Response(code, message, status))
+
+
+class FakeClient:
+    """gspread.Client 替身。
+
+    latency:每次 API 呼叫的人工延遲(秒);jitter 為額外的隨機延遲上限。
+    quota_per_minute:整個 client 每 60 秒最多幾個請求,超過丟 429(None = 不限)。
+    error_rate:每個請求以此機率隨機丟 429(seed 固定可重現)。
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, quota_per_minute=None, error_rate=0.0,
+                 seed=0, clock=time.monotonic, sleep=time.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.requests = collections.Counter()   # 方法名 -> 請求次數(含被拒的)
+        self.rejected = 0
+        self._rng = random.Random(seed)
+        self._clock = clock
+        self._sleep = sleep
+        self._window = collections.deque()
+        self._lock = threading.Lock()
+        self._spreadsheets = {}
+        self._ids = itertools.count(1)
+
+    def _request(self, method):
+        """每個 API 請求的共同處理:計數、配額、隨機錯誤、延遲。"""
+        with self._lock:
+            self.requests[method] += 1
+            now = self._clock()
+            while self._window and self._window[0] <= now - 60:
+                self._window.popleft()
+            over_quota = (self.quota_per_minute is not None
+                          and len(self._window) >= self.quota_per_minute)
+            unlucky = self.error_rate and self._rng.random() < self.error_rate
+            if over_quota or unlucky:
+                self.rejected += 1
+            else:
+                self._window.append(now)
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            self._sleep(delay)
+        if over_quota or unlucky:
+            raise api_error(429, 'Quota exceeded for quota metric \'Read requests\'',
+                            'RESOURCE_EXHAUSTED')
+
+    def open(self, title):
+        self._request('open')
+        try:
+            return self._spreadsheets[title]
+        except KeyError:
+            raise SpreadsheetNotFound(title) from None
+
+    def create(self, title):
+        self._request('create')
+        sheet = self._spreadsheets[title] = FakeSpreadsheet(self, title, f'fake-{next(self._ids)}')
+        sheet.add_worksheet('Sheet1', rows=1000, cols=26, _request=False)
+        return sheet
+
+    def get_file_drive_metadata(self, file_id):
+        self._request('get_file_drive_metadata')
+        for sheet in self._spreadsheets.values():
+            if sheet.id == file_id:
+                return {'id': file_id, 'name': sheet.title, 'modifiedTime': sheet.modified_time()}
+        raise SpreadsheetNotFound(file_id)
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, title, sheet_id):
+        self.client = client
+        self.title = title
+        self.id = sheet_id
+        self.url = f'https://docs.google.com/spreadsheets/d/{sheet_id}'
+        self._worksheets = []
+        self._revision = 0
+        self._ids = itertools.count(0)
+
+    def _touch(self):
+        self._revision += 1
+
+    def modified_time(self):
+        base = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        stamp = base + datetime.timedelta(milliseconds=self._revision)
+        return stamp.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+    def get_lastUpdateTime(self):
+        return self.client.get_file_drive_metadata(self.id)['modifiedTime']
+
+    @property
+    def lastUpdateTime(self):
+        return self.get_lastUpdateTime()
+
+    def worksheets(self):
+        self.client._request('worksheets')
+        return list(self._worksheets)
+
+    def worksheet(self, title):
+        self.client._request('worksheet')
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise WorksheetNotFound(title)
+
+    def add_worksheet(self, title, rows, cols, _request=True):
+        if _request:
+            self.client._request('add_worksheet')
+        ws = FakeWorksheet(self, title, next(self._ids), rows, cols)
+        self._worksheets.append(ws)
+        self._touch()
+        return ws
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, ws_id, rows, cols):
+        self.spreadsheet = spreadsheet
+        self.client = spreadsheet.client
+        self.title = title
+        self.id = ws_id
+        self.row_count = rows
+        self.col_count = cols
+        self._values = []   # 只存到最後一列有值為止;格線外(row_count 之後)不存在
+        self._lock = threading.Lock()
+
+    # ─── 內部 ────────────────────────────────────────────────────
+    def _request(self, method):
+        self.client._request(method)
+
+    def _grid(self, a1):
+        """A1 範圍 → 0-based (r0, r1, c0, c1),結尾不含;開放端點以格線為界。"""
+        grid = a1_range_to_grid_range(a1)
+        r0 = grid.get('startRowIndex', 0)
+        c0 = grid.get('startColumnIndex', 0)
+        r1 = grid.get('endRowIndex', self.row_count)
+        c1 = grid.get('endColumnIndex', self.col_count)
+        if r0 >= self.row_count or c0 >= self.col_count:
+            raise api_error(400, f"Range ('{self.title}'!{a1}) exceeds grid limits. "
+                                 f"Max rows: {self.row_count}, max columns: {self.col_count}",
+                            'INVALID_ARGUMENT')
+        return r0, min(r1, self.row_count), c0, min(c1, self.col_count)
+
+    @staticmethod
+    def _trim(rows):
+        rows = [list(r) for r in rows]
+        for r in rows:
+            while r and r[-1] == '':
+                r.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def _read(self, r0, r1, c0, c1):
+        return self._trim(row[c0:c1] for row in self._values[r0:r1])
+
+    def _write(self, r0, c0, values):
+        values = [['' if v is None else str(v) for v in row] for row in values]
+        r1 = r0 + len(values)
+        c1 = c0 + max((len(r) for r in values), default=0)
+        if r1 > self.row_count or c1 > self.col_count:
+            raise api_error(400, f'Range exceeds grid limits. Max rows: {self.row_count}',
+                            'INVALID_ARGUMENT')
+        while len(self._values) < r1:
+            self._values.append([])
+        for i, row in enumerate(values):
+            target = self._values[r0 + i]
+            if len(target) < c0 + len(row):
+                target.extend([''] * (c0 + len(row) - len(target)))
+            target[c0:c0 + len(row)] = row
+            while target and target[-1] == '':
+                target.pop()
+        while self._values and not self._values[-1]:
+            self._values.pop()
+        self.spreadsheet._touch()
+
+    # ─── 讀 ──────────────────────────────────────────────────────
+    def get_values(self, range_name=None, **kwargs):
+        self._request('values_get')
+        with self._lock:
+            rows = self._read(*self._grid(range_name)) if range_name else self._trim(self._values)
+        width = max((len(r) for r in rows), default=0)
+        return [r + [''] * (width - len(r)) for r in rows]
+
+    def get_all_records(self, **kwargs):
+        values = self.get_values()
+        if not values:
+            return []
+        header, rows = values[0], values[1:]
+        return [dict(zip(header, numericise_all(row))) for row in rows]
+
+    def batch_get(self, ranges, **kwargs):
+        self._request('values_batchGet')
+        with self._lock:
+            return [self._read(*self._grid(a1)) for a1 in ranges]
+
+    def acell(self, label, **kwargs):
+        self._request('values_get')
+        row, col = a1_to_rowcol(label)
+        with self._lock:
+            values = self._read(row - 1, row, col - 1, col)
+        return Cell(row, col, values[0][0] if values and values[0] else '')
+
+    # ─── 寫 ──────────────────────────────────────────────────────
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        """接在最後一列有值的列之後;格線不夠就剛好長到需要的列數。"""
+        self._request('values_append')
+        with self._lock:
+            start = len(self._values)
+            self.row_count = max(self.row_count, start + len(values))
+            self.col_count = max(self.col_count, max((len(r) for r in values), default=0))
+            self._write(start, 0, values)
+        return {'updates': {'updatedRows': len(values)}}
+
+    def update(self, values=None, range_name=None, **kwargs):
+        if isinstance(values, str):   # 舊式 update('A1', values)
+            values, range_name = range_name, values
+        self._request('values_update')
+        with self._lock:
+            r0, _, c0, _ = self._grid(range_name or 'A1')
+            self._write(r0, c0, values)
+        return {'updatedRows': len(values)}
+
+    def batch_update(self, data, **kwargs):
+        self._request('values_batchUpdate')
+        with self._lock:
+            for item in data:
+                r0, _, c0, _ = self._grid(item['range'])
+                self._write(r0, c0, item['values'])
+        return {'totalUpdatedRows': sum(len(item['values']) for item in data)}
+
+    def resize(self, rows=None, cols=None):
+        self._request('batchUpdate')
+        with self._lock:
+            if rows is not None:
+                self.row_count = rows
+                del self._values[rows:]
+            if cols is not None:
+                self.col_count = cols
+                self._values = [r[:cols] for r in self._values]
+            self._values = self._trim(self._values)
+            self.spreadsheet._touch()
+
+    def clear(self):
+        self._request('values_clear')
+        with self._lock:
+            self._values = []
+            self.spreadsheet._touch()
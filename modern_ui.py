@@ -240,7 +240,7 @@ def create_status_bar():
     # 獲取系統狀態
     dm = get_data_manager()
     storage_info = dm.get_storage_info()
-    df = dm.load_data()
+    summary = dm.get_qr_state_summary()
     
     with col1:
         st.markdown("""
@@ -248,10 +248,10 @@ def create_status_bar():
             <div class="metric-value">{}</div>
             <div class="metric-label">總記錄數</div>
         </div>
-        """.format(len(df)), unsafe_allow_html=True)
+        """.format(summary['records']), unsafe_allow_html=True)
     
     with col2:
-        unique_qrs = df['qr_id'].nunique() if not df.empty else 0
+        unique_qrs = summary['qrs']
         st.markdown("""
         <div class="metric-card">
             <div class="metric-value">{}</div>
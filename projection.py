@@ -0,0 +1,111 @@
+"""
+事件記錄投影的共用基底(不 import streamlit,方便 headless 單元測試)。
+
+投影是由整份事件記錄推導、隨新增事件增量更新的狀態(record_index.RecordIndex、
+balance_view.BatchBalanceView、qr_state.QrStateTable)。Projection 負責共同的部分:
+- 記住已折進的列數與最後一列(16 欄字串 tuple,同 StorageBackend.load_since 的預設 cursor);
+- apply(record):新增一筆時 O(1) 折進;
+- sync(df):以 schema.extends 驗證 df 仍是「已折進的列 + 新列」,新列不超過 fold_limit
+  筆就逐列折,否則(整表改寫、別的 process 寫入順序不同、落後太多)整份向量化重建;
+- to_snapshot() / restore():event_store 快照用的可 JSON 化 dict。
+
+子類只實作自己的狀態(抽象方法,少實作一個在建立時就報 TypeError):
+    _reset()               清空狀態
+    _fold(cells)           一列折進狀態
+    _rebuild(df)           由整份資料向量化重建
+    _state() / _restore_state(data)   快照中自己的部分
+"""
+
+import abc
+import threading
+
+from schema import COLUMNS, extends, row_cells, to_cell
+
+FOLD_LIMIT = 1000   # 一次要補的新列超過這個數就改用向量化重建(逐列折比較慢)
+
+
+class Projection(abc.ABC):
+    """thread-safe;同一儲存在 process 內共用一個即可。"""
+
+    def __init__(self, df=None):
+        self._lock = threading.RLock()
+        self._clear()
+        if df is not None:
+            self.rebuild(df)
+
+    def _clear(self):
+        self.rows = 0      # 已折進的列數
+        self.last = None   # 最後折進那一列
+        self._reset()
+
+    # ─── 子類實作 ────────────────────────────────────────────────
+    @abc.abstractmethod
+    def _reset(self):
+        """清空狀態。"""
+
+    @abc.abstractmethod
+    def _fold(self, cells):
+        """一列(COLUMNS 順序、to_cell 過的字串 tuple)折進狀態;self.rows 為這一列的位置。"""
+
+    @abc.abstractmethod
+    def _rebuild(self, df):
+        """由整份資料(ensure_schema 過、寫入順序)向量化重建。"""
+
+    @abc.abstractmethod
+    def _state(self):
+        """快照中自己的部分(可 JSON 化的 dict)。"""
+
+    @abc.abstractmethod
+    def _restore_state(self, data):
+        """由 _state() 的內容還原。"""
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def _add(self, cells):
+        self._fold(cells)
+        self.rows += 1
+        self.last = cells
+
+    def _sync(self, df, fold_limit=FOLD_LIMIT):
+        """呼叫端持鎖。"""
+        if not extends(df, self.rows, self.last) or len(df) - self.rows > fold_limit:
+            self.rebuild(df)
+            return 'rebuilt'
+        if len(df) == self.rows:
+            return 'current'
+        for cells in df.iloc[self.rows:].itertuples(index=False, name=None):
+            self._add(tuple(to_cell(v) for v in cells))
+        return 'folded'
+
+    def apply(self, record):
+        """新增一筆記錄(dict,缺欄補 '')後呼叫,O(1)。"""
+        with self._lock:
+            self._add(tuple(to_cell(record.get(col, '')) for col in COLUMNS))
+
+    def rebuild(self, df):
+        """由整份資料重建。"""
+        with self._lock:
+            self._clear()
+            self._rebuild(df)
+            self.rows = len(df)
+            self.last = row_cells(df, -1) if len(df) else None
+
+    def sync(self, df, fold_limit=FOLD_LIMIT):
+        """與整份資料 df(ensure_schema 過、寫入順序)對齊;回傳 'current' / 'folded' / 'rebuilt'。
+        新列超過 fold_limit 筆時改為整份重建。"""
+        with self._lock:
+            return self._sync(df, fold_limit)
+
+    # ─── 快照(見 event_store) ────────────────────────────────────────
+    def to_snapshot(self):
+        """可 JSON 化的 dict(複製一份,之後的 apply 不會改到)。"""
+        with self._lock:
+            return {'rows': self.rows, 'last': list(self.last) if self.last is not None else None,
+                    **self._state()}
+
+    def restore(self, data):
+        """由 to_snapshot() 的內容還原;之後照常 sync(df) 驗證、只補快照之後的列。"""
+        with self._lock:
+            self._clear()
+            self._restore_state(data)
+            self.rows = data['rows']
+            self.last = tuple(data['last']) if data['last'] is not None else None
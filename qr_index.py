@@ -0,0 +1,251 @@
+"""
+CSV 旁的 qr_id → byte 範圍索引(不 import streamlit,方便 headless 單元測試)。
+
+掃描頁只需要一個 qr_id 的歷程,但 CSV 沒有索引:查一個 QR 也得先載入整份資料
+(冷啟動數百萬列要好幾秒)。QrOffsetIndex 在 CSV 旁維護一個 SQLite 檔
+(plastic_trace_data.csv → plastic_trace_data.qrindex.db):
+    entries(qr_id, offset, length)   每筆記錄在 CSV 裡的 byte 範圍(qr_id 建索引)
+    meta                             已索引到的 offset、表頭、offset 前的指紋
+history(qr_id) 先 refresh()——檔案只在尾端 append 就只掃新增的 bytes(同 CsvTailReader 以
+表頭 + offset 前的指紋驗證),被整表改寫就整檔重建——再依索引 seek 讀出該 QR 那幾列
+交給 parse_csv_bytes。成本與該 QR 的列數成正比,與總列數無關。
+
+索引檔隨時可刪,下次查詢重建。多個 process 共用同一索引檔:refresh 以 BEGIN IMMEDIATE
+交易序列化,查詢走 WAL 不被寫入擋住。
+"""
+
+import contextlib
+import csv
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from csv_store import parse_csv_bytes
+from schema import empty_frame
+
+INDEX_FORMAT = 1
+SCAN_CHUNK = 8 << 20    # 建索引時一次讀多少 bytes
+_TAIL_MARK_BYTES = 64   # offset 前保留多少 bytes 當指紋(同 csv_store)
+_CREATE_INDEX_SQL = 'CREATE INDEX IF NOT EXISTS idx_entries_qr ON entries (qr_id, "offset")'
+
+
+def qr_index_path(csv_path):
+    """CSV 旁的索引檔:plastic_trace_data.csv → plastic_trace_data.qrindex.db。"""
+    return os.path.splitext(os.path.abspath(csv_path))[0] + '.qrindex.db'
+
+
+def remove_index_files(index_path):
+    """刪除索引檔與它的 -wal / -shm(不存在就略過)。先 close() 仍開著的 QrOffsetIndex。"""
+    for suffix in ('', '-wal', '-shm'):
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(index_path + suffix)
+
+
+def split_records(data):
+    """data 中完整 CSV 記錄的 [(start, end)](end 在換行之後)。
+
+    引號內的換行不算列尾:QUOTE_MINIMAL 下欄內的 " 一律成對跳脫,數到換行前
+    引號為偶數個才是列尾。最後沒換行的殘段(別的 process 寫到一半)不算。
+    整段沒有引號(常態)時以 numpy 一次找出所有換行。
+    """
+    if b'"' not in data:
+        ends = (np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1).tolist()
+        return list(zip([0] + ends[:-1], ends))
+    spans = []
+    start = pos = quotes = 0
+    while True:
+        nl = data.find(b'\n', pos)
+        if nl < 0:
+            return spans
+        quotes += data.count(b'"', pos, nl)
+        pos = nl + 1
+        if quotes % 2 == 0:
+            spans.append((start, pos))
+            start, quotes = pos, 0
+
+
+def field_at(line, col):
+    """一列 CSV bytes 的第 col 欄(字串);欄數不足回 ''。沒有引號時直接切逗號。"""
+    if b'"' in line:
+        cells = next(csv.reader([line.decode('utf-8')]), [])
+        return cells[col] if col < len(cells) else ''
+    cells = line.rstrip(b'\r\n').split(b',', col + 1)
+    return cells[col].decode('utf-8') if col < len(cells) else ''
+
+
+class QrOffsetIndex:
+    """thread-safe(每個 thread 各用一條 SQLite 連線);同一 CSV 在 process 內共用一個即可。"""
+
+    def __init__(self, csv_path, index_path=None):
+        self.csv_path = csv_path
+        self.index_path = index_path or qr_index_path(csv_path)
+        self._local = threading.local()
+        self._conns = []   # 所有 thread 的連線,close() 一起關
+        self._conns_lock = threading.Lock()
+        self.closed = False
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            with self._conns_lock:
+                if self.closed:   # 不重開:否則會在 CSV 已不存在的地方再建出索引檔
+                    raise sqlite3.ProgrammingError('QrOffsetIndex is closed')
+                # isolation_level=None:交易由這裡明確 BEGIN / COMMIT;
+                # check_same_thread=False 只為了讓 close() 能關別的 thread 的連線
+                conn = sqlite3.connect(self.index_path, timeout=10, isolation_level=None,
+                                       check_same_thread=False)
+                self._conns.append(conn)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """關閉所有連線;之後再查詢會丟 sqlite3.ProgrammingError。CSV 不再存在
+        (例如分片壓縮)時先 close 再 remove_index_files。"""
+        with self._conns_lock:
+            self.closed = True
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS entries '
+                     '(qr_id TEXT NOT NULL, "offset" INTEGER NOT NULL, length INTEGER NOT NULL)')
+        conn.execute(_CREATE_INDEX_SQL)
+        conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)')
+
+    def _meta(self, conn):
+        """{'offset', 'header', 'tail_mark', 'qr_col'};格式不符或尚未建立回空 dict。"""
+        meta = dict(conn.execute('SELECT key, value FROM meta'))
+        return meta if meta.get('format') == INDEX_FORMAT else {}
+
+    def _intact(self, f, meta):
+        """表頭與 offset 前的指紋都沒變 → CSV 確實只在尾端 append。"""
+        header, mark = meta['header'], meta['tail_mark']
+        f.seek(0)
+        if f.read(len(header)) != header:
+            return False
+        f.seek(meta['offset'] - len(mark))
+        return f.read(len(mark)) == mark
+
+    def _current(self, f, size, meta):
+        return bool(meta) and size == meta['offset'] and self._intact(f, meta)
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def refresh(self):
+        """把 CSV 新增的完整列補進索引(被改寫則重建);回傳 'current' / 'extended' / 'rebuilt'。"""
+        conn = self._conn()
+        try:
+            f = open(self.csv_path, 'rb')
+        except FileNotFoundError:
+            if self._meta(conn):
+                self.reset()
+                return 'rebuilt'
+            return 'current'
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if self._current(f, size, self._meta(conn)):
+                return 'current'
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                meta = self._meta(conn)   # 等鎖期間別的 process 可能已更新
+                if self._current(f, size, meta):
+                    status = 'current'
+                elif meta and size > meta['offset'] and self._intact(f, meta):
+                    self._scan(conn, f, size, meta)
+                    status = 'extended'
+                else:
+                    # 整檔重建:先拿掉索引,整批寫入後再建(比逐列維護 B-tree 快)
+                    conn.execute('DROP INDEX IF EXISTS idx_entries_qr')
+                    conn.execute('DELETE FROM entries')
+                    self._scan(conn, f, size, {})
+                    conn.execute(_CREATE_INDEX_SQL)
+                    status = 'rebuilt'
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return status
+
+    def _scan(self, conn, f, size, meta):
+        """索引 [meta offset, size) 中完整的列;meta 為空時從檔頭(含表頭)開始。呼叫端持交易。"""
+        offset = meta.get('offset', 0)
+        header, qr_col = meta.get('header'), meta.get('qr_col')
+        tail = meta.get('tail_mark', b'')
+        f.seek(offset)
+        carry = b''
+        while offset < size:
+            data = carry + f.read(min(SCAN_CHUNK, size - offset - len(carry)))
+            if len(data) == len(carry):
+                break   # 檔案在 fstat 之後被截短:剩下的下次再補
+            spans = split_records(data)
+            rows = []
+            for start, end in spans:
+                line = data[start:end]
+                if header is None:
+                    header = line
+                    names = next(csv.reader([line.decode('utf-8-sig')]), [])
+                    qr_col = names.index('qr_id') if 'qr_id' in names else -1
+                elif line.strip() and qr_col >= 0:
+                    rows.append((field_at(line, qr_col), offset + start, end - start))
+            conn.executemany('INSERT INTO entries VALUES (?, ?, ?)', rows)
+            end = spans[-1][1] if spans else 0
+            tail = (tail + data[:end])[-_TAIL_MARK_BYTES:]
+            offset += end
+            carry = data[end:]
+            if offset + len(carry) >= size:
+                break
+        if header is None:
+            return   # 連表頭都還沒寫完整
+        conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', [
+            ('format', INDEX_FORMAT), ('offset', offset), ('header', header),
+            ('tail_mark', tail), ('qr_col', qr_col)])
+
+    def reset(self):
+        """丟掉整份索引(整表改寫後呼叫),下次查詢時重建。"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM entries')
+        conn.execute('DELETE FROM meta')
+        conn.execute('COMMIT')
+
+    # ─── 查詢 ────────────────────────────────────────────────────
+    def spans(self, qr_id):
+        """(meta, [(offset, length)...]),同一讀取交易內取得,依寫入順序。"""
+        conn = self._conn()
+        conn.execute('BEGIN')
+        try:
+            meta = self._meta(conn)
+            spans = conn.execute('SELECT "offset", length FROM entries WHERE qr_id = ? '
+                                 'ORDER BY "offset"', (qr_id,)).fetchall()
+        finally:
+            conn.execute('COMMIT')
+        return meta, spans
+
+    def history(self, qr_id):
+        """某 qr_id 的全部列(16 欄 frame,寫入順序);只讀這幾列的 bytes。
+
+        讀完再驗一次指紋:讀取途中 CSV 被整表改寫就重新 refresh 再讀。
+        """
+        for _ in range(3):
+            self.refresh()
+            meta, spans = self.spans(qr_id)
+            if not spans:
+                return empty_frame()
+            try:
+                with open(self.csv_path, 'rb') as f:
+                    chunks = []
+                    for offset, length in spans:
+                        f.seek(offset)
+                        chunks.append(f.read(length))
+                    if self._intact(f, meta):
+                        break
+            except FileNotFoundError:
+                return empty_frame()
+        df = parse_csv_bytes(meta['header'] + b''.join(chunks))
+        return df[df['qr_id'] == qr_id].reset_index(drop=True)
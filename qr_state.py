@@ -0,0 +1,163 @@
+"""
+每個 qr_id 目前狀態的精簡表(不 import streamlit,方便 headless 單元測試)。
+
+儀表板(狀態列、系統概覽、最近活動)原本每次 rerun 都從整份事件記錄重算
+「每個 QR 現在在哪」:nunique、篩選、整表排序。QrStateTable 每個 qr_id 保存一列:
+    batch_name   該 QR 第一筆記錄的批次(同 get_qr_batch)
+    stage        時間最新一筆的階段(同一 timestamp 後寫入者為準,同 latest_balance_rows)
+    timestamp    該筆的 timestamp
+    weight_kg    時間最新、且有重量的那筆重量(float;從未記重量為 None)
+    events       事件(列)數
+另外維護依目前階段的 QR 數、已建立 / 已掃描 / 閒置(已建立但從未掃描)的 QR 數,
+與時間最新的 RECENT_KEEP 筆事件;儀表板讀這些都是常數時間。
+
+apply(record) 新增一筆時 O(1) 更新,sync(df) 只折新列、整表改寫則向量化重建
+(見 projection.Projection)。本身只在記憶體;持久化由 event_store 的快照負責。
+"""
+
+import bisect
+
+import pandas as pd
+
+from projection import Projection
+from schema import COLUMNS, STAGE_INITIAL, ensure_schema, to_float, to_float_series
+
+STATE_FIELDS = ['batch_name', 'stage', 'timestamp', 'weight_kg', 'events']
+RECENT_FIELDS = ['qr_id', 'stage', 'operator', 'timestamp']
+RECENT_KEEP = 20     # 保留幾筆最新事件給「最近活動」
+_STATE_KEYS = STATE_FIELDS + ['weight_at', 'created', 'scanned']
+
+
+class QrStateTable(Projection):
+    """thread-safe;同一儲存在 process 內共用一個即可。"""
+
+    def _reset(self):
+        self.states = {}         # qr_id -> STATE_FIELDS + 'weight_at' / 'created' / 'scanned'
+        self.by_stage = {}       # 目前階段 -> QR 數
+        self.created = 0         # 有「初始建立」記錄的 QR 數
+        self.active = 0          # 有初始建立以外記錄的 QR 數
+        self.idle = 0            # 已建立但從未掃描
+        self._recent = []        # [((timestamp, 列位置), 事件 dict)],依時間遞增
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def _move(self, state, stage, timestamp):
+        if state['stage'] is not None:
+            self.by_stage[state['stage']] -= 1
+            if not self.by_stage[state['stage']]:
+                del self.by_stage[state['stage']]
+        state['stage'], state['timestamp'] = stage, timestamp
+        self.by_stage[stage] = self.by_stage.get(stage, 0) + 1
+
+    def _mark(self, state, stage):
+        if stage == STAGE_INITIAL:
+            if not state['created']:
+                state['created'] = True
+                self.created += 1
+                self.idle += not state['scanned']
+        elif not state['scanned']:
+            state['scanned'] = True
+            self.active += 1
+            self.idle -= state['created']
+
+    def _fold(self, cells):
+        """一列折進所屬 QR。"""
+        row = dict(zip(COLUMNS, cells))
+        stage, timestamp = row['stage'], row['timestamp']
+        state = self.states.get(row['qr_id'])
+        if state is None:
+            state = self.states[row['qr_id']] = {
+                'batch_name': row['batch_name'], 'stage': None, 'timestamp': None,
+                'weight_kg': None, 'events': 0, 'weight_at': None,
+                'created': False, 'scanned': False}
+        state['events'] += 1
+        if state['timestamp'] is None or timestamp >= state['timestamp']:
+            self._move(state, stage, timestamp)
+        weight = to_float(row['weight_kg'])
+        if weight is not None and (state['weight_at'] is None or timestamp >= state['weight_at']):
+            state['weight_kg'], state['weight_at'] = weight, timestamp
+        self._mark(state, stage)
+        key = (timestamp, self.rows)
+        if len(self._recent) < RECENT_KEEP or key > self._recent[0][0]:
+            bisect.insort(self._recent, (key, {col: row[col] for col in RECENT_FIELDS}),
+                          key=lambda item: item[0])
+            del self._recent[:-RECENT_KEEP]
+
+    def _rebuild(self, df):
+        """依 timestamp stable 排序一次,各 QR 以 duplicated(keep='last') 取最新。"""
+        df = ensure_schema(df, copy=False).reset_index(drop=True)
+        ordered = df.sort_values('timestamp', kind='mergesort')
+        latest = ordered[~ordered['qr_id'].duplicated(keep='last')]
+        weights = to_float_series(ordered['weight_kg'])
+        weighed = ordered.assign(weight_kg=weights)[weights.notna()]
+        weighed = weighed[~weighed['qr_id'].duplicated(keep='last')]
+        first = df[~df['qr_id'].duplicated()]
+        events = df.groupby('qr_id', sort=False).size()   # 依首次出現順序,與 first 對齊
+        initial = df['stage'] == STAGE_INITIAL
+        created = set(df.loc[initial, 'qr_id'].tolist())
+        scanned = set(df.loc[~initial, 'qr_id'].tolist())
+
+        latest_rows = dict(zip(latest['qr_id'].tolist(),
+                               zip(latest['stage'].tolist(), latest['timestamp'].tolist())))
+        weight_rows = dict(zip(weighed['qr_id'].tolist(),
+                               zip(weighed['weight_kg'].tolist(), weighed['timestamp'].tolist())))
+        for qr, batch, count in zip(first['qr_id'].tolist(), first['batch_name'].tolist(),
+                                    events.tolist()):
+            stage, timestamp = latest_rows[qr]
+            weight, weight_at = weight_rows.get(qr, (None, None))
+            self.states[qr] = {
+                'batch_name': batch, 'stage': stage, 'timestamp': timestamp,
+                'weight_kg': weight, 'events': count, 'weight_at': weight_at,
+                'created': qr in created, 'scanned': qr in scanned}
+            self.by_stage[stage] = self.by_stage.get(stage, 0) + 1
+        self.created, self.active = len(created), len(scanned)
+        self.idle = len(created - scanned)
+
+        tail = ordered.tail(RECENT_KEEP)
+        self._recent = [((timestamp, pos), dict(zip(RECENT_FIELDS, values)))
+                        for timestamp, pos, values in zip(
+                            tail['timestamp'].tolist(), tail.index.tolist(),
+                            zip(*(tail[col].tolist() for col in RECENT_FIELDS)))]
+
+    # ─── 快照(見 event_store) ────────────────────────────────────────
+    def _state(self):
+        return {'states': {'qr_id': list(self.states),   # 欄式存放:比每 QR 一個 dict 小、讀得快
+                           **{field: [state[field] for state in self.states.values()]
+                              for field in _STATE_KEYS}},
+                'by_stage': dict(self.by_stage), 'created': self.created,
+                'active': self.active, 'idle': self.idle,
+                'recent': [[list(key), dict(event)] for key, event in self._recent]}
+
+    def _restore_state(self, data):
+        states = data['states']
+        self.states = {qr: dict(zip(_STATE_KEYS, values)) for qr, values in
+                       zip(states['qr_id'], zip(*(states[field] for field in _STATE_KEYS)))}
+        self.by_stage = data['by_stage']
+        self.created, self.active, self.idle = data['created'], data['active'], data['idle']
+        self._recent = [(tuple(key), event) for key, event in data['recent']]
+
+    # ─── 查詢 ────────────────────────────────────────────────────
+    def get(self, qr_id):
+        """{'qr_id', STATE_FIELDS...};沒有記錄回 None。"""
+        with self._lock:
+            state = self.states.get(qr_id)
+            if state is None:
+                return None
+            return {'qr_id': qr_id, **{field: state[field] for field in STATE_FIELDS}}
+
+    def summary(self):
+        """{'records', 'qrs', 'created', 'active', 'idle', 'by_stage': {目前階段: QR 數}}。"""
+        with self._lock:
+            return {'records': self.rows, 'qrs': len(self.states), 'created': self.created,
+                    'active': self.active, 'idle': self.idle, 'by_stage': dict(self.by_stage)}
+
+    def recent(self, n=5):
+        """時間最新的 n 筆事件(新到舊;n 最多 RECENT_KEEP)。"""
+        with self._lock:
+            return [dict(event) for _, event in reversed(self._recent[-n:])] if n > 0 else []
+
+    def frame(self):
+        """整張狀態表(qr_id + STATE_FIELDS,依 QR 首次出現順序)。"""
+        with self._lock:
+            return pd.DataFrame([{'qr_id': qr, **{field: state[field] for field in STATE_FIELDS}}
+                                 for qr, state in self.states.items()],
+                                columns=['qr_id'] + STATE_FIELDS)
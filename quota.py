@@ -0,0 +1,241 @@
+"""
+Google Sheets API 配額控管與呼叫統計(不 import streamlit / gspread,方便 headless 單元測試)。
+
+Sheets 配額以「每位使用者每分鐘」計(服務帳號算一位):讀、寫各自約 60 次/分鐘,
+超過就回 429。這裡在 client 端先擋:
+- TokenBucket:讀、寫各一個桶;burst 個 token 可立即用(最多 per_minute 的一半),其餘以
+  (per_minute - burst) / 60 每秒補充 → 任何 60 秒視窗內最多 per_minute 次。
+- QuotaGuard.call:先取 token,再呼叫並記錄延遲;遇到 429 仍以指數退避重試幾次,
+  同時把該桶清空,讓同 process 其他呼叫一起放慢。
+- SingleFlight:同一時間對同一 key 的讀取只真的打一次 API,其他 caller 共用結果。
+- MeteredProxy:把 gspread Worksheet 的讀寫方法包上 QuotaGuard,其餘屬性原樣轉發。
+- CallMetrics:每種操作的次數、錯誤、延遲直方圖、被節流次數,給管理頁顯示。
+
+限制只在單一 process 內;多個 replica 共用同一服務帳號時,per_minute 要按 replica 數調低。
+"""
+
+import bisect
+import functools
+import random
+import threading
+import time
+
+
+def is_rate_limited(exc):
+    """例外是否為 429 / RESOURCE_EXHAUSTED(gspread APIError 有 .code;其他看 response / 訊息)。"""
+    code = getattr(exc, 'code', None)
+    if code is None:
+        code = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return code == 429 or 'RESOURCE_EXHAUSTED' in str(exc)
+
+
+class TokenBucket:
+    """阻塞式 token bucket(thread-safe)。"""
+
+    def __init__(self, per_minute, burst=10, clock=time.monotonic, sleep=time.sleep):
+        # burst 最多佔配額一半,補充速率才不會因 burst 設太大而趨近於 0
+        self.capacity = max(1, min(burst, per_minute // 2))
+        self.rate = max(per_minute - self.capacity, 1) / 60.0   # 每秒補充
+        self.tokens = float(self.capacity)
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """取一個 token,必要時等待;回傳等待秒數。
+
+        不夠時先「預約」(tokens 可為負,代表排隊中的呼叫),再睡到輪到自己,
+        同時等待的呼叫依序排開、不會一起醒來搶。
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay:
+            self._sleep(delay)
+        return delay
+
+    def drain(self):
+        """伺服器回 429 時把桶清空,後續呼叫自然放慢。"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+class CallMetrics:
+    """每種操作的呼叫次數、錯誤、延遲直方圖與節流事件(thread-safe)。"""
+
+    BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)   # 秒;最後一格為 > 10s
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    def _op(self, op):
+        stats = self._ops.get(op)
+        if stats is None:
+            stats = self._ops[op] = {
+                'calls': 0, 'errors': 0, 'total_s': 0.0,
+                'histogram': [0] * (len(self.BUCKETS) + 1),
+                'throttled': 0, 'throttle_wait_s': 0.0, 'rate_limited': 0, 'merged': 0,
+            }
+        return stats
+
+    def record_call(self, op, seconds, ok=True):
+        with self._lock:
+            stats = self._op(op)
+            stats['calls'] += 1
+            stats['errors'] += 0 if ok else 1
+            stats['total_s'] += seconds
+            stats['histogram'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def record_throttle(self, op, waited):
+        with self._lock:
+            stats = self._op(op)
+            stats['throttled'] += 1
+            stats['throttle_wait_s'] += waited
+
+    def record_rate_limited(self, op):
+        with self._lock:
+            self._op(op)['rate_limited'] += 1
+
+    def record_merged(self, op):
+        with self._lock:
+            self._op(op)['merged'] += 1
+
+    def _percentile(self, histogram, q):
+        total = sum(histogram)
+        if not total:
+            return None
+        seen = 0
+        for i, count in enumerate(histogram):
+            seen += count
+            if seen >= q * total:
+                return self.BUCKETS[i] if i < len(self.BUCKETS) else float('inf')
+
+    def snapshot(self):
+        """{op: 統計} 的深拷貝。"""
+        with self._lock:
+            return {op: dict(stats, histogram=list(stats['histogram']))
+                    for op, stats in self._ops.items()}
+
+    def rows(self):
+        """管理頁表格用:每個操作一列(p50 / p95 為直方圖上界,秒)。"""
+        rows = []
+        for op, stats in sorted(self.snapshot().items()):
+            calls = stats['calls']
+            rows.append({
+                'operation': op,
+                'calls': calls,
+                'errors': stats['errors'],
+                'avg_ms': round(stats['total_s'] / calls * 1000, 1) if calls else None,
+                'p50_s': self._percentile(stats['histogram'], 0.5),
+                'p95_s': self._percentile(stats['histogram'], 0.95),
+                'throttled': stats['throttled'],
+                'throttle_wait_s': round(stats['throttle_wait_s'], 2),
+                'rate_limited_429': stats['rate_limited'],
+                'merged': stats['merged'],
+            })
+        return rows
+
+
+class QuotaGuard:
+    """讀寫各一個 TokenBucket + CallMetrics;call() 負責取 token、計時、429 重試。"""
+
+    def __init__(self, reads_per_minute=60, writes_per_minute=60, burst=10,
+                 max_retries=3, base_delay=1.0, sleep=time.sleep, clock=time.monotonic):
+        self.buckets = {
+            'read': TokenBucket(reads_per_minute, burst, clock=clock, sleep=sleep),
+            'write': TokenBucket(writes_per_minute, burst, clock=clock, sleep=sleep),
+        }
+        self.metrics = CallMetrics()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self._sleep = sleep
+        self._clock = clock
+
+    def call(self, op, kind, fn, *args, **kwargs):
+        """kind 為 'read' / 'write' 走對應的桶;None 只記錄統計(例如 Drive metadata)。"""
+        bucket = self.buckets.get(kind)
+        attempt = 0
+        while True:
+            if bucket is not None:
+                waited = bucket.acquire()
+                if waited:
+                    self.metrics.record_throttle(op, waited)
+            start = self._clock()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                self.metrics.record_call(op, self._clock() - start, ok=False)
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                self.metrics.record_rate_limited(op)
+                if bucket is not None:
+                    bucket.drain()
+                self._sleep(self.base_delay * 2 ** attempt * random.uniform(1.0, 1.5))
+                attempt += 1
+                continue
+            self.metrics.record_call(op, self._clock() - start)
+            return result
+
+
+class SingleFlight:
+    """同一 key 同時只有一個 caller 真的執行 fn,其餘等它並共用結果(或例外)。"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            if self.metrics is not None:
+                self.metrics.record_merged(key)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class MeteredProxy:
+    """包住 gspread 物件:reads / writes 內的方法經 QuotaGuard 呼叫,其他屬性原樣轉發。"""
+
+    def __init__(self, target, guard, reads=(), writes=()):
+        self._target = target
+        self._guard = guard
+        self._kinds = {**{name: 'read' for name in reads}, **{name: 'write' for name in writes}}
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        kind = self._kinds.get(name)
+        if kind is None or not callable(attr):
+            return attr
+        return functools.partial(self._guard.call, name, kind, attr)
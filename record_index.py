@@ -0,0 +1,90 @@
+"""
+載入資料的記憶體索引(不 import streamlit,方便 headless 單元測試)。
+
+掃描 / 查詢頁反覆以 df[df['qr_id'] == x] 篩整份資料(每次 O(列數))。RecordIndex
+跟著快取的 frame 維護:
+    qr_id      → 列位置(寫入順序)
+    batch_name → 列位置
+    qr_id      → batch_name(該 QR 第一列的批次)
+查詢變成 dict 命中再 iloc。每個資料版本只整份建一次(向量化);新增記錄時 apply()
+接在後面,sync() 只補新列、整表改寫則重建(見 projection.Projection)。
+
+所有查詢都帶著 caller 手上的 df:先對它 sync 再回傳位置(同一把鎖內),
+位置一定對應那個 df,不會拿到別的 session 較新 / 較舊版本的位置。
+"""
+
+import numpy as np
+import pandas as pd
+
+from projection import Projection
+from schema import COLUMNS, to_cell
+
+_QR = COLUMNS.index('qr_id')
+_BATCH = COLUMNS.index('batch_name')
+
+
+def _cells(series):
+    """欄值 → to_cell 字串;ensure_schema 過的字串欄本來就是,免逐格轉。"""
+    if pd.api.types.is_string_dtype(series.dtype) and not series.hasnans:
+        return series
+    return series.map(to_cell)
+
+
+def _positions(series):
+    """{值: [列位置...]}(依首次出現順序,位置遞增)。factorize + stable argsort 一次分組,
+    比 groupby().indices 快數倍。"""
+    codes, uniques = pd.factorize(series)
+    order = np.argsort(codes, kind='stable').tolist()
+    ends = np.cumsum(np.bincount(codes, minlength=len(uniques))).tolist()
+    return {value: order[start:end]
+            for value, start, end in zip(uniques.tolist(), [0] + ends[:-1], ends)}
+
+
+class RecordIndex(Projection):
+    """thread-safe;同一儲存在 process 內共用一個即可。"""
+
+    def _reset(self):
+        self.by_qr = {}      # qr_id -> [列位置]
+        self.by_batch = {}   # batch_name -> [列位置]
+        self.qr_batch = {}   # qr_id -> 第一列的 batch_name
+
+    # ─── 更新 ────────────────────────────────────────────────────
+    def _fold(self, cells):
+        qr, batch = cells[_QR], cells[_BATCH]
+        self.by_qr.setdefault(qr, []).append(self.rows)
+        self.by_batch.setdefault(batch, []).append(self.rows)
+        self.qr_batch.setdefault(qr, batch)
+
+    def _rebuild(self, df):
+        batches = _cells(df['batch_name'])
+        self.by_qr = _positions(_cells(df['qr_id']))
+        self.by_batch = _positions(batches)
+        batch_list = batches.tolist()
+        self.qr_batch = {qr: batch_list[positions[0]] for qr, positions in self.by_qr.items()}
+
+    # ─── 快照(見 event_store) ────────────────────────────────────────
+    def _state(self):
+        return {'by_qr': {qr: list(p) for qr, p in self.by_qr.items()},
+                'by_batch': {batch: list(p) for batch, p in self.by_batch.items()},
+                'qr_batch': dict(self.qr_batch)}
+
+    def _restore_state(self, data):
+        self.by_qr, self.by_batch = data['by_qr'], data['by_batch']
+        self.qr_batch = data['qr_batch']
+
+    # ─── 查詢(回傳的位置對應傳入的 df) ─────────────────────────────
+    def qr_positions(self, df, qr_id):
+        with self._lock:
+            self._sync(df)
+            return list(self.by_qr.get(qr_id, ()))
+
+    def batch_positions(self, df, batch):
+        with self._lock:
+            self._sync(df)
+            return list(self.by_batch.get(batch, ()))
+
+    def batch_of(self, df, qr_id):
+        """qr_id 第一列的 batch_name;不存在回 None。"""
+        with self._lock:
+            self._sync(df)
+            return self.qr_batch.get(qr_id)
@@ -7,6 +7,7 @@
 - _ensure_schema() 是唯一的向後相容進入點:任何來源(舊 11 欄 CSV / 舊表頭 Sheets)
   載入後補齊缺欄、依 COLUMNS 排序,讓 16 欄程式不會在舊資料上 KeyError。
 - compute_mass_balance() 依規劃方 2026-06-16 業務定義:節點取值、禁止 SUM 全 stage。
+  compute_mass_balance_all() 以同一定義一次算完所有批次(結果與逐批次呼叫相同)。
 """
 
 # ─── 欄位真相來源 ────────────────────────────────────────────────
@@ -44,6 +45,18 @@ DATA_TIER_OPTIONS = ['實測(初級)', '推估(二級)']
 ELV_CLOSEDLOOP_OPTIONS = ['是', '否', '未知']
 MATERIAL_TYPE_OPTIONS = ['PP', 'PE', 'PS', 'PVC', 'ABS', '其他']
 
+# ─── typed 模式(ensure_schema(df, typed=True))的欄位型別 ─────────────
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+FLOAT_COLUMNS = ['weight_kg', 'recycled_ratio']
+# 類別欄的 categories 固定取自選單常數(不同來源的 frame 代碼一致,可直接 concat / 比較)
+CATEGORY_COLUMNS = {
+    'stage': [STAGE_INITIAL] + SCAN_STAGES,
+    'material_type': MATERIAL_TYPE_OPTIONS,
+    'data_tier': DATA_TIER_OPTIONS,
+    'is_elv_closedloop': ELV_CLOSEDLOOP_OPTIONS,
+}
+_TYPED_COLUMNS = set(FLOAT_COLUMNS) | {'timestamp'} | set(CATEGORY_COLUMNS)
+
 # 歐盟 ELV 再生料門檻(顏色對照用)
 EU_THRESHOLD_LOW = 15.0
 EU_THRESHOLD_HIGH = 25.0
@@ -55,24 +68,153 @@ def empty_frame():
     return pd.DataFrame(columns=COLUMNS)
 
 
-def ensure_schema(df):
+# ensure_schema 輸出的標記(DataFrame.attrs,值為 'str' / 'typed')。attrs 會跟著
+# copy / 篩選 / reset_index / 同標記 frame 的 concat 傳遞,下一次 ensure_schema 就免檢查。
+SCHEMA_MARK = 'plastictrace_schema'
+
+
+def copy_on_write():
+    """pandas 是否啟用 Copy-on-Write(pandas 3 一律開啟;2.x 看 mode.copy_on_write 選項)。
+    只有 Copy-on-Write 下淺拷貝才與原 frame 互不影響。"""
+    import pandas as pd
+    return int(pd.__version__.split('.')[0]) >= 3 or pd.get_option('mode.copy_on_write') is True
+
+
+def ensure_schema(df, typed=False, copy=True):
     """補齊缺欄、依 COLUMNS 排序的唯一 migration 進入點。
 
     - 舊資料缺新欄 → 補空字串。
     - 未知欄(不在 COLUMNS)→ 丟棄,讓 CSV 與 Sheets 兩條路欄位一致
       (避免 Sheets save 的 reindex 與 CSV 不同步)。
-    - 不原地修改 caller 的 df(回傳新物件,避免 SettingWithCopy 與測試 flakiness)。
+    - 不原地修改 caller 的 df(預設回傳新物件,避免 SettingWithCopy 與測試 flakiness)。
+    - typed=True 回傳型別化 frame(見 to_typed);傳入 typed frame 而 typed=False 時
+      還原成字串欄,所以既有以字串為前提的程式(儲存層、顯示)可原樣收 typed frame。
+
+    快速路徑:輸出帶 SCHEMA_MARK 標記;已標記同一模式、欄位仍是 COLUMNS 且 dtype 相符的
+    frame 不再逐欄檢查。copy=True 回傳 caller 可自由修改的拷貝:Copy-on-Write 下為淺拷貝
+    (寫入時才真的複製),pandas 2.x 未開 Copy-on-Write 時為深拷貝;只讀不改的呼叫端傳
+    copy=False 直接拿回原物件。標記不檢查值:對已標記 frame 原地
+    寫入非字串 / 缺值後要重新正規化,先 df.attrs.pop(SCHEMA_MARK)。
     """
-    import pandas as pd
     if df is None:
-        return empty_frame()
-    df = df.copy()
-    for col in COLUMNS:
-        if col not in df.columns:
-            df[col] = ''
+        df = empty_frame()
+    mode = 'typed' if typed else 'str'
+    if _conforms(df, mode):
+        return df.copy(deep=not copy_on_write()) if copy else df
+    # reindex 回傳新 frame(Copy-on-Write 下延後到寫入才複製既有欄);缺欄補 '',未知欄丟棄
+    out = df.reindex(columns=COLUMNS, fill_value='')
+    for col, dtype in out.dtypes.items():
+        if _is_typed_dtype(dtype):
+            out[col] = _column_to_strings(out[col])
     # CSV 空格讀進來是 NaN(float),Sheets 則是 '';統一成 '' 讓全 app 看到一致的空值
     # (否則 material_type 等欄會混 str/float → sorted() TypeError、顯示出現 'nan')
-    return df[COLUMNS].fillna('')
+    out = out.fillna('')
+    if typed:
+        return to_typed(out)
+    out.attrs[SCHEMA_MARK] = mode
+    return out
+
+
+def _conforms(df, mode):
+    """df 是否為 ensure_schema 以同一模式輸出過的 frame(欄位與 dtype 也還相符)。"""
+    if df.attrs.get(SCHEMA_MARK) != mode or list(df.columns) != COLUMNS:
+        return False
+    typed = mode == 'typed'
+    return all(_is_typed_dtype(dtype) == (typed and col in _TYPED_COLUMNS)
+               for col, dtype in df.dtypes.items())
+
+
+def _is_typed(series):
+    """typed 模式才會出現的 dtype:nullable Float64、datetime64、categorical。"""
+    return _is_typed_dtype(series.dtype)
+
+
+def _is_typed_dtype(dtype):
+    import pandas as pd
+    return (isinstance(dtype, (pd.CategoricalDtype, pd.Float64Dtype))
+            or pd.api.types.is_datetime64_any_dtype(dtype))
+
+
+def _column_to_strings(series):
+    """typed 欄 → 與儲存層相同的字串(數值 str(float)、時間 TIMESTAMP_FORMAT、缺值 '')。
+
+    數值 / 類別欄先 factorize,只對相異值做字串化(同一 stage / 重量大量重複)。
+    """
+    import numpy as np
+    import pandas as pd
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        # 時間幾乎每筆不同,factorize 無益;向量化 strftime
+        return series.dt.strftime(TIMESTAMP_FORMAT).fillna('')
+    codes, uniques = pd.factorize(series)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        labels = [str(u) for u in uniques]
+    else:
+        labels = [str(float(u)) for u in uniques]
+    # codes 的 -1(缺值)取到最後一個 ''
+    return pd.Series(np.array(labels + [''], dtype=object)[codes], index=series.index,
+                     name=series.name)
+
+
+def to_typed(df):
+    """16 欄字串 frame → 型別化 frame(記憶體較小,數值欄可直接向量化運算):
+
+    - weight_kg / recycled_ratio:nullable Float64(to_float_series;'' 與無法轉換的值為 <NA>)
+    - timestamp:datetime64(不符 TIMESTAMP_FORMAT 的為 NaT)
+    - stage / material_type / data_tier / is_elv_closedloop:categorical,categories 為
+      CATEGORY_COLUMNS 的選單常數;'' 為缺值,不在選單內的舊值附加在固定 categories 之後
+    - 其餘欄維持字串。顯示前以 display_frame() 還原成字串。
+    """
+    import pandas as pd
+    out = {}
+    for col in COLUMNS:
+        values = df[col]
+        if col in FLOAT_COLUMNS:
+            values = to_float_series(values).astype('Float64')
+        elif col == 'timestamp':
+            values = pd.to_datetime(values, format=TIMESTAMP_FORMAT, errors='coerce')
+        elif col in CATEGORY_COLUMNS:
+            fixed = CATEGORY_COLUMNS[col]
+            known = set(fixed)
+            extra = sorted({v for v in values.unique() if v != '' and v not in known})
+            values = pd.Categorical(values.where(values != ''), categories=fixed + extra)
+        out[col] = values
+    typed = pd.DataFrame(out, index=df.index)
+    typed.attrs[SCHEMA_MARK] = 'typed'
+    return typed
+
+
+def display_frame(df):
+    """顯示 / 下載用的相容層:typed 或字串 frame(可為欄位子集)→ 全字串 frame,缺值為 ''。
+
+    取代散落的 .astype(str):typed 欄若直接 astype(str) 會顯示 '<NA>' / 'NaT' / 'nan'。
+    """
+    import pandas as pd
+    out = {}
+    for col in df.columns:
+        series = df[col]
+        if _is_typed(series):
+            out[col] = _column_to_strings(series)
+        else:
+            out[col] = series.where(series.notna(), '').astype(str)
+    return pd.DataFrame(out, index=df.index)
+
+
+def to_cell(value):
+    """寫入儲存層前的字串化規則(CSV 列 / SQLite / Sheets 共用):None、NaN → '',其餘 str()。"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value)
+
+
+def row_cells(df, pos):
+    """df 第 pos 列(位置)依 to_cell 字串化的 tuple;增量維護的結構用它記住「最後一列」。"""
+    return tuple(to_cell(v) for v in df.iloc[pos])
+
+
+def extends(df, rows, last):
+    """df 是否為「已處理的前 rows 列(最後一列為 last)」後面再接新列:
+    列數沒變少且第 rows 列仍是 last。整表改寫後多半不成立,呼叫端應整份重建。"""
+    return len(df) >= rows and (rows == 0 or row_cells(df, rows - 1) == last)
 
 
 def to_float(value):
@@ -93,9 +235,59 @@ def to_float(value):
     if s == '' or s.lower() in ('nan', 'none'):
         return None
     try:
-        return float(s)
+        result = float(s)
     except ValueError:
         return None
+    return None if result != result else result   # '-nan' 之類解析成 NaN 也算缺值
+
+
+# 一般十進位數字(ASCII、前後無空白):交給 Arrow 批次轉換。其餘(前後空白、'inf'、
+# '1_000'、全形數字、非字串值…)逐一交給 to_float,結果與 scalar 版完全一致。
+_DECIMAL_RE = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+
+
+def to_float_series(values):
+    """to_float 的向量化版本:整欄 → float64 Series(同 index),to_float 回 None 的為 NaN。
+
+    先 factorize,只轉相異值(重量 / 比率大量重複);數值 dtype 直接轉型。
+    """
+    import numpy as np
+    import pandas as pd
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series.dtype):
+        return series.astype('float64')
+    codes, uniques = pd.factorize(series)
+    uniques = np.asarray(uniques, dtype=object)
+    parsed = np.full(len(uniques) + 1, np.nan)   # 最後一格給 codes 的 -1(缺值)
+    rest = range(len(uniques))
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        # 混入非字串值(Sheets 讀回的數字)時 pa.array 失敗 → 全部逐一轉
+        text = pa.array(uniques, type=pa.string())
+    except (ImportError, ValueError, TypeError):   # ArrowInvalid / ArrowTypeError 為其子類
+        text = None
+    if text is not None and len(text):
+        decimal = pc.match_substring_regex(text, _DECIMAL_RE).to_numpy(zero_copy_only=False)
+        parsed[:-1][decimal] = pc.cast(pc.filter(text, decimal), pa.float64()).to_numpy()
+        rest = np.flatnonzero(~decimal)
+    for i in rest:
+        value = to_float(uniques[i])
+        if value is not None:
+            parsed[i] = value
+    return pd.Series(parsed[codes], index=series.index, name=series.name)
+
+
+# 質量平衡的取值節點:每批次各取 stage 屬於該節點、timestamp 最新的一列
+# (content 只看 recycled_ratio 可轉成數字的列)。
+BALANCE_NODES = {
+    'feed': [STAGE_FACTORY_OUT],                 # 進料 + 再生料來源純度
+    'received': [STAGE_BACKEND_IN],              # 收料(對帳)
+    'output': [STAGE_RECYCLE, STAGE_PRODUCT],    # 產出
+    'content': BACKEND_RATIO_STAGES,             # 成品再生含量 + data_tier
+}
+# balance_from_nodes 會用到的欄(節點列只需保留這些)
+BALANCE_FIELDS = ['timestamp', 'stage', 'weight_kg', 'recycled_ratio', 'data_tier']
 
 
 def _latest_row(df, stages):
@@ -108,12 +300,8 @@ def _latest_row(df, stages):
     sub = df[df['stage'].isin(stages)]
     if sub.empty:
         return None
-    return sub.sort_values('timestamp').iloc[-1]
-
-
-def _latest_weight(df, stages):
-    row = _latest_row(df, stages)
-    return None if row is None else to_float(row.get('weight_kg'))
+    # stable 排序:同一 timestamp 以原本順序較後者為準(與 compute_mass_balance_all 一致)
+    return sub.sort_values('timestamp', kind='mergesort').iloc[-1]
 
 
 def compute_mass_balance(df, batch):
@@ -132,14 +320,23 @@ def compute_mass_balance(df, batch):
       data_tier               = 與成品再生含量同一筆的可信度分級
     回傳值欄位資料不足時為 None。
     """
-    df = ensure_schema(df)
+    df = ensure_schema(df, copy=False)   # 只讀:已正規化的 frame 直接沿用,迴圈呼叫不重複複製
     b = df[df['batch_name'] == batch]
+    nodes = {node: _latest_row(b, stages) for node, stages in BALANCE_NODES.items()
+             if node != 'content'}
+    # 成品再生含量:後端段時間最新「非空」那筆
+    backend = b[b['stage'].isin(BALANCE_NODES['content'])].sort_values('timestamp', kind='mergesort')
+    filled = to_float_series(backend['recycled_ratio']).notna().to_numpy().nonzero()[0]
+    nodes['content'] = backend.iloc[filled[-1]] if len(filled) else None
+    return balance_from_nodes(batch, nodes, len(b))
 
-    feed = _latest_weight(b, [STAGE_FACTORY_OUT])
-    received = _latest_weight(b, [STAGE_BACKEND_IN])
-    out_row = _latest_row(b, [STAGE_RECYCLE, STAGE_PRODUCT])
-    output = None if out_row is None else to_float(out_row.get('weight_kg'))
-    output_stage = None if out_row is None else str(out_row.get('stage') or '') or None
+
+def balance_from_nodes(batch, nodes, records):
+    """由各節點最新一列(dict / Series;沒有為 None)組出 compute_mass_balance 的回傳 dict。"""
+    feed_row, received_row, out_row, content_row = (nodes.get(node) for node in BALANCE_NODES)
+    feed = None if feed_row is None else to_float(feed_row['weight_kg'])
+    received = None if received_row is None else to_float(received_row['weight_kg'])
+    output = None if out_row is None else to_float(out_row['weight_kg'])
 
     loss = None
     if feed is not None and output is not None:
@@ -149,38 +346,60 @@ def compute_mass_balance(df, batch):
     if feed not in (None, 0) and output is not None:
         recovery_rate = round(output / feed * 100, 2)
 
-    # 成品再生含量:後端段時間最新「非空」那筆
-    recycled_content = None
-    data_tier = None
-    backend = b[b['stage'].isin(BACKEND_RATIO_STAGES)].sort_values('timestamp')
-    for _, row in backend.iloc[::-1].iterrows():
-        r = to_float(row.get('recycled_ratio'))
-        if r is not None:
-            recycled_content = r
-            data_tier = str(row.get('data_tier') or '').strip() or None
-            break
-
-    # 再生料來源純度:出廠那筆
-    source_purity = None
-    fac = _latest_row(b, [STAGE_FACTORY_OUT])
-    if fac is not None:
-        source_purity = to_float(fac.get('recycled_ratio'))
-
     return {
         'batch': batch,
         'feed_kg': feed,                  # 進料
         'received_kg': received,          # 收料(對帳)
         'output_kg': output,              # 產出
-        'output_stage': output_stage,     # 產出取自哪個 stage(再生處理/產品製造)
+        # 產出取自哪個 stage(再生處理/產品製造)
+        'output_stage': None if out_row is None else str(out_row['stage'] or '') or None,
         'loss_kg': loss,                  # 損耗
         'recovery_rate': recovery_rate,   # 回收率 %
-        'recycled_content': recycled_content,  # 成品再生含量 %(對歐盟門檻)
-        'data_tier': data_tier,           # 上述數字的可信度
-        'source_purity': source_purity,   # 再生料來源純度 %(不對門檻)
-        'records': int(len(b)),
+        # 成品再生含量 %(對歐盟門檻)與其可信度
+        'recycled_content': None if content_row is None else to_float(content_row['recycled_ratio']),
+        'data_tier': None if content_row is None else str(content_row['data_tier'] or '').strip() or None,
+        # 再生料來源純度 %(出廠那筆,不對門檻)
+        'source_purity': None if feed_row is None else to_float(feed_row['recycled_ratio']),
+        'records': int(records),
     }
 
 
+def latest_balance_rows(df):
+    """每批次各節點時間最新的一列,一次算完:({節點: {batch: 列 dict}}, {batch: 列數})。
+
+    整份資料依 timestamp stable 排序一次(同一 timestamp 以寫入順序較後者為準),
+    各節點以 duplicated(keep='last') 取每批次最後一列。列數 dict 依批次首次出現的順序。
+    """
+    df = ensure_schema(df, copy=False)
+    ordered = df.sort_values('timestamp', kind='mergesort', ignore_index=True)
+    nodes = {}
+    for node, stages in BALANCE_NODES.items():
+        rows = ordered[ordered['stage'].isin(stages)]
+        if node == 'content':
+            rows = rows[to_float_series(rows['recycled_ratio']).notna()]
+        rows = rows[~rows['batch_name'].duplicated(keep='last')]
+        columns = zip(*(rows[col].tolist() for col in BALANCE_FIELDS))   # 比 to_dict('records') 快數倍
+        nodes[node] = {batch: dict(zip(BALANCE_FIELDS, values))
+                       for batch, values in zip(rows['batch_name'].tolist(), columns)}
+    records = df.groupby('batch_name', sort=False).size()
+    return nodes, dict(zip(records.index, records.tolist()))
+
+
+def compute_mass_balance_all(df, batches=None):
+    """所有批次的質量平衡,一次算完:{batch: 與 compute_mass_balance(df, batch) 相同的 dict}。
+
+    以 latest_balance_rows 取各節點最新一列,不再逐批次篩選、排序
+    (O(批次數 × 列數) → O(列數 log 列數))。batches 預設為 df 中所有 batch_name
+    (依出現順序);指定時沒有資料的批次也會回傳(records=0,其餘 None)。
+    """
+    nodes, records = latest_balance_rows(df)
+    if batches is None:
+        batches = list(records)
+    return {batch: balance_from_nodes(batch, {node: rows.get(batch) for node, rows in nodes.items()},
+                                      records.get(batch, 0))
+            for batch in batches}
+
+
 def threshold_color(ratio):
     """回傳成品再生含量對歐盟門檻的顏色標記:red / amber / green / gray。"""
     if ratio is None:
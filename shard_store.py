@@ -0,0 +1,342 @@
+"""
+按月分片的本地 CSV 儲存(不 import streamlit,方便 headless 單元測試)。
+
+單一 plastic_trace_data.csv 會無限長大,整表重寫(migration / save_data)的成本也跟著長。
+這裡改成一個月一檔(data/2026-10.csv):
+- append 只寫「當月」分片(AppendJournal group commit,落盤保證與單檔 CSV 相同);
+- 月份過了,舊分片壓成 2026-09.csv.gz 後視為不可變,讀過一次就留在記憶體;
+- manifest.json 記錄每個分片的列數與 timestamp 最小 / 最大值,load_range 只開
+  與日期區間重疊的分片;
+- get_history(qr_id) 明文分片走各自旁邊的 qr_id 索引(2026-10.qrindex.db,見 qr_index),
+  壓縮分片讀過一次後在記憶體內篩選。
+
+與 StorageBackend「寫入順序」的約定不同:load() 依月份串接,只保證同月內的寫入順序。
+append 一律寫進當月分片,所以只有 replace_all(save_data)會改變順序:整表依 timestamp
+月份重新分組,原本穿插在不同月份之間的列會被分開(test_storage_backend 有測)。
+
+分片檔以磁碟為準,manifest 只是索引:manifest 沒記到的分片一律視為可能重疊。
+manifest 在 append 落盤後(持鎖)更新,兩者之間當機統計會少算,壓縮分片時會由
+實際資料重算,也可呼叫 rebuild_manifest() 重建。
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from csv_store import AppendJournal, CsvTailReader, file_lock, format_record
+from qr_index import QrOffsetIndex, qr_index_path, remove_index_files
+from schema import empty_frame, ensure_schema, to_cell
+from storage_backend import StorageBackend, filter_date_range
+
+MANIFEST_FILE = 'manifest.json'
+_SHARD_RE = re.compile(r'^(\d{4}-\d{2})\.csv(\.gz)?$')
+_MONTH_RE = re.compile(r'^\d{4}-\d{2}')
+
+
+def month_of(timestamp):
+    """'2026-10-18 09:00:00' → '2026-10';無法判讀回 None。"""
+    match = _MONTH_RE.match(str(timestamp))
+    return match.group(0) if match else None
+
+
+def _shard_stats(frame, compressed):
+    stamps = frame['timestamp'][frame['timestamp'] != '']
+    return {
+        'rows': len(frame),
+        'min_ts': str(stamps.min()) if len(stamps) else None,
+        'max_ts': str(stamps.max()) if len(stamps) else None,
+        'compressed': compressed,
+    }
+
+
+def _concat(parts):
+    parts = [p for p in parts if len(p)]
+    if not parts:
+        return empty_frame()
+    return parts[0] if len(parts) == 1 else pd.concat(parts, ignore_index=True)
+
+
+class ShardedCsvStore(StorageBackend):
+    """data 目錄下的月分片 CSV;thread-safe,同一目錄在 process 內共用一個即可。
+
+    clock 回傳 epoch 秒(測試可注入),決定「當月」是哪個分片。
+    """
+
+    name = 'sharded'
+
+    def __init__(self, directory, clock=time.time):
+        self.directory = directory
+        self._clock = clock
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._readers = {}    # 明文分片路徑 -> CsvTailReader(增量讀取)
+        self._journals = {}   # 月份 -> AppendJournal
+        self._frozen = {}     # 壓縮分片路徑 -> ((mtime_ns, size), frame)
+        self._qr_indexes = {}  # 明文分片路徑 -> QrOffsetIndex
+        self._loaded = None   # (分片 frame 清單, 合併後 frame):分片都沒變就不重新 concat
+        self._checked_month = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def current_month(self):
+        return datetime.datetime.fromtimestamp(self._clock()).strftime('%Y-%m')
+
+    def _path(self, month, compressed=False):
+        return os.path.join(self.directory, f'{month}.csv' + ('.gz' if compressed else ''))
+
+    def _shard_files(self):
+        """{月份: [檔名...]}(依月份排序)。同月可能同時有 .csv.gz 與 .csv
+        (壓縮後才寫到的 append),壓縮檔在前、較新的明文檔在後。"""
+        files = {}
+        for name in os.listdir(self.directory):
+            match = _SHARD_RE.match(name)
+            if match:
+                files.setdefault(match.group(1), []).append(name)
+        return {month: sorted(names, key=lambda n: not n.endswith('.gz'))
+                for month, names in sorted(files.items())}
+
+    def _journal(self, month):
+        with self._lock:
+            journal = self._journals.get(month)
+            if journal is None:
+                journal = self._journals[month] = AppendJournal(self._path(month))
+            return journal
+
+    # ─── manifest ────────────────────────────────────────────────
+    def manifest(self):
+        """{'shards': {月份: {'rows', 'min_ts', 'max_ts', 'compressed'}}}"""
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {'shards': {}}
+
+    def _write_manifest(self, manifest):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.manifest_path)
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """manifest 與分片檔案結構的異動鎖(本 process thread 鎖 + 跨 process flock)。"""
+        with self._lock, open(self.manifest_path + '.lock', 'ab') as f, file_lock(f.fileno()):
+            yield
+
+    def rebuild_manifest(self):
+        """由實際分片內容重建 manifest。"""
+        with self._locked():
+            manifest = {'shards': {}}
+            for month, names in self._shard_files().items():
+                frame = _concat(self._read_file(name) for name in names)
+                manifest['shards'][month] = _shard_stats(frame, f'{month}.csv' not in names)
+            self._write_manifest(manifest)
+        return manifest
+
+    # ─── 讀 ──────────────────────────────────────────────────────
+    def _read_file(self, name):
+        path = os.path.join(self.directory, name)
+        if not name.endswith('.gz'):
+            with self._lock:
+                reader = self._readers.get(path)
+                if reader is None:
+                    reader = self._readers[path] = CsvTailReader(path)
+            return reader.read()
+        st_ = os.stat(path)
+        key = (st_.st_mtime_ns, st_.st_size)
+        hit = self._frozen.get(path)
+        if hit is not None and hit[0] == key:
+            return hit[1]
+        frame = ensure_schema(pd.read_csv(path, dtype=str, keep_default_na=False,
+                                          encoding='utf-8-sig', compression='gzip'))
+        self._frozen[path] = (key, frame)
+        return frame
+
+    def load(self):
+        """全部分片依月份串接(同月內依寫入順序)。"""
+        parts = [p for names in self._shard_files().values()
+                 for p in (self._read_file(name) for name in names) if len(p)]
+        loaded = self._loaded
+        if (loaded is not None and len(loaded[0]) == len(parts)
+                and all(a is b for a, b in zip(loaded[0], parts))):
+            return loaded[1]
+        frame = _concat(parts)
+        self._loaded = (parts, frame)
+        return frame
+
+    def load_range(self, start, end):
+        """timestamp 日期落在 [start, end](含)的列;只讀 manifest 顯示與區間重疊的分片。"""
+        files = self._shard_files()
+        names = [name for month in self.shards_for_range(start, end) for name in files[month]]
+        return filter_date_range(_concat(self._read_file(name) for name in names), start, end)
+
+    def get_history(self, qr_id):
+        """某 qr_id 的全部列(依月份、同月依寫入順序)。明文分片只讀該 QR 的列。
+
+        查詢途中該分片剛好被壓縮(索引已關閉)就重新列出分片再查一次。
+        """
+        for _ in range(3):
+            try:
+                return self._history(qr_id)
+            except sqlite3.ProgrammingError:
+                continue
+        return self._history(qr_id)
+
+    def _history(self, qr_id):
+        parts = []
+        for names in self._shard_files().values():
+            for name in names:
+                if name.endswith('.gz'):
+                    frame = self._read_file(name)
+                    parts.append(frame[frame['qr_id'] == qr_id])
+                else:
+                    parts.append(self._qr_index(os.path.join(self.directory, name)).history(qr_id))
+        return _concat(parts).reset_index(drop=True)
+
+    def _qr_index(self, path):
+        with self._lock:
+            index = self._qr_indexes.get(path)
+            if index is None:
+                index = self._qr_indexes[path] = QrOffsetIndex(path)
+            return index
+
+    def _drop_qr_index(self, path):
+        """明文分片 path 不再存在(壓縮 / 整表改寫)時:關閉並刪除它旁邊的 qr_id 索引檔。"""
+        with self._lock:
+            index = self._qr_indexes.pop(path, None)
+        if index is not None:
+            index.close()
+        remove_index_files(qr_index_path(path))
+
+    def shards_for_range(self, start, end):
+        """與 [start, end] 可能重疊的分片月份(manifest 沒記到的也算)。"""
+        lo, hi = str(start)[:10], str(end)[:10]
+        shards = self.manifest()['shards']
+        months = []
+        for month in self._shard_files():
+            entry = shards.get(month)
+            if entry is None or (entry['min_ts'] is not None
+                                 and entry['min_ts'][:10] <= hi and entry['max_ts'][:10] >= lo):
+                months.append(month)
+        return months
+
+    def version(self):
+        """資料版本:所有分片與 manifest 的 (檔名, 大小, mtime);任何 process 寫入後都會變。"""
+        out = []
+        for name in sorted(os.listdir(self.directory)):
+            if _SHARD_RE.match(name) or name == MANIFEST_FILE:
+                st_ = os.stat(os.path.join(self.directory, name))
+                out.append((name, st_.st_size, st_.st_mtime_ns))
+        return tuple(out)
+
+    def stats(self):
+        shards = self.manifest()['shards']
+        size = sum(os.path.getsize(os.path.join(self.directory, name))
+                   for names in self._shard_files().values() for name in names)
+        return {'backend': self.name, 'rows': sum(s['rows'] for s in shards.values()),
+                'shards': len(shards), 'compressed': sum(s['compressed'] for s in shards.values()),
+                'bytes': size}
+
+    # ─── 寫 ──────────────────────────────────────────────────────
+    def append_many(self, records):
+        """寫進當月分片(換月後第一次寫入先壓縮上個月以前的分片),再更新 manifest。"""
+        if not records:
+            return
+        month = self.current_month()
+        if self._checked_month != month:
+            self.compress_closed_shards(month)
+            self._checked_month = month
+        self._journal(month).append_many([format_record(r) for r in records])
+        stamps = [s for s in (to_cell(r.get('timestamp', '')) for r in records) if s]
+        with self._locked():
+            manifest = self.manifest()
+            entry = manifest['shards'].setdefault(
+                month, {'rows': 0, 'min_ts': None, 'max_ts': None, 'compressed': False})
+            entry['rows'] += len(records)
+            if stamps:
+                entry['min_ts'] = min(stamps + ([entry['min_ts']] if entry['min_ts'] else []))
+                entry['max_ts'] = max(stamps + ([entry['max_ts']] if entry['max_ts'] else []))
+            self._write_manifest(manifest)
+
+    def _write_shard(self, month, frame, compressed):
+        path = self._path(month, compressed)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            frame.to_csv(f, index=False, encoding='utf-8-sig',
+                         compression='gzip' if compressed else None)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def compress_closed_shards(self, before=None):
+        """把 before(預設當月)之前仍是明文 .csv 的分片壓成 .csv.gz;回傳壓縮了哪些月份。
+
+        壓縮時持該分片 journal 的跨 process 鎖;其他 process 等鎖後發現檔案已刪會重開
+        新的 .csv(見 AppendJournal._write),不會寫丟,下次壓縮時再併入。
+        """
+        before = before or self.current_month()
+        done = []
+        with self._locked():
+            manifest = self.manifest()
+            for month, names in self._shard_files().items():
+                if month >= before or f'{month}.csv' not in names:
+                    continue
+                with self._journal(month).exclusive():
+                    frame = _concat(self._read_file(name) for name in names)
+                    self._write_shard(month, frame, compressed=True)
+                    os.remove(self._path(month))
+                self._readers.pop(self._path(month), None)
+                self._drop_qr_index(self._path(month))
+                manifest['shards'][month] = _shard_stats(frame, compressed=True)
+                done.append(month)
+            if done:
+                self._write_manifest(manifest)
+        return done
+
+    def replace_all(self, df):
+        """整表取代(對應 save_data):依 timestamp 月份重新分片,當月以前的直接寫成壓縮檔。
+
+        timestamp 無法判讀的列歸到當月。之後 load() 依月份排列、同月內保持 df 的順序,
+        不是 df 原本的列順序(見模組說明)。
+        """
+        df = ensure_schema(df, copy=False)
+        current = self.current_month()
+        months = [month_of(ts) or current for ts in df['timestamp']]
+        with self._locked():
+            with self._journal(current).exclusive():
+                for names in self._shard_files().values():
+                    for name in names:
+                        os.remove(os.path.join(self.directory, name))
+                        if not name.endswith('.gz'):
+                            self._drop_qr_index(os.path.join(self.directory, name))
+                manifest = {'shards': {}}
+                # 用 Series 分組:長度 1 的 list 會被當成「欄名 list」,月份變成 tuple
+                for month, part in df.groupby(pd.Series(months, index=df.index), sort=True):
+                    compressed = month < current
+                    self._write_shard(month, part, compressed)
+                    manifest['shards'][month] = _shard_stats(part, compressed)
+                self._write_manifest(manifest)
+            self._readers.clear()
+            self._frozen.clear()
+            self._loaded = None
+
+    def migrate_from_csv(self, csv_path):
+        """一次性把既有單檔 CSV 依月份拆進空的分片目錄;已有分片則不動。回傳匯入列數。"""
+        if self._shard_files() or not os.path.exists(csv_path):
+            return 0
+        df = CsvTailReader(csv_path).read()
+        if df.empty:
+            return 0
+        self.replace_all(df)
+        return len(df)
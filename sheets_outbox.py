@@ -0,0 +1,215 @@
+"""
+Google Sheets 寫入的本地 outbox(write-behind 佇列;不 import streamlit,方便 headless 單元測試)。
+
+掃描登錄只需等本地寫入落盤就返回;要送到 Sheets 的列先 append 到磁碟上的 outbox
+(JSON Lines,一列一行,fsync 後才返回),再由背景 thread 送出:
+- 佇列中的列合併成一次 append_rows(最多 max_batch 列),卡車到場的一波掃碼只打一次 API。
+- 失敗(配額 429、網路)不丟列,以指數退避(含抖動)重試;process 重啟後從磁碟續送。
+- 已送出的位置記在旁邊的 .ack 檔(byte offset),全部送完才把 outbox 截斷歸零。
+  送出成功但 ack 尚未寫入就當機 → 重啟後那批會再送一次(至少一次,不會漏)。
+- 多個 process 共用同一 outbox:寫入與讀取以 outbox 檔的 flock 互斥;送出則由 .lock 檔
+  的非阻塞 flock 保證同一時間只有一個 process 在送。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+from csv_store import file_lock
+
+
+class SheetsOutbox:
+    """磁碟上的待送佇列 + 背景送出 thread。
+
+    send(rows) 收到 list[list[str]](COLUMNS 順序),失敗時 raise;on_sent() 在每批
+    送出成功後呼叫(給上層失效快取用)。兩者都在背景 thread 執行,不可呼叫 st.*。
+    """
+
+    def __init__(self, path, send=None, base_delay=2.0, max_delay=300.0,
+                 max_batch=500, linger=0.2, poll_interval=30.0):
+        self.path = path
+        self.ack_path = path + '.ack'
+        self.lock_path = path + '.lock'
+        self.send = send
+        self.on_sent = None
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self.linger = linger                # 被喚醒後先等一下,讓同一波的列一起送
+        self.poll_interval = poll_interval  # 沒人喚醒時也定期看一次(接手其他 process 留下的列)
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.last_error = ''
+        self.sent = 0
+        self._drain_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ─── 寫入端 ──────────────────────────────────────────────────
+    def enqueue(self, rows):
+        """把多列寫進 outbox;返回時已 fsync,之後交給背景 thread。"""
+        if not rows:
+            return
+        now = time.time()
+        data = ''.join(json.dumps({'t': now, 'row': list(row)}, ensure_ascii=False) + '\n'
+                       for row in rows).encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            with file_lock(fd):
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._wake.set()
+
+    # ─── 讀取 / 確認 ─────────────────────────────────────────────
+    def _read_ack(self):
+        try:
+            with open(self.ack_path, 'r', encoding='ascii') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_ack(self, offset):
+        tmp = self.ack_path + '.tmp'
+        with open(tmp, 'w', encoding='ascii') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ack_path)
+
+    def _pending(self, limit=None):
+        """([entry...], end):尚未確認的完整行(最多 limit 筆)與其後的 byte offset。"""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return [], 0
+        with f:
+            with file_lock(f.fileno()):
+                ack = self._read_ack()
+                if ack > os.fstat(f.fileno()).st_size:
+                    ack = 0   # 截斷後、ack 歸零前當機
+                f.seek(ack)
+                data = f.read()
+        entries = []
+        end = ack
+        for line in data.splitlines(keepends=True):
+            if limit is not None and len(entries) >= limit:
+                break
+            if not line.endswith(b'\n'):
+                break   # 寫到一半的行(當機殘留)不送
+            end += len(line)
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue   # 壞行略過,位置照樣推進
+        return entries, end
+
+    def _commit(self, end):
+        """確認 end 之前都已送出;佇列清空時把 outbox 截斷,避免檔案無限長大。"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with file_lock(fd):
+                if end >= os.fstat(fd).st_size:
+                    os.ftruncate(fd, 0)
+                    end = 0
+                self._write_ack(end)
+        finally:
+            os.close(fd)
+
+    def pending_rows(self):
+        """尚未送出的列(供讀取端合併,自己剛寫的列立刻看得到)。"""
+        return [entry['row'] for entry in self._pending()[0]]
+
+    def stats(self):
+        """佇列深度、最舊一筆已等待秒數、重試狀態。"""
+        entries, _ = self._pending()
+        now = time.time()
+        return {
+            'depth': len(entries),
+            'oldest_age': now - entries[0]['t'] if entries else None,
+            'sent': self.sent,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'retry_in': max(0.0, self.next_attempt - now) if self.failures else 0.0,
+            'running': self._thread is not None and self._thread.is_alive(),
+        }
+
+    # ─── 送出端 ──────────────────────────────────────────────────
+    def drain_once(self):
+        """送出一批,回傳列數;其他 thread / process 正在送時回傳 0。send 失敗則 raise。"""
+        if not self._drain_lock.acquire(blocking=False):
+            return 0
+        try:
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                with file_lock(fd, blocking=False) as acquired:
+                    if not acquired:
+                        return 0
+                    entries, end = self._pending(self.max_batch)
+                    if entries:
+                        self.send([entry['row'] for entry in entries])
+                    if end:
+                        self._commit(end)
+            finally:
+                os.close(fd)
+        finally:
+            self._drain_lock.release()
+        if entries:
+            self.sent += len(entries)
+            if self.on_sent:
+                self.on_sent()
+        return len(entries)
+
+    def drain(self):
+        """一直送到佇列清空(或碰到別人正在送);失敗時記錄錯誤並排定退避重試。"""
+        try:
+            while self.drain_once() >= self.max_batch:
+                pass
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f'{type(e).__name__}: {e}'
+            backoff = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+            self.next_attempt = time.time() + backoff * random.uniform(0.5, 1.0)
+            return False
+        self.failures = 0
+        self.last_error = ''
+        self.next_attempt = 0.0
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            delay = self.next_attempt - time.time()
+            self._wake.wait(delay if delay > 0 else self.poll_interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if time.time() < self.next_attempt:
+                continue   # 退避中:新進的列不提前重試
+            time.sleep(self.linger)
+            self.drain()
+
+    def start(self):
+        """啟動背景送出 thread(daemon;重複呼叫只會有一條)。"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='sheets-outbox', daemon=True)
+                self._thread.start()
+
+    def retry_now(self):
+        """取消退避等待,立刻再試一次。"""
+        self.next_attempt = 0.0
+        self._wake.set()
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
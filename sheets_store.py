@@ -0,0 +1,211 @@
+"""
+Google Sheets 工作表的本地鏡像(不 import streamlit / gspread,方便 headless 單元測試)。
+
+worksheet 只需提供 gspread Worksheet 的 get_values / batch_get / batch_update / resize / row_count。
+
+- 第一次載入:get_values() 整張取回(全部是字串,與 CSV 的 dtype=str 語意一致)。
+- 之後:一次 batch_get 只取「表頭列」+「上次最後一列起到表尾」兩段。
+  表頭相同且上次最後一列仍在原位、內容不變 → 只把新增的列接上去;
+  否則(有人刪列、整表重寫、表頭改了)才退回整張重抓。
+  掃碼之間的重新載入成本只剩一個小範圍請求,與總列數無關。
+- 給了 revision(回傳試算表最後修改時間的 callable,一次 Drive metadata 呼叫):
+  版本沒變就直接用鏡像,連上述的小範圍請求都省掉;鏡像另存成磁碟快取(Parquet +
+  版本),process 重啟或其他 replica 冷啟動時版本相同即直接載入,不用整張重抓。
+- 儲存:與鏡像逐列比對雜湊,只把變動的連續區段用一次 batch_update 送出;列數變了
+  才 resize。不再 clear() 後整表重傳,讀者不會看到「空表」的瞬間。
+"""
+
+import contextlib
+import os
+
+import pandas as pd
+
+from csv_store import read_snapshot, write_snapshot
+from schema import COLUMNS, ensure_schema, empty_frame
+
+
+def _runs(indexes):
+    """遞增的索引 → 連續區段 [(start, stop), ...]。"""
+    runs = []
+    for i in indexes:
+        if runs and runs[-1][1] == i:
+            runs[-1][1] = i + 1
+        else:
+            runs.append([i, i + 1])
+    return [tuple(r) for r in runs]
+
+
+def col_letter(n):
+    """1 → 'A'、16 → 'P'、27 → 'AA'。"""
+    letters = ''
+    while n > 0:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(ord('A') + rem) + letters
+    return letters
+
+
+class SheetsMirror:
+    """記住上次取回的表頭與資料列,load() 只抓新增的部分。
+
+    cache_path / revision / cache_key 皆可省略;cache_key 用來確認磁碟快取
+    屬於同一張工作表(例如 '<spreadsheet id>:<worksheet id>')。
+    """
+
+    def __init__(self, worksheet, cache_path=None, revision=None, cache_key=''):
+        self.worksheet = worksheet
+        self.cache_path = cache_path
+        self.revision_fn = revision
+        self.cache_key = cache_key
+        self.full_fetches = 0
+        self.incremental_fetches = 0
+        self.revision_hits = 0
+        self.cache_loads = 0
+        self.reset()
+
+    def reset(self):
+        """丟掉鏡像,下次 load() 整張重抓。"""
+        self.header = None    # 試算表第一列(原樣,未補欄)
+        self.rows = []        # 資料列,每列補齊/截到表頭寬度
+        self.revision = None  # 鏡像對應的試算表版本;None = 未知,需向 Sheets 確認
+        self._frame = empty_frame()
+
+    def mark_stale(self):
+        """自己剛寫過試算表:版本失效(Drive 的 modifiedTime 可能稍晚才更新),下次照常增量同步。"""
+        self.revision = None
+
+    def _current_revision(self):
+        if self.revision_fn is None:
+            return None
+        try:
+            return self.revision_fn()
+        except Exception:
+            return None   # metadata 取不到就當不知道,走一般載入
+
+    def _pad(self, row):
+        width = len(self.header)
+        row = [str(v) for v in row[:width]]
+        return row + [''] * (width - len(row))
+
+    def _to_frame(self, rows):
+        if not rows:
+            return empty_frame()
+        return ensure_schema(pd.DataFrame(rows, columns=self.header))
+
+    def load(self):
+        """回傳目前整張表的 16 欄字串 frame。"""
+        revision = self._current_revision()
+        if revision is not None:
+            if self.header and revision == self.revision:
+                self.revision_hits += 1
+                return self._frame
+            if not self.header and self._restore_cache(revision):
+                self.cache_loads += 1
+                return self._frame
+        # 先取版本再抓:抓取途中若有人寫入,下次版本不符會再同步
+        frame = self._fetch()
+        if revision is not None:
+            self.revision = revision
+            self._write_cache()
+        return frame
+
+    def _restore_cache(self, revision):
+        if not self.cache_path:
+            return False
+        cached = read_snapshot(self.cache_path)
+        if cached is None:
+            return False
+        frame, meta = cached
+        if meta.get('revision') != revision or meta.get('key') != self.cache_key:
+            return False
+        self.header = list(COLUMNS)
+        self.rows = frame.values.tolist()
+        self.revision = revision
+        self._frame = frame
+        return True
+
+    def _write_cache(self):
+        # 只快取標準表頭的表(舊欄位表的原始列無法從 16 欄 frame 還原)
+        if not self.cache_path or self.header != COLUMNS:
+            return
+        try:
+            # 多個 process 同時冷啟動會一起寫:write_snapshot 各用自己的暫存檔再 os.replace
+            write_snapshot(self.cache_path, self._frame,
+                           {'revision': self.revision, 'key': self.cache_key})
+        except Exception:
+            # 快取寫不了(唯讀目錄、沒有 pyarrow)不影響載入;別的 process 可能已先刪掉
+            with contextlib.suppress(OSError):
+                os.remove(self.cache_path)
+
+    def _fetch(self):
+        if not self.header or not self.rows:
+            return self._full_fetch()
+        n = len(self.rows)
+        try:
+            # 試算表第 n+1 列 = 上次最後一列資料(第 1 列是表頭)
+            header_range, tail = self.worksheet.batch_get(
+                ['1:1', f'A{n + 1}:{col_letter(len(self.header))}'])
+        except Exception:
+            # 例如列數縮到比 n+1 還少 → 範圍超出格線;整張重抓
+            return self._full_fetch()
+        header = list(header_range[0]) if header_range else []
+        if header != self.header or not tail or self._pad(tail[0]) != self.rows[-1]:
+            return self._full_fetch()
+
+        self.incremental_fetches += 1
+        new_rows = [self._pad(row) for row in tail[1:]]
+        if new_rows:
+            self.rows.extend(new_rows)
+            self._frame = pd.concat([self._frame, self._to_frame(new_rows)], ignore_index=True)
+        return self._frame
+
+    def _full_fetch(self):
+        values = self.worksheet.get_values()
+        self.full_fetches += 1
+        if not values:
+            self.reset()
+            return self._frame
+        self.header = list(values[0])
+        self.rows = [self._pad(row) for row in values[1:]]
+        self._frame = self._to_frame(self.rows)
+        return self._frame
+
+    def save(self, df, full=False):
+        """把 df 寫成整張表(表頭 = COLUMNS),回傳實際送出的資料列數。
+
+        預設差異寫入:先增量同步鏡像,逐列比對雜湊,變動的連續區段合併成一次
+        batch_update;列數增加先 resize 再寫、減少則寫完再 resize 砍掉尾端。
+        full=True(或試算表表頭不是 COLUMNS)才整表重寫,同樣不經 clear()。
+        """
+        # ensure_schema 已把空值補成 '';整表 astype(str) 與逐格 to_cell 結果相同,快數倍
+        target = ensure_schema(df, copy=False).astype(str).to_numpy(dtype=object).tolist()
+        last = col_letter(len(COLUMNS))
+        if not full:
+            self.load()
+        if full or self.header != COLUMNS:
+            changed = list(range(len(target)))
+            updates = [{'range': f'A1:{last}{len(target) + 1}', 'values': [COLUMNS] + target}]
+            old_rows = None
+        else:
+            old_hashes = [hash(tuple(row)) for row in self.rows]
+            changed = [i for i, row in enumerate(target)
+                       if i >= len(old_hashes) or hash(tuple(row)) != old_hashes[i]]
+            updates = [{'range': f'A{start + 2}:{last}{stop + 1}', 'values': target[start:stop]}
+                       for start, stop in _runs(changed)]
+            old_rows = len(self.rows)
+
+        total = len(target) + 1
+        grid = getattr(self.worksheet, 'row_count', None)
+        if old_rows is None or old_rows != len(target):
+            if grid is None or grid < total:
+                self.worksheet.resize(rows=total)
+        if updates:
+            self.worksheet.batch_update(updates)
+        if (old_rows is None and grid is not None and grid > total) or \
+                (old_rows is not None and old_rows > len(target)):
+            self.worksheet.resize(rows=total)
+
+        self.header = list(COLUMNS)
+        self.rows = target
+        self._frame = self._to_frame(target)
+        self.mark_stale()
+        return len(changed)
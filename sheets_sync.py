@@ -0,0 +1,53 @@
+"""
+本地儲存與 Google Sheets 的雜湊對帳(不 import streamlit,方便 headless 單元測試)。
+
+每列 16 欄字串 → 一個雜湊;兩邊各是一個 multiset(內容完全相同的列可能合法地出現
+多次),差集就是「Sheets 缺的列」與「本地缺的列」。同步只把 Sheets 缺的列一次
+append_rows 補上:不清表、不重寫既有列,短暫斷線後重新對帳只傳差異。
+"""
+
+import collections
+import hashlib
+
+from schema import ensure_schema
+
+_SEP = '\x1f'   # unit separator:不會出現在正常輸入裡,避免 ('a|b', 'c') 與 ('a', 'b|c') 撞在一起
+
+
+def row_hashes(df):
+    """每列的 16-byte 雜湊(依 COLUMNS 順序、字串化後計算)。"""
+    rows = ensure_schema(df, copy=False).astype(str).to_numpy(dtype=object).tolist()
+    return [hashlib.blake2b(_SEP.join(row).encode('utf-8'), digest_size=16).digest()
+            for row in rows]
+
+
+def _multiset_minus(left, right):
+    """left 中扣掉 right 之後剩下的列位置(保持 left 的順序,重複列逐一抵銷)。"""
+    remaining = collections.Counter(right)
+    positions = []
+    for pos, h in enumerate(left):
+        if remaining[h]:
+            remaining[h] -= 1
+        else:
+            positions.append(pos)
+    return positions
+
+
+def reconcile(local_df, remote_df):
+    """對帳結果 dict:
+
+    - to_append:本地有、Sheets 沒有的列(本地順序),同步時 append 到 Sheets
+    - missing_local:Sheets 有、本地沒有的列(只回報,不自動寫回本地)
+    - matched:兩邊都有的列數
+    """
+    local = ensure_schema(local_df, copy=False).reset_index(drop=True)
+    remote = ensure_schema(remote_df, copy=False).reset_index(drop=True)
+    local_hashes = row_hashes(local)
+    remote_hashes = row_hashes(remote)
+    to_append = _multiset_minus(local_hashes, remote_hashes)
+    missing_local = _multiset_minus(remote_hashes, local_hashes)
+    return {
+        'to_append': local.iloc[to_append].reset_index(drop=True),
+        'missing_local': remote.iloc[missing_local].reset_index(drop=True),
+        'matched': len(local) - len(to_append),
+    }
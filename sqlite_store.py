@@ -0,0 +1,161 @@
+"""
+本地 SQLite 儲存(不 import streamlit,方便 headless 單元測試)。
+
+與 CSV / Google Sheets 並列的第三種儲存:
+- 一張 records 表,欄位即 schema.COLUMNS(全部 TEXT,與 CSV/Sheets 的字串語意一致),
+  另有自增 seq 保留寫入順序。
+- qr_id / batch_name / stage / timestamp 建索引 →「某 QR 的歷程」「某批次的列」是索引查詢。
+- WAL 模式:多支手機同時送出掃描登錄時,寫入只排隊彼此、不擋讀取。
+- 實作 storage_backend.StorageBackend;load_since 以 (epoch, seq) 為 cursor,走主鍵範圍查詢。
+"""
+
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+from csv_store import CsvTailReader
+from schema import COLUMNS, ensure_schema, empty_frame, to_cell
+from storage_backend import StorageBackend
+
+_COLS_SQL = ', '.join(f'"{c}"' for c in COLUMNS)
+_INSERT_SQL = f'INSERT INTO records ({_COLS_SQL}) VALUES ({", ".join("?" * len(COLUMNS))})'
+_INDEXED = ['qr_id', 'batch_name', 'stage', 'timestamp']
+
+
+def _row_values(record):
+    return [to_cell(record.get(col, '')) for col in COLUMNS]
+
+
+class SqliteStore(StorageBackend):
+    """SQLite 履歷資料庫。每個 thread 各用一條連線(sqlite3 連線不可跨 thread 共用)。"""
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # timeout = busy_timeout:另一個寫入者持有鎖時最多等 10 秒,不立即報錯
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        with conn:
+            cols = ', '.join(f'"{c}" TEXT NOT NULL DEFAULT \'\'' for c in COLUMNS)
+            conn.execute(f'CREATE TABLE IF NOT EXISTS records '
+                         f'(seq INTEGER PRIMARY KEY AUTOINCREMENT, {cols})')
+            for col in _INDEXED:
+                conn.execute(f'CREATE INDEX IF NOT EXISTS idx_records_{col} ON records ("{col}")')
+            # epoch:整表取代(replace_all)時 +1,讓版本號在「刪光不再寫」時也會變
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)')
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('epoch', 0)")
+
+    def _query(self, where='', params=()):
+        cur = self._conn().execute(f'SELECT {_COLS_SQL} FROM records {where} ORDER BY seq', params)
+        rows = cur.fetchall()
+        if not rows:
+            return empty_frame()
+        return ensure_schema(pd.DataFrame(rows, columns=COLUMNS))
+
+    # ─── 讀 ──────────────────────────────────────────────────────
+    def load(self):
+        """整份資料(依寫入順序)。"""
+        return self._query()
+
+    def history(self, qr_id):
+        """某 qr_id 的全部列(走 qr_id 索引)。"""
+        return self._query('WHERE qr_id = ?', (qr_id,))
+
+    def batch_rows(self, batch):
+        """某 batch 的全部列(走 batch_name 索引)。"""
+        return self._query('WHERE batch_name = ?', (batch,))
+
+    lookup_by_qr = history
+    lookup_by_batch = batch_rows
+
+    def load_since(self, cursor=None):
+        """cursor = (epoch, 最後 seq);epoch 變了(replace_all)就整份重給,reset=True。"""
+        conn = self._conn()
+        epoch = self._epoch()
+        reset = cursor is not None and cursor[0] != epoch
+        last = 0 if cursor is None or reset else cursor[1]
+        rows = conn.execute(f'SELECT seq, {_COLS_SQL} FROM records WHERE seq > ? ORDER BY seq',
+                            (last,)).fetchall()
+        if self._epoch() != epoch:   # 查詢途中被整表取代:下次再從頭
+            return self.load_since((None, 0))
+        frame = (ensure_schema(pd.DataFrame([r[1:] for r in rows], columns=COLUMNS))
+                 if rows else empty_frame())
+        return {'rows': frame, 'cursor': (epoch, rows[-1][0] if rows else last), 'reset': reset}
+
+    def stats(self):
+        size = sum(os.path.getsize(p) for p in (self.path, self.path + '-wal')
+                   if os.path.exists(p))
+        return {'backend': self.name, 'rows': self.count(), 'bytes': size}
+
+    def count(self):
+        return self._conn().execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def version(self):
+        """資料版本 (epoch, 最後 seq):任何 process 寫入後都會變,供快取比對。"""
+        conn = self._conn()
+        epoch = self._epoch()
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'records'").fetchone()
+        return (epoch, seq[0] if seq else 0)
+
+    def _epoch(self):
+        return self._conn().execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    # ─── 寫 ──────────────────────────────────────────────────────
+    def append(self, record):
+        """單列 INSERT(一個短交易);WAL 下不擋其他連線讀取。"""
+        conn = self._conn()
+        with conn:
+            conn.execute(_INSERT_SQL, _row_values(record))
+
+    def append_many(self, records):
+        conn = self._conn()
+        with conn:
+            conn.executemany(_INSERT_SQL, [_row_values(r) for r in records])
+
+    def replace_all(self, df):
+        """整表取代(對應 save_data);同一交易內刪除再寫入,讀者不會看到半套。"""
+        df = ensure_schema(df, copy=False)
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM records')
+            conn.executemany(_INSERT_SQL, [[to_cell(v) for v in row]
+                                           for row in df.itertuples(index=False, name=None)])
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'epoch'")
+
+    def migrate_from_csv(self, csv_path):
+        """一次性把既有 CSV 匯入空資料庫;資料庫已有資料則不動。回傳匯入列數。
+        檢查是否為空與匯入在同一個 BEGIN IMMEDIATE 交易內:多個 process 同時啟動也只會匯入一次。"""
+        if self.count() or not os.path.exists(csv_path):
+            return 0   # 快速路徑:已有資料就不必讀 CSV
+        df = CsvTailReader(csv_path).read()
+        if df.empty:
+            return 0
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]:
+                conn.execute('ROLLBACK')   # 讀 CSV 期間別的 process 已匯入
+                return 0
+            conn.executemany(_INSERT_SQL, [[to_cell(v) for v in row]
+                                           for row in df.itertuples(index=False, name=None)])
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        return len(df)
@@ -0,0 +1,160 @@
+"""
+儲存後端的共同介面(不 import streamlit / gspread,方便 headless 單元測試)。
+
+DataManager 目前有三種儲存:本地 CSV、本地 SQLite(sqlite_store.SqliteStore)、
+Google Sheets。這裡把它們共同的讀寫操作定成 StorageBackend:
+
+    load()                 整份資料(16 欄字串 frame,寫入順序)
+    load_since(cursor)     cursor 之後新增的列,見 load_since 說明
+    append(record)         單列 append(dict,缺欄補 '')
+    append_many(records)   多列一次 append
+    lookup_by_qr(qr_id)    某 QR 的全部列(寫入順序)
+    get_history(qr_id)     同 lookup_by_qr,給掃描頁的單點查詢:只讀該 QR 的列
+    lookup_by_batch(batch) 某批次的全部列
+    load_range(start, end) timestamp 日期落在 [start, end] 的列
+    stats()                {'backend', 'rows', ...} 給管理頁 / benchmark 顯示
+
+所有輸出都已過 ensure_schema;test_storage_backend.py 是每個後端都要通過的一致性
+測試,bench.py backends 在同樣的工作量上比較各後端。新增後端只要實作 load /
+append_many / stats,查詢與 load_since 有以 load() 為基礎的預設實作,可再覆寫成索引版本。
+例外:按月分片的 shard_store.ShardedCsvStore 整表改寫後依月份排列(同月內保持寫入順序)。
+"""
+
+import abc
+import os
+
+from csv_store import AppendJournal, CsvTailReader, format_record, read_header
+from qr_index import QrOffsetIndex
+from schema import COLUMNS, ensure_schema, to_cell
+
+
+def snapshot_path(csv_path):
+    """CSV 旁的欄式快照檔(plastic_trace_data.snapshot.parquet)。"""
+    return os.path.splitext(os.path.abspath(csv_path))[0] + '.snapshot.parquet'
+
+
+def filter_date_range(df, start, end):
+    """timestamp 日期(前 10 字元 YYYY-MM-DD)落在 [start, end](含)的列;start / end 可為 date 或字串。"""
+    day = df['timestamp'].astype(str).str[:10]
+    return df[(day >= str(start)[:10]) & (day <= str(end)[:10])].reset_index(drop=True)
+
+
+class StorageBackend(abc.ABC):
+    name = ''
+
+    @abc.abstractmethod
+    def load(self):
+        """整份資料(依寫入順序)。"""
+
+    @abc.abstractmethod
+    def append_many(self, records):
+        """多列一次 append;返回時已寫入儲存層。"""
+
+    @abc.abstractmethod
+    def stats(self):
+        """至少含 'backend' 與 'rows'。"""
+
+    def append(self, record):
+        self.append_many([record])
+
+    def lookup_by_qr(self, qr_id):
+        df = self.load()
+        return df[df['qr_id'] == qr_id].reset_index(drop=True)
+
+    def get_history(self, qr_id):
+        """某 QR 的全部列(寫入順序)。預設同 lookup_by_qr;有 qr_id 索引的後端覆寫成
+        只讀該 QR 的列,延遲不隨總列數成長。"""
+        return self.lookup_by_qr(qr_id)
+
+    def lookup_by_batch(self, batch):
+        df = self.load()
+        return df[df['batch_name'] == batch].reset_index(drop=True)
+
+    def load_range(self, start, end):
+        return filter_date_range(self.load(), start, end)
+
+    def load_since(self, cursor=None):
+        """cursor 之後新增的列:回傳 {'rows': frame, 'cursor': 下次用的 cursor, 'reset': bool}。
+
+        cursor 由後端自訂、呼叫端只原樣傳回;None 表示從頭讀。資料被整表改寫
+        (save_data)後舊 cursor 失效,此時回傳整份資料且 reset=True,呼叫端應捨棄
+        先前累積的狀態。預設實作的 cursor 是 (列數, 最後一列的值):只驗證這兩項,
+        中間列被改寫而列數與最後一列不變時偵測不到;需要精確偵測的後端請覆寫
+        (SqliteStore 以整表取代時遞增的 epoch 判斷)。
+        """
+        df = self.load()
+        seen, last = cursor if cursor is not None else (0, None)
+        reset = cursor is not None and not (
+            len(df) >= seen and (seen == 0 or tuple(df.iloc[seen - 1]) == last))
+        start = 0 if reset else seen
+        rows = df.iloc[start:].reset_index(drop=True)
+        next_cursor = (len(df), tuple(df.iloc[-1]) if len(df) else None)
+        return {'rows': rows, 'cursor': next_cursor, 'reset': reset}
+
+
+class CsvBackend(StorageBackend):
+    """本地 CSV:append 走 AppendJournal(group commit),讀取走 CsvTailReader(增量 + 快照),
+    get_history 走 CSV 旁的 qr_id → byte 範圍索引(qr_index.QrOffsetIndex,第一次查詢時建立)。
+
+    reader / journal / qr_index 可由呼叫端傳入,讓同一檔在 process 內共用一份增量狀態與 flusher。
+    """
+
+    name = 'csv'
+
+    def __init__(self, path, reader=None, journal=None, qr_index=None):
+        self.path = path
+        self.reader = reader if reader is not None else CsvTailReader(path, snapshot_path(path))
+        self.journal = journal if journal is not None else AppendJournal(path)
+        self.qr_index = qr_index
+
+    def load(self):
+        return self.reader.read()
+
+    def append_many(self, records):
+        """若既有檔仍是舊欄位,先一次性 migration 補欄重寫;新檔表頭由 journal 補上。"""
+        if not self.journal.header_current():
+            with self.journal.exclusive():
+                if read_header(self.path) not in (None, COLUMNS):
+                    # 舊檔欄位不符 → 補欄重寫(持跨 process 鎖,其他 append 等它)
+                    migrated = self.reader.read()
+                    migrated.to_csv(self.path, header=True, index=False, encoding='utf-8-sig')
+        self.journal.append_many([format_record(r) for r in records])
+
+    def get_history(self, qr_id):
+        if self.qr_index is None:
+            self.qr_index = QrOffsetIndex(self.path)
+        return self.qr_index.history(qr_id)
+
+    def stats(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {'backend': self.name, 'rows': len(self.load()), 'bytes': size,
+                'snapshot': os.path.exists(snapshot_path(self.path))}
+
+
+class SheetsBackend(StorageBackend):
+    """Google Sheets:包一個 GoogleSheetsManager(配額、SingleFlight、差異鏡像都在它裡面)。
+
+    讀取失敗直接 raise(fetch_data),不會被當成空表。
+    """
+
+    name = 'sheets'
+
+    def __init__(self, manager):
+        self.manager = manager
+
+    def load(self):
+        return ensure_schema(self.manager.fetch_data(), copy=False).reset_index(drop=True)
+
+    def append_many(self, records):
+        if records:
+            self.manager.append_rows([[to_cell(r.get(col, '')) for col in COLUMNS]
+                                      for r in records])
+
+    def stats(self):
+        calls = self.manager.get_call_metrics()
+        return {'backend': self.name, 'rows': len(self.load()),
+                'api_calls': sum(row['calls'] for row in calls),
+                'rate_limited_429': sum(row['rate_limited_429'] for row in calls)}
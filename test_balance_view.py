@@ -0,0 +1,52 @@
+"""
+balance_view.py 單元測試(headless,不需 streamlit)。
+apply / sync / 快照等投影共同行為見 test_projection.py。
+執行:python -m pytest test_balance_view.py -v
+"""
+
+import random
+
+import pandas as pd
+import pytest
+
+from balance_view import BatchBalanceView
+from schema import (COLUMNS, SCAN_STAGES, STAGE_FACTORY_OUT, STAGE_INITIAL, STAGE_RECYCLE,
+                    compute_mass_balance, compute_mass_balance_all, ensure_schema)
+
+_NUMBERS = ['', '0', '100', '85.5', ' 42 ', 'abc', 'nan']   # 含空白、非數字、nan
+
+
+def _rec(batch, **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(batch_name=batch, **kw)
+    return base
+
+
+def _frame(records):
+    return ensure_schema(pd.DataFrame(records, columns=COLUMNS))
+
+
+def _random_frame(rng, rows):
+    """rows 筆隨機記錄:3 個批次、各階段、重量 / 比率混入不合法值,timestamp 常重複。"""
+    return _frame([_rec(rng.choice(['b1', 'b2', 'b3']), stage=rng.choice([STAGE_INITIAL] + SCAN_STAGES),
+                        timestamp=f'2026-06-16 0{rng.randint(8, 9)}:00:00',
+                        weight_kg=rng.choice(_NUMBERS), recycled_ratio=rng.choice(_NUMBERS),
+                        data_tier=rng.choice(['', '實測(初級)', '推估(二級)']))
+                   for _ in range(rows)])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_view_matches_compute_mass_balance_all(seed):
+    rng = random.Random(seed)
+    df = _random_frame(rng, rng.randint(1, 40))
+    view = BatchBalanceView(df)
+    assert view.all() == compute_mass_balance_all(df)
+    assert view.get('b1') == compute_mass_balance(df, 'b1')
+
+
+def test_apply_updates_its_batch():
+    view = BatchBalanceView(_frame([_rec('b', stage=STAGE_FACTORY_OUT,
+                                         timestamp='2026-06-16 08:00:00', weight_kg='1000')]))
+    view.apply(_rec('b', stage=STAGE_RECYCLE, timestamp='2026-06-16 09:00:00', weight_kg=850.0))
+    assert view.get('b')['recovery_rate'] == 85.0
+    assert view.get('none')['records'] == 0
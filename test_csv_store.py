@@ -0,0 +1,348 @@
+"""
+csv_store.py 純邏輯單元測試(headless,不需 streamlit)。
+執行:python -m pytest test_csv_store.py -v
+"""
+
+import multiprocessing
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import csv_store
+from schema import COLUMNS, STAGE_FACTORY_OUT, empty_frame, ensure_schema
+from csv_store import CsvTailReader, AppendJournal, HEADER_LINE, format_record
+
+
+def _rec(qr_id, **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, **kw)
+    return base
+
+
+def _write(path, records, mode='w'):
+    pd.DataFrame(records, columns=COLUMNS).to_csv(
+        path, mode=mode, header=(mode == 'w'), index=False, encoding='utf-8-sig')
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    return str(tmp_path / 'data.csv')
+
+
+def test_missing_file_returns_empty_16col(csv_path):
+    out = CsvTailReader(csv_path).read()
+    assert out.empty and list(out.columns) == COLUMNS
+
+
+def test_tail_reader_parses_only_appended_bytes(csv_path):
+    _write(csv_path, [_rec('A1'), _rec('A2')])
+    reader = CsvTailReader(csv_path)
+    assert reader.read()['qr_id'].tolist() == ['A1', 'A2']
+    offset = reader.offset
+
+    _write(csv_path, [_rec('A3', weight_kg=12.5)], mode='a')
+    out = reader.read()
+    assert out['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert out.loc[2, 'weight_kg'] == '12.5'
+    assert reader.rows == 3 and reader.offset > offset
+
+
+def test_unchanged_file_returns_cached_frame(csv_path):
+    _write(csv_path, [_rec('A1')])
+    reader = CsvTailReader(csv_path)
+    assert reader.read() is reader.read()
+
+
+def test_values_read_as_strings(csv_path):
+    """qr_id 像 '1E10' 不可被推斷成數字;空格是 '' 不是 NaN。"""
+    _write(csv_path, [_rec('1E10', weight_kg=100)])
+    out = CsvTailReader(csv_path).read()
+    assert out.loc[0, 'qr_id'] == '1E10'
+    assert out.loc[0, 'recycled_ratio'] == ''
+
+
+def test_partial_trailing_line_not_cached(csv_path):
+    _write(csv_path, [_rec('A1')])
+    reader = CsvTailReader(csv_path)
+    reader.read()
+    with open(csv_path, 'ab') as f:
+        f.write(b'A2,b')                               # 別的 process 寫到一半
+    assert reader.read()['qr_id'].tolist() == ['A1', 'A2']
+    assert reader.rows == 1
+    with open(csv_path, 'ab') as f:
+        f.write(b',,,,,,,,,,,,,,\n')
+    out = reader.read()
+    assert out['qr_id'].tolist() == ['A1', 'A2'] and out.loc[1, 'batch_name'] == 'b'
+    assert reader.rows == 2
+
+
+def test_shrink_triggers_full_reread(csv_path):
+    _write(csv_path, [_rec('A1'), _rec('A2')])
+    reader = CsvTailReader(csv_path)
+    reader.read()
+    _write(csv_path, [_rec('B1')])
+    assert reader.read()['qr_id'].tolist() == ['B1']
+
+
+def test_rewrite_with_same_or_larger_size_detected(csv_path):
+    """save_data 整表重寫後檔案可能不變小;offset 前指紋不符 → 整檔重讀。"""
+    _write(csv_path, [_rec('A1')])
+    reader = CsvTailReader(csv_path)
+    reader.read()
+    _write(csv_path, [_rec('B1'), _rec('B2'), _rec('B3')])
+    assert reader.read()['qr_id'].tolist() == ['B1', 'B2', 'B3']
+
+
+def test_header_change_triggers_full_reread(csv_path):
+    old_cols = COLUMNS[:11]
+    pd.DataFrame([{'qr_id': 'A1'}], columns=old_cols).to_csv(
+        csv_path, index=False, encoding='utf-8-sig')
+    reader = CsvTailReader(csv_path)
+    assert list(reader.read().columns) == COLUMNS        # 舊 11 欄補齊
+    # 一次性 migration 重寫成 16 欄 + 新列
+    _write(csv_path, [_rec('A1'), _rec('A2', material_type='PP')])
+    out = reader.read()
+    assert out['qr_id'].tolist() == ['A1', 'A2']
+    assert out.loc[1, 'material_type'] == 'PP'
+
+
+def test_reset_forces_full_reread(csv_path):
+    _write(csv_path, [_rec('A1')])
+    reader = CsvTailReader(csv_path)
+    reader.read()
+    reader.reset()
+    assert reader.offset == 0
+    assert reader.read()['qr_id'].tolist() == ['A1']
+
+
+def test_quoted_newline_in_notes_survives_tail_read(csv_path):
+    _write(csv_path, [_rec('A1')])
+    reader = CsvTailReader(csv_path)
+    reader.read()
+    _write(csv_path, [_rec('A2', notes='第一行\n第二行')], mode='a')
+    out = reader.read()
+    assert out.loc[1, 'notes'] == '第一行\n第二行'
+    assert reader.rows == 2
+
+
+def test_empty_file_is_empty_frame(csv_path):
+    empty_frame().to_csv(csv_path, index=False, encoding='utf-8-sig')
+    reader = CsvTailReader(csv_path)
+    assert reader.read().empty
+    _write(csv_path, [_rec('A1')], mode='a')
+    assert reader.read()['qr_id'].tolist() == ['A1']
+
+
+# ─── 欄式快照 ────────────────────────────────────────────────────
+@pytest.fixture
+def small_snapshots(monkeypatch):
+    monkeypatch.setattr(csv_store, 'SNAPSHOT_MIN_ROWS', 3)
+    monkeypatch.setattr(csv_store, 'SNAPSHOT_REFRESH_ROWS', 2)
+
+
+def _many(n, start=0):
+    return [_rec(f'Q{i}', batch_name=f'b{i % 3}', stage=STAGE_FACTORY_OUT,
+                 timestamp=f'2026-06-16 10:{i % 60:02d}:00', weight_kg=i * 1.5,
+                 recycled_ratio='' if i % 2 else 27, material_type='PP')
+            for i in range(start, start + n)]
+
+
+def test_snapshot_roundtrip_is_lossless(csv_path, small_snapshots):
+    records = _many(5)
+    records[1].update(weight_kg='100', timestamp='not-a-time')     # 轉型後無法原樣還原
+    records[2].update(weight_kg=' 3 ', recycled_ratio='abc')
+    _write(csv_path, records)
+    snap = csv_path + '.parquet'
+    expected = CsvTailReader(csv_path).read()
+    CsvTailReader(csv_path, snap).read()                           # 寫快照
+    assert os.path.exists(snap)
+    pd.testing.assert_frame_equal(CsvTailReader(csv_path, snap).read(), expected)
+
+
+def test_snapshot_stores_typed_columns(csv_path, small_snapshots):
+    _write(csv_path, _many(4))
+    snap = csv_path + '.parquet'
+    CsvTailReader(csv_path, snap).read()
+    schema_ = pq.read_schema(snap)
+    assert pa.types.is_float64(schema_.field('weight_kg').type)
+    assert pa.types.is_float64(schema_.field('recycled_ratio').type)
+    assert pa.types.is_timestamp(schema_.field('timestamp').type)
+    for col in ['stage', 'material_type', 'data_tier']:
+        assert pa.types.is_dictionary(schema_.field(col).type)
+
+
+def test_snapshot_plus_csv_tail(csv_path, small_snapshots):
+    _write(csv_path, _many(4))
+    snap = csv_path + '.parquet'
+    CsvTailReader(csv_path, snap).read()
+    _write(csv_path, _many(1, start=4), mode='a')                 # 快照之後 append
+    reader = CsvTailReader(csv_path, snap)
+    out = reader.read()
+    assert out['qr_id'].tolist() == [f'Q{i}' for i in range(5)]
+    pd.testing.assert_frame_equal(out, CsvTailReader(csv_path).read())
+
+
+def test_stale_snapshot_ignored_after_rewrite(csv_path, small_snapshots):
+    _write(csv_path, _many(4))
+    snap = csv_path + '.parquet'
+    CsvTailReader(csv_path, snap).read()
+    rewritten = _many(6)
+    rewritten[0]['notes'] = 'edited'
+    _write(csv_path, rewritten)                                   # 整表重寫、檔案變大
+    out = CsvTailReader(csv_path, snap).read()
+    assert out.loc[0, 'notes'] == 'edited' and len(out) == 6
+
+
+def test_snapshot_refreshed_as_tail_grows(csv_path, small_snapshots):
+    _write(csv_path, _many(3))
+    snap = csv_path + '.parquet'
+    reader = CsvTailReader(csv_path, snap)
+    reader.read()
+    _write(csv_path, _many(2, start=3), mode='a')
+    reader.read()
+    assert pq.read_metadata(snap).num_rows == 5
+
+
+def test_concurrent_snapshot_writers_do_not_collide(tmp_path):
+    snap = str(tmp_path / 'data.snapshot.parquet')
+    frame = ensure_schema(pd.DataFrame(_many(200), columns=COLUMNS).astype(str))
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def writer(n):
+        barrier.wait()
+        try:
+            for _ in range(5):
+                csv_store.write_snapshot(snap, frame, {'writer': n})
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    out, meta = csv_store.read_snapshot(snap)
+    pd.testing.assert_frame_equal(out, frame)
+    assert meta['writer'] in range(8)
+    assert os.listdir(tmp_path) == ['data.snapshot.parquet']   # 沒留下暫存檔
+
+
+# ─── group commit journal ───────────────────────────────────────
+def test_format_record_matches_pandas_to_csv(csv_path):
+    records = [_rec('A1', weight_kg=12.5, notes='含,逗號與"引號"\n與換行'),
+               _rec('A2', weight_kg=None, recycled_ratio=float('nan'))]
+    _write(csv_path, records)
+    with open(csv_path, 'rb') as f:
+        expected = f.read()
+    assert HEADER_LINE + b''.join(format_record(r) for r in records) == expected
+
+
+def test_journal_creates_file_with_header(csv_path):
+    AppendJournal(csv_path).append(format_record(_rec('A1')))
+    out = CsvTailReader(csv_path).read()
+    assert out['qr_id'].tolist() == ['A1'] and list(out.columns) == COLUMNS
+
+
+def test_journal_groups_concurrent_appends(csv_path):
+    journal = AppendJournal(csv_path, max_delay=0.05)
+    barrier = threading.Barrier(30)
+
+    def submit(i):
+        barrier.wait()
+        journal.append(format_record(_rec(f'Q{i}')))
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(30)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    out = CsvTailReader(csv_path).read()
+    assert sorted(out['qr_id']) == sorted(f'Q{i}' for i in range(30))
+    assert journal.records == 30
+    assert journal.flushes < 30                     # 至少有一批被合併
+
+
+def test_journal_append_is_durable_on_return(csv_path):
+    journal = AppendJournal(csv_path)
+    journal.append(format_record(_rec('A1')))
+    with open(csv_path, 'rb') as f:                 # append 返回即已寫入檔案
+        assert b'A1' in f.read()
+
+
+def test_journal_reopens_file_removed_while_waiting(csv_path):
+    journal = AppendJournal(csv_path, max_delay=0)
+    journal.append(format_record(_rec('A1')))
+    with journal.exclusive():
+        t = threading.Thread(target=journal.append, args=(format_record(_rec('A2')),))
+        t.start()
+        t.join(0.2)                                 # flusher 已開好舊檔、在等鎖
+        os.remove(csv_path)                         # 例如分片壓縮後刪掉明文檔
+    t.join(5)
+    out = CsvTailReader(csv_path).read()            # 寫進重開的新檔(含表頭),沒寫丟
+    assert out['qr_id'].tolist() == ['A2'] and list(out.columns) == COLUMNS
+
+
+def test_journal_write_error_raised_to_caller(tmp_path):
+    journal = AppendJournal(str(tmp_path / 'missing-dir' / 'data.csv'))
+    with pytest.raises(OSError):
+        journal.append(format_record(_rec('A1')))
+
+
+# ─── 跨 process 鎖 + 表頭快取 ────────────────────────────────────
+def _append_worker(path, worker, count):
+    journal = AppendJournal(path, max_delay=0)
+    for i in range(count):
+        # notes 遠大於 PIPE_BUF(4 KB),沒有鎖時多個 process 的 write 可能交錯
+        journal.append(format_record(_rec(f'P{worker}-{i}', notes='x' * 8000 + f'|{worker}-{i}')))
+
+
+@pytest.mark.skipif(csv_store.fcntl is None, reason='需要 fcntl(Linux/macOS)')
+def test_multiprocess_appends_no_lost_or_torn_rows(csv_path):
+    ctx = multiprocessing.get_context('spawn')
+    workers, count = 4, 40
+    procs = [ctx.Process(target=_append_worker, args=(csv_path, w, count)) for w in range(workers)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(timeout=120)
+        assert p.exitcode == 0
+    out = CsvTailReader(csv_path).read()
+    expected = {f'P{w}-{i}' for w in range(workers) for i in range(count)}
+    assert len(out) == workers * count                # 沒有遺失、沒有多出半列
+    assert set(out['qr_id']) == expected
+    for qr_id, notes in zip(out['qr_id'], out['notes']):
+        assert notes == 'x' * 8000 + '|' + qr_id[1:]  # 每列完整、沒被撕裂
+    with open(csv_path, 'rb') as f:
+        assert f.read().count(HEADER_LINE) == 1       # 只有一個 process 寫了表頭
+
+
+def test_header_check_cached_per_inode(csv_path, monkeypatch):
+    _write(csv_path, [_rec('A1')])
+    journal = AppendJournal(csv_path)
+    calls = []
+    real = csv_store.read_header
+    monkeypatch.setattr(csv_store, 'read_header', lambda p: calls.append(p) or real(p))
+    for i in range(5):
+        assert journal.header_current()
+        journal.append(format_record(_rec(f'B{i}')))
+    assert len(calls) == 1                            # 只讀一次表頭
+
+
+def test_header_check_detects_old_columns(csv_path):
+    pd.DataFrame([{'qr_id': 'A1'}], columns=COLUMNS[:11]).to_csv(
+        csv_path, index=False, encoding='utf-8-sig')
+    assert not AppendJournal(csv_path).header_current()
+
+
+def test_header_recheck_after_shrink(csv_path):
+    _write(csv_path, [_rec('A1'), _rec('A2')])
+    journal = AppendJournal(csv_path)
+    assert journal.header_current()
+    pd.DataFrame([{'qr_id': 'A1'}], columns=COLUMNS[:11]).to_csv(
+        csv_path, index=False, encoding='utf-8-sig')   # 同 inode 被改寫且變小
+    assert not journal.header_current()
@@ -0,0 +1,178 @@
+"""
+DataManager 整合測試(headless:本地儲存放在 tmp 目錄,Google Sheets 用 fake_sheets.FakeClient)。
+執行:python -m pytest test_data_manager.py -v
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import data_manager
+from fake_sheets import FakeClient
+from google_sheets_manager import GoogleSheetsManager, SheetsConnection
+from quota import QuotaGuard
+from schema import COLUMNS, STAGE_FACTORY_OUT, STAGE_INITIAL, STAGE_RECYCLE, to_cell
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+@pytest.fixture
+def local_dm(tmp_path, monkeypatch):
+    """本地 CSV 為主的 DataManager(tmp 目錄,不連 Sheets)。"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('APP_STORAGE_BACKEND', 'csv')
+    monkeypatch.setattr(data_manager, 'get_sheets_connection', lambda: None)
+    return data_manager.DataManager()
+
+
+def _count_loads(dm, monkeypatch):
+    """把 dm._load_uncached 換成計數版,回傳計數 list(快取沒命中才會讀儲存層)。"""
+    calls = []
+    load = dm._load_uncached
+
+    def counted():
+        calls.append(1)
+        return load()
+    monkeypatch.setattr(dm, '_load_uncached', counted)
+    return calls
+
+
+@pytest.fixture
+def sheets_dm(tmp_path, monkeypatch):
+    """Sheets 為主的 DataManager(本地備份為 tmp 目錄的 CSV);outbox 背景 thread 停掉,測試自己 drain。"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('APP_STORAGE_BACKEND', 'csv')
+    client = FakeClient()
+    quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6, base_delay=0.001)
+    conn = SheetsConnection('db')
+    conn.manager = GoogleSheetsManager('db', quiet=True, client=client, cache_path=None, quota=quota)
+    conn.state = 'ready'
+    monkeypatch.setattr(data_manager, 'get_sheets_connection', lambda: conn)
+    dm = data_manager.DataManager()
+    dm.outbox.stop()
+    yield dm, client
+    dm.outbox.stop()
+
+
+def _sheets_rows(dm, client, records):
+    """直接寫進 Sheets 的列(其他 replica / 容器重建前寫入的)。"""
+    worksheet = client.open('db').worksheet(dm.sheets_manager.worksheet_name)
+    worksheet.append_rows([[to_cell(v) for v in r.values()] for r in records])
+
+
+def test_sheets_history_includes_rows_missing_from_local_backup(sheets_dm):
+    dm, client = sheets_dm
+    assert dm.use_sheets
+    _sheets_rows(dm, client, [_rec('Q1', stage=STAGE_INITIAL, timestamp='2026-06-16 08:00:00'),
+                              _rec('Q1', stage=STAGE_FACTORY_OUT, timestamp='2026-06-16 09:00:00')])
+    # 容器重建後本地備份是空的,第一次掃描只在本地寫下新的一列
+    dm.append_record(_rec('Q1', stage=STAGE_RECYCLE, timestamp='2026-06-16 10:00:00'))
+    expected = [STAGE_INITIAL, STAGE_FACTORY_OUT, STAGE_RECYCLE]
+    assert dm.get_qr_history('Q1')['stage'].tolist() == expected
+    assert dm.outbox.drain_once() == 1
+    assert dm.get_qr_history('Q1')['stage'].tolist() == expected
+    assert dm.get_qr_batch('Q1') == 'b'
+
+
+def test_sheets_history_sees_rows_still_in_outbox(sheets_dm):
+    dm, client = sheets_dm
+    _sheets_rows(dm, client, [_rec('Q1')])
+    # 本地 append 失敗、只進了 outbox 的列
+    dm.outbox.enqueue([[to_cell(v) for v in _rec('Q3', batch='b3').values()]])
+    assert dm.get_qr_history('Q3')['batch_name'].tolist() == ['b3']
+    assert dm.get_qr_batch('Q3') == 'b3'
+
+
+def test_sheets_history_of_unknown_qr_is_empty(sheets_dm):
+    dm, client = sheets_dm
+    _sheets_rows(dm, client, [_rec('Q9', batch='b9')])
+    assert dm.get_qr_history('Q9')['batch_name'].tolist() == ['b9']
+    assert dm.get_qr_batch('none') is None and len(dm.get_qr_history('none')) == 0
+
+
+def test_local_history_uses_the_local_index(local_dm, monkeypatch):
+    local_dm.append_record(_rec('Q1', stage=STAGE_INITIAL))
+    local_dm.append_record(_rec('Q2'))
+    local_dm.append_record(_rec('Q1', stage=STAGE_RECYCLE))
+    loads = _count_loads(local_dm, monkeypatch)
+    assert local_dm.get_qr_history('Q1')['stage'].tolist() == [STAGE_INITIAL, STAGE_RECYCLE]
+    assert local_dm.get_qr_batch('Q2') == 'b' and local_dm.get_qr_batch('none') is None
+    assert not loads   # 只讀該 QR 的列,不載入整份資料
+
+
+# ─── 跨 session 共用的 load_data 快取 ─────────────────────────────
+def test_load_data_cache_hit_and_copies_are_private(local_dm, monkeypatch):
+    local_dm.append_record(_rec('Q1'))
+    loads = _count_loads(local_dm, monkeypatch)
+    first = local_dm.load_data()
+    first.loc[0, 'notes'] = '改過'
+    first['extra'] = 1
+    second = data_manager.DataManager().load_data()   # 另一個 session
+    assert len(loads) == 1
+    assert second['notes'].tolist() == [''] and 'extra' not in second.columns
+
+
+def test_writes_invalidate_cache(local_dm, monkeypatch):
+    loads = _count_loads(local_dm, monkeypatch)
+    assert local_dm.load_data().empty
+    local_dm.append_record(_rec('Q1'))
+    assert local_dm.load_data()['qr_id'].tolist() == ['Q1']
+    df = local_dm.load_data()
+    df.loc[0, 'notes'] = '已修正'
+    local_dm.save_data(df)
+    assert local_dm.load_data()['notes'].tolist() == ['已修正']
+    assert len(loads) == 3
+
+
+def test_write_from_another_process_invalidates_cache(local_dm):
+    local_dm.append_record(_rec('Q1'))
+    assert len(local_dm.load_data()) == 1
+    script = ('from schema import COLUMNS\n'
+              'from storage_backend import CsvBackend\n'
+              'record = {c: "" for c in COLUMNS}\n'
+              'record.update(qr_id="Q2", batch_name="b")\n'
+              f'CsvBackend({local_dm.csv_file!r}).append(record)\n')
+    env = {**os.environ, 'PYTHONPATH': os.path.dirname(os.path.abspath(data_manager.__file__))}
+    subprocess.run([sys.executable, '-c', script], check=True, env=env)
+    assert local_dm.load_data()['qr_id'].tolist() == ['Q1', 'Q2']
+
+
+def test_sync_to_sheets_invalidates_cache(sheets_dm, monkeypatch):
+    dm, client = sheets_dm
+    monkeypatch.setattr(data_manager, 'SHEETS_CACHE_TTL', 10 ** 9)   # 不讓時間桶換掉版本
+    worksheet = client.open('db').worksheet(dm.sheets_manager.worksheet_name)
+    worksheet.append_rows([[to_cell(v) for v in _rec('Q0').values()]])
+    dm._append_local(_rec('Q0'))
+    dm._append_local(_rec('Q1'))   # 只在本地備份
+    loads = _count_loads(dm, monkeypatch)
+    assert dm.load_data()['qr_id'].tolist() == ['Q0']
+    assert dm.load_data()['qr_id'].tolist() == ['Q0'] and len(loads) == 1
+    assert dm.sync_to_sheets()
+    assert dm.load_data()['qr_id'].tolist() == ['Q0', 'Q1']
+    assert len(loads) == 2
+
+
+def test_typed_load_is_derived_from_the_string_cache(local_dm, monkeypatch):
+    local_dm.append_record(_rec('Q1', weight_kg=12.5))
+    loads = _count_loads(local_dm, monkeypatch)
+    typed = local_dm.load_data(typed=True)
+    assert typed['weight_kg'].tolist() == [12.5]
+    assert local_dm.load_data()['weight_kg'].tolist() == ['12.5']
+    assert len(loads) == 1   # typed 與字串共用同一份快取
+
+
+def test_dashboard_reads_do_not_copy_the_cached_frame(local_dm, monkeypatch):
+    local_dm.append_record(_rec('Q1', stage=STAGE_INITIAL, timestamp='2026-06-16 08:00:00'))
+    copies = []
+    hand_out = data_manager._hand_out
+    monkeypatch.setattr(data_manager, '_hand_out', lambda frame: copies.append(1) or hand_out(frame))
+    assert local_dm.get_qr_state_summary()['qrs'] == 1
+    assert [e['qr_id'] for e in local_dm.list_recent_events()] == ['Q1']
+    assert local_dm.get_mass_balance('b') is not None
+    assert not copies   # 投影直接與共用快取 frame 對齊,不每次拷貝整份資料
@@ -0,0 +1,92 @@
+"""
+event_store.py 單元測試(headless,不需 streamlit)。
+執行:python -m pytest test_event_store.py -v
+"""
+
+import random
+
+import pandas as pd
+
+import event_store
+from event_store import EventStore, state_snapshot_path
+from schema import COLUMNS, SCAN_STAGES, STAGE_INITIAL, compute_mass_balance_all, ensure_schema
+
+
+def _random_frame(rng, rows):
+    """rows 筆隨機事件(10 個 QR、3 個批次、各階段),給快照 / 重播測試用。"""
+    records = []
+    for _ in range(rows):
+        record = {c: '' for c in COLUMNS}
+        record.update(qr_id=f'Q{rng.randint(0, 9)}', batch_name=rng.choice(['b1', 'b2', 'b3']),
+                      stage=rng.choice([STAGE_INITIAL] + SCAN_STAGES),
+                      timestamp=f'2026-06-16 0{rng.randint(8, 9)}:00:00',
+                      weight_kg=rng.choice(['', '100', '85.5']))
+        records.append(record)
+    return ensure_schema(pd.DataFrame(records, columns=COLUMNS))
+
+
+def _assert_matches(store, df):
+    assert store.seq == len(df)
+    fresh = EventStore()
+    fresh.sync(df)
+    for name, projection in store.projections.items():
+        assert projection.to_snapshot() == fresh.projections[name].to_snapshot()
+    assert store.balance.all() == compute_mass_balance_all(df)
+
+
+def test_snapshot_path_next_to_data(tmp_path):
+    assert state_snapshot_path(str(tmp_path / 'plastic_trace_data.csv')) == str(
+        tmp_path / 'plastic_trace_data.state.json')
+    assert state_snapshot_path(str(tmp_path)) == str(tmp_path / 'state.json')
+
+
+def test_restart_replays_only_events_after_snapshot(tmp_path):
+    path = str(tmp_path / 'data.state.json')
+    df = _random_frame(random.Random(0), 60)
+    store = EventStore(path)
+    store.sync(df.iloc[:40])      # 首次整份建立後寫快照
+
+    reopened = EventStore(path)   # 例如 server 重啟
+    assert reopened.seq == reopened.snapshot_seq == 40
+    statuses = reopened.sync(df)
+    assert 'rebuilt' not in statuses.values()
+    _assert_matches(reopened, df)
+    assert reopened.sync(df) == {'index': 'current', 'balance': 'current', 'qr_state': 'current'}
+
+
+def test_apply_then_sync_is_current_and_snapshots_periodically(tmp_path, monkeypatch):
+    monkeypatch.setattr(event_store, 'SNAPSHOT_EVERY', 5)
+    path = str(tmp_path / 'data.state.json')
+    df = _random_frame(random.Random(1), 30)
+    store = EventStore(path)
+    store.sync(df.iloc[:20])
+    for record in df.iloc[20:].to_dict('records'):
+        store.apply(record)
+    assert store.seq == 30 and store.snapshot_seq == 20
+    assert set(store.sync(df).values()) == {'current'}
+    assert store.snapshot_seq == 30      # 累積 >= SNAPSHOT_EVERY 個事件 → 重寫快照
+    _assert_matches(EventStore(path), df)
+
+
+def test_rewritten_log_rebuilds_and_reset_removes_snapshot(tmp_path):
+    path = str(tmp_path / 'data.state.json')
+    df = _random_frame(random.Random(2), 30)
+    EventStore(path).sync(df)
+    rewritten = df.iloc[::-1].reset_index(drop=True)
+    store = EventStore(path)
+    assert 'rebuilt' in store.sync(rewritten).values()
+    _assert_matches(store, rewritten)
+
+    store.reset()
+    assert not (tmp_path / 'data.state.json').exists()
+    assert store.seq == 0 and EventStore(path).seq == 0
+
+
+def test_corrupt_snapshot_is_ignored(tmp_path):
+    path = tmp_path / 'data.state.json'
+    path.write_text('{"format": 1, "seq": 3, "projections": {}}', encoding='utf-8')
+    store = EventStore(str(path))
+    assert store.seq == 0
+    df = _random_frame(random.Random(3), 10)
+    store.sync(df)
+    _assert_matches(store, df)
@@ -0,0 +1,157 @@
+"""
+fake_sheets.py 的行為測試,以及 GoogleSheetsManager 注入 FakeClient 的端到端測試
+(headless,不需網路 / Google 帳號)。
+執行:python -m pytest test_fake_sheets.py -v
+"""
+
+import pandas as pd
+import pytest
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+
+from fake_sheets import FakeClient
+from quota import QuotaGuard
+from schema import COLUMNS
+
+
+def _rec(qr_id, **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, **kw)
+    return base
+
+
+@pytest.fixture
+def client():
+    return FakeClient()
+
+
+@pytest.fixture
+def ws(client):
+    return client.create('db').add_worksheet('履歷資料', rows=5, cols=20)
+
+
+def test_open_missing_raises_gspread_errors(client):
+    with pytest.raises(SpreadsheetNotFound):
+        client.open('nope')
+    sheet = client.create('db')
+    assert client.open('db') is sheet
+    with pytest.raises(WorksheetNotFound):
+        sheet.worksheet('nope')
+
+
+def test_append_grows_grid_exactly_and_reads_trim(ws):
+    ws.append_row(['a', 'b', ''])
+    ws.append_rows([[str(i), ''] for i in range(6)])
+    assert ws.row_count == 7
+    assert ws.get_values()[0] == ['a', 'b'] and ws.get_values()[1] == ['0', '']
+    assert ws.batch_get(['1:1', 'A6:P']) == [[['a', 'b']], [['4'], ['5']]]
+    assert ws.acell('B1').value == 'b'
+
+
+def test_range_beyond_grid_is_400(ws):
+    ws.append_row(['a'])
+    with pytest.raises(APIError) as err:
+        ws.batch_get(['A6:P'])
+    assert err.value.code == 400
+    with pytest.raises(APIError):
+        ws.batch_update([{'range': 'A6:B6', 'values': [['x', 'y']]}])
+
+
+def test_update_batch_update_resize_clear(ws):
+    ws.update([['h1', 'h2'], ['1', '2']], 'A1')
+    ws.batch_update([{'range': 'B2:B3', 'values': [['x'], ['y']]}])
+    assert ws.get_values() == [['h1', 'h2'], ['1', 'x'], ['', 'y']]
+    ws.resize(rows=2)
+    assert ws.get_values() == [['h1', 'h2'], ['1', 'x']] and ws.row_count == 2
+    ws.clear()
+    assert ws.get_values() == []
+
+
+def test_get_all_records_numericises_like_gspread(ws):
+    ws.append_rows([['qr_id', 'weight_kg'], ['A1', '12.5'], ['A2', '']])
+    assert ws.get_all_records() == [{'qr_id': 'A1', 'weight_kg': 12.5},
+                                    {'qr_id': 'A2', 'weight_kg': ''}]
+
+
+def test_revision_changes_on_write(client, ws):
+    sheet = ws.spreadsheet
+    before = sheet.get_lastUpdateTime()
+    assert sheet.get_lastUpdateTime() == before
+    ws.append_row(['a'])
+    assert sheet.get_lastUpdateTime() > before
+
+
+def test_quota_and_latency():
+    sleeps = []
+    now = [0.0]
+    client = FakeClient(latency=0.05, clock=lambda: now[0], sleep=sleeps.append)
+    ws = client.create('db').add_worksheet('w', rows=10, cols=5)
+    sleeps.clear()
+    client.quota_per_minute = 5   # create + add_worksheet 已用掉 2 個
+    ws.append_row(['a'])
+    ws.get_values()
+    ws.get_values()
+    with pytest.raises(APIError) as err:
+        ws.get_values()
+    assert err.value.code == 429 and client.rejected == 1
+    assert sleeps == [0.05] * 4
+    now[0] += 61
+    assert ws.get_values() == [['a']]
+    assert client.requests['values_get'] == 4
+
+
+def test_error_rate_is_seeded():
+    def run():
+        client = FakeClient(seed=7)
+        ws = client.create('db').worksheet('Sheet1')
+        client.error_rate = 0.3
+        outcomes = []
+        for _ in range(30):
+            try:
+                ws.get_values()
+                outcomes.append(True)
+            except APIError:
+                outcomes.append(False)
+        return outcomes
+
+    first = run()
+    assert first == run() and not all(first) and any(first)
+
+
+# ─── GoogleSheetsManager 注入 FakeClient ──────────────────────
+
+@pytest.fixture
+def manager(client):
+    from google_sheets_manager import GoogleSheetsManager
+    # 測試不受 client 端節流影響;429 重試的退避縮到毫秒
+    quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6, base_delay=0.001)
+    return GoogleSheetsManager('db', quiet=True, client=client, cache_path=None, quota=quota)
+
+
+def test_manager_creates_sheet_with_header(manager, client):
+    ws = client.open('db').worksheet('履歷資料')
+    assert ws.get_values() == [COLUMNS]
+    assert manager.load_data().empty
+
+
+def test_manager_append_load_save_roundtrip(manager, client):
+    manager.append_rows([[_rec('A1', weight_kg='12.5')[c] for c in COLUMNS],
+                         [_rec('A2')[c] for c in COLUMNS]])
+    df = manager.load_data()
+    assert df['qr_id'].tolist() == ['A1', 'A2'] and df.loc[0, 'weight_kg'] == '12.5'
+
+    df = df.copy()
+    df.loc[1, 'notes'] = '改'
+    assert manager.save_data(df)
+    other = pd.DataFrame(client.open('db').worksheet('履歷資料').get_all_records(
+        numericise_ignore=['all']))
+    assert other['notes'].tolist() == ['', '改']
+    assert client.requests['values_clear'] == 0
+
+
+def test_manager_retries_quota_errors(manager, client):
+    client.error_rate = 0.5
+    for i in range(10):
+        manager.append_rows([[_rec(f'Q{i}')[c] for c in COLUMNS]])
+    client.error_rate = 0.0
+    assert manager.load_data()['qr_id'].tolist() == [f'Q{i}' for i in range(10)]
+    assert sum(r['rate_limited_429'] for r in manager.get_call_metrics()) == client.rejected > 0
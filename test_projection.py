@@ -0,0 +1,100 @@
+"""
+各投影(projection.Projection 子類)共同行為的測試(headless,不需 streamlit):
+逐筆 apply 與整份重建結果相同、sync 只補新列、整表改寫後重建、快照可還原。
+各投影自己的查詢結果見 test_record_index / test_balance_view / test_qr_state。
+執行:python -m pytest test_projection.py -v
+"""
+
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from balance_view import BatchBalanceView
+from projection import Projection
+from qr_state import QrStateTable
+from record_index import RecordIndex
+from schema import COLUMNS, SCAN_STAGES, STAGE_FACTORY_OUT, STAGE_INITIAL, STAGE_RECYCLE, ensure_schema
+
+PROJECTIONS = [RecordIndex, BatchBalanceView, QrStateTable]
+_NUMBERS = ['', '0', '100', '85.5', ' 42 ', 'abc', 'nan', '27']   # 含空白、非數字、nan
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+def _frame(records):
+    return ensure_schema(pd.DataFrame(records, columns=COLUMNS))
+
+
+def _random_frame(rng, rows):
+    """rows 筆隨機事件:10 個 QR、3 個批次、各階段,timestamp 只有四種(常有同時間的列)。"""
+    return _frame([_rec(f'Q{rng.randint(0, 9)}', rng.choice(['b1', 'b2', 'b3']),
+                        stage=rng.choice([STAGE_INITIAL] + SCAN_STAGES), operator=rng.choice(['甲', '乙']),
+                        timestamp=f'2026-06-16 0{rng.randint(8, 9)}:00:0{rng.randint(0, 1)}',
+                        weight_kg=rng.choice(_NUMBERS), recycled_ratio=rng.choice(_NUMBERS),
+                        data_tier=rng.choice(['', '實測(初級)', '推估(二級)']))
+                   for _ in range(rows)])
+
+
+@pytest.mark.parametrize('cls', PROJECTIONS)
+@pytest.mark.parametrize('seed', range(10))
+def test_apply_matches_rebuild(cls, seed):
+    rng = random.Random(seed)
+    df = _random_frame(rng, rng.randint(0, 40))
+    folded = cls()
+    for record in df.to_dict('records'):
+        folded.apply(record)
+    assert folded.to_snapshot() == cls(df).to_snapshot()
+
+
+@pytest.mark.parametrize('cls', PROJECTIONS)
+def test_sync_folds_appends_and_rebuilds_after_rewrite(cls):
+    df = _random_frame(random.Random(0), 30)
+    projection = cls()
+    assert projection.sync(df.iloc[:20]) == 'folded'
+    assert projection.sync(df) == 'folded'
+    assert projection.sync(df) == 'current'
+
+    rewritten = df.iloc[:25].copy()
+    rewritten.loc[24, 'notes'] = '已修正'   # 最後一列變了 → 不是單純 append
+    assert projection.sync(rewritten) == 'rebuilt'
+    assert projection.to_snapshot() == cls(rewritten).to_snapshot()
+    assert cls(df.iloc[:20]).sync(df, fold_limit=5) == 'rebuilt'   # 新列太多 → 向量化重建
+
+
+@pytest.mark.parametrize('cls', PROJECTIONS)
+def test_apply_then_sync_is_current(cls):
+    df = _frame([_rec('A', stage=STAGE_FACTORY_OUT, timestamp='2026-06-16 08:00:00', weight_kg='1000')])
+    projection = cls(df)
+    record = _rec('A', stage=STAGE_RECYCLE, timestamp='2026-06-16 09:00:00',
+                  weight_kg=850.0)   # 表單傳進來的可能是數值;儲存層讀回為 '850.0'
+    projection.apply(record)
+    after = ensure_schema(pd.concat([df, pd.DataFrame([record]).astype(str)], ignore_index=True))
+    assert projection.sync(after) == 'current'
+    assert projection.to_snapshot() == cls(after).to_snapshot()
+
+
+@pytest.mark.parametrize('cls', PROJECTIONS)
+def test_snapshot_round_trips_through_json(cls):
+    df = _random_frame(random.Random(1), 30)
+    restored = cls()
+    restored.restore(json.loads(json.dumps(cls(df.iloc[:20]).to_snapshot())))
+    assert restored.sync(df) == 'folded'   # 只補快照之後的列
+    assert restored.to_snapshot() == cls(df).to_snapshot()
+
+
+def test_subclass_missing_a_method_fails_on_instantiation():
+    class Partial(Projection):
+        def _reset(self):
+            self.seen = []
+
+        def _fold(self, cells):
+            self.seen.append(cells)
+
+    with pytest.raises(TypeError):
+        Partial()
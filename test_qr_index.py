@@ -0,0 +1,127 @@
+"""
+qr_index.py 單元測試(headless,不需 streamlit)。
+執行:python -m pytest test_qr_index.py -v
+"""
+
+import os
+import random
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import qr_index
+from csv_store import HEADER_LINE, format_record
+from qr_index import QrOffsetIndex, field_at, qr_index_path, split_records
+from schema import COLUMNS, ensure_schema
+
+
+def _rec(qr_id, **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, **kw)
+    return base
+
+
+def _append(path, records):
+    with open(path, 'ab') as f:
+        if f.tell() == 0:
+            f.write(HEADER_LINE)
+        f.write(b''.join(format_record(r) for r in records))
+
+
+def _expected(path, qr_id):
+    df = ensure_schema(pd.read_csv(path, dtype=str, keep_default_na=False, encoding='utf-8-sig'))
+    return df[df['qr_id'] == qr_id].reset_index(drop=True)
+
+
+def test_split_records_respects_quoted_newlines():
+    data = b'a,b\n"x\ny",1\n"say ""hi""",2\npartial,"open\n'
+    assert [data[s:e] for s, e in split_records(data)] == [
+        b'a,b\n', b'"x\ny",1\n', b'"say ""hi""",2\n']
+    assert field_at(b'"Q,1",b\r\n', 0) == 'Q,1'
+    assert field_at(b'Q1,b\r\n', 1) == 'b'
+    assert field_at(b'Q1\n', 3) == ''
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_history_matches_full_scan(tmp_path, seed, monkeypatch):
+    monkeypatch.setattr(qr_index, 'SCAN_CHUNK', 97)   # 逼出跨 chunk 的殘列
+    rng = random.Random(seed)
+    path = str(tmp_path / 'data.csv')
+    index = QrOffsetIndex(path)
+    notes = ['', '逗號,與"引號"', '換\n行', 'plain']
+    for _ in range(3):
+        _append(path, [_rec(rng.choice(['A', 'B', 'C,1', '"D"']), notes=rng.choice(notes),
+                            weight_kg=rng.choice(['', '12.5']))
+                       for _ in range(rng.randint(0, 15))])
+        for qr in ['A', 'B', 'C,1', '"D"', 'NOPE']:
+            history, expected = index.history(qr), _expected(path, qr)
+            assert list(history.columns) == COLUMNS
+            assert history.equals(expected) or (history.empty and expected.empty)
+
+
+def test_refresh_extends_on_append_and_rebuilds_on_rewrite(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    index = QrOffsetIndex(path)
+    assert index.refresh() == 'current'   # 檔案還不存在
+    _append(path, [_rec('A', stage='s1'), _rec('B')])
+    assert index.refresh() == 'rebuilt'
+    assert index.refresh() == 'current'
+    _append(path, [_rec('A', stage='s2')])
+    assert index.refresh() == 'extended'
+    assert index.history('A')['stage'].tolist() == ['s1', 's2']
+
+    ensure_schema(pd.DataFrame([_rec('A', stage='new')])).to_csv(
+        path, index=False, encoding='utf-8-sig')
+    assert index.history('A')['stage'].tolist() == ['new']
+    assert index.history('B').empty
+
+
+def test_partial_last_line_is_indexed_once_complete(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    _append(path, [_rec('A', stage='s1')])
+    line = format_record(_rec('A', stage='s2'))
+    with open(path, 'ab') as f:
+        f.write(line[:10])
+    index = QrOffsetIndex(path)
+    assert index.history('A')['stage'].tolist() == ['s1']
+    with open(path, 'ab') as f:
+        f.write(line[10:])
+    assert index.history('A')['stage'].tolist() == ['s1', 's2']
+
+
+def test_index_is_shared_through_the_sidecar_file(tmp_path):
+    path = str(tmp_path / 'plastic_trace_data.csv')
+    assert qr_index_path(path) == str(tmp_path / 'plastic_trace_data.qrindex.db')
+    _append(path, [_rec('A'), _rec('B')])
+    assert QrOffsetIndex(path).refresh() == 'rebuilt'
+    other = QrOffsetIndex(path)           # 例如另一個 server process
+    assert other.refresh() == 'current'
+    assert other.history('B')['qr_id'].tolist() == ['B']
+    other.reset()
+    assert other.refresh() == 'rebuilt'
+
+
+def test_legacy_header_finds_qr_column(tmp_path):
+    path = tmp_path / 'data.csv'
+    path.write_text('batch_name,qr_id,stage\nb1,A,s1\nb2,B,s2\n', encoding='utf-8')
+    history = QrOffsetIndex(str(path)).history('B')
+    assert history[['qr_id', 'batch_name', 'stage']].values.tolist() == [['B', 'b2', 's2']]
+
+
+def test_close_and_remove_index_files(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    _append(path, [_rec('A1')])
+    index = QrOffsetIndex(path)
+    other = []
+    thread = threading.Thread(target=lambda: other.append(len(index.history('A1'))))
+    thread.start()
+    thread.join()
+    assert other == [1]
+    index.close()                                  # 連別的 thread 開的連線一起關
+    qr_index.remove_index_files(qr_index_path(path))
+    assert sorted(os.listdir(tmp_path)) == ['data.csv']
+    with pytest.raises(sqlite3.ProgrammingError):
+        index.history('A1')
+    assert sorted(os.listdir(tmp_path)) == ['data.csv']   # 關閉後不會再建出索引檔
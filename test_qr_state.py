@@ -0,0 +1,82 @@
+"""
+qr_state.py 單元測試(headless,不需 streamlit)。
+apply / sync / 快照等投影共同行為見 test_projection.py。
+執行:python -m pytest test_qr_state.py -v
+"""
+
+import random
+
+import pandas as pd
+import pytest
+
+from qr_state import QrStateTable
+from schema import COLUMNS, SCAN_STAGES, STAGE_INITIAL, STAGE_RECYCLE, ensure_schema, to_float
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+def _frame(records):
+    return ensure_schema(pd.DataFrame(records, columns=COLUMNS))
+
+
+def _random_frame(rng, rows):
+    """rows 筆隨機事件:10 個 QR、各階段;timestamp 只有四種(常有同時間的列),重量混入不合法值。"""
+    return _frame([_rec(f'Q{rng.randint(0, 9)}', rng.choice(['b1', 'b2']),
+                        stage=rng.choice([STAGE_INITIAL] + SCAN_STAGES),
+                        timestamp=f'2026-06-16 0{rng.randint(8, 9)}:00:0{rng.randint(0, 1)}',
+                        weight_kg=rng.choice(['', '0', '85.5', ' 42 ', 'abc', 'nan']))
+                   for _ in range(rows)])
+
+
+def _reference(df):
+    """逐 QR 以 pandas 直接算(stable 排序後取最後一列)。"""
+    states = {}
+    for qr, rows in df.groupby('qr_id', sort=False):
+        ordered = rows.sort_values('timestamp', kind='mergesort')
+        weighed = ordered[ordered['weight_kg'].map(to_float).notna()]
+        states[qr] = {'qr_id': qr, 'batch_name': rows['batch_name'].iloc[0],
+                      'stage': ordered['stage'].iloc[-1], 'timestamp': ordered['timestamp'].iloc[-1],
+                      'weight_kg': to_float(weighed['weight_kg'].iloc[-1]) if len(weighed) else None,
+                      'events': len(rows)}
+    return states
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_table_matches_reference(seed):
+    rng = random.Random(seed)
+    df = _random_frame(rng, rng.randint(1, 40))
+    expected = _reference(df)
+    created = df[df['stage'] == STAGE_INITIAL]['qr_id'].nunique()
+    active = df[df['stage'] != STAGE_INITIAL]['qr_id'].nunique()
+
+    table = QrStateTable(df)
+    assert {qr: table.get(qr) for qr in expected} == expected
+    summary = table.summary()
+    assert summary['records'] == len(df) and summary['qrs'] == df['qr_id'].nunique()
+    assert (summary['created'], summary['active']) == (created, active)
+    assert summary['idle'] == len(set(df[df['stage'] == STAGE_INITIAL]['qr_id'])
+                                  - set(df[df['stage'] != STAGE_INITIAL]['qr_id']))
+    assert summary['by_stage'] == pd.Series(
+        [s['stage'] for s in expected.values()]).value_counts().to_dict()
+    latest = df.sort_values('timestamp', kind='mergesort').iloc[::-1].head(5)
+    assert [e['timestamp'] for e in table.recent()] == latest['timestamp'].tolist()
+    assert table.frame()['qr_id'].tolist() == list(expected)
+
+
+def test_apply_moves_tag_between_stages():
+    table = QrStateTable(_frame([_rec('A', stage=STAGE_INITIAL, timestamp='2026-06-16 08:00:00'),
+                                 _rec('B', stage=STAGE_INITIAL, timestamp='2026-06-16 08:00:00')]))
+    assert table.summary()['by_stage'] == {STAGE_INITIAL: 2}
+    assert table.summary()['idle'] == 2
+    table.apply(_rec('A', stage=STAGE_RECYCLE, timestamp='2026-06-16 09:00:00', weight_kg=850.0))
+    summary = table.summary()
+    assert summary['by_stage'] == {STAGE_INITIAL: 1, STAGE_RECYCLE: 1}
+    assert (summary['created'], summary['active'], summary['idle']) == (2, 1, 1)
+    assert table.get('A') == {'qr_id': 'A', 'batch_name': 'b', 'stage': STAGE_RECYCLE,
+                              'timestamp': '2026-06-16 09:00:00', 'weight_kg': 850.0, 'events': 2}
+    assert table.recent(1)[0]['qr_id'] == 'A'
+    assert table.get('none') is None
@@ -0,0 +1,198 @@
+"""
+quota.py 純邏輯單元測試(headless,不需 streamlit / gspread / 網路)。
+執行:python -m pytest test_quota.py -v
+"""
+
+import threading
+import time
+
+import pytest
+
+from quota import (CallMetrics, MeteredProxy, QuotaGuard, SingleFlight, TokenBucket,
+                   is_rate_limited)
+
+
+class FakeClock:
+    """假時鐘:sleep 只推進時間,測試不真的等。"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimited(Exception):
+    code = 429
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_bucket_allows_burst_then_throttles(clock):
+    bucket = TokenBucket(60, burst=10, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(10)] == [0.0] * 10
+    waited = bucket.acquire()
+    assert waited == pytest.approx(60 / 50)   # 補充速率 (60-10)/60 每秒
+    assert clock.now == pytest.approx(waited)
+
+
+def test_bucket_burst_is_clamped_to_half_the_quota(clock):
+    bucket = TokenBucket(60, burst=100, clock=clock, sleep=clock.sleep)
+    assert bucket.capacity == 30
+    assert [bucket.acquire() for _ in range(30)] == [0.0] * 30
+    assert bucket.acquire() == pytest.approx(60 / 30)   # 補充速率 (60-30)/60 每秒,不會趨近 0
+    assert TokenBucket(1, burst=10).capacity == 1
+
+
+def test_bucket_never_exceeds_quota_in_any_minute(clock):
+    bucket = TokenBucket(60, burst=10, clock=clock, sleep=clock.sleep)
+    times = []
+    for _ in range(300):
+        bucket.acquire()
+        times.append(clock.now)
+    for i, start in enumerate(times):
+        in_window = sum(1 for t in times[i:] if t < start + 60)
+        assert in_window <= 60
+
+
+def test_bucket_refills_while_idle(clock):
+    bucket = TokenBucket(60, burst=5, clock=clock, sleep=clock.sleep)
+    for _ in range(5):
+        bucket.acquire()
+    clock.now += 100
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+
+
+def test_is_rate_limited():
+    assert is_rate_limited(RateLimited())
+    assert is_rate_limited(RuntimeError('RESOURCE_EXHAUSTED: quota'))
+    assert not is_rate_limited(ValueError('bad range'))
+
+
+def test_guard_retries_429_with_backoff_and_records(clock):
+    guard = QuotaGuard(clock=clock, sleep=clock.sleep)
+    attempts = []
+
+    def flaky():
+        attempts.append(clock.now)
+        if len(attempts) < 3:
+            raise RateLimited()
+        return 'ok'
+
+    assert guard.call('batch_get', 'read', flaky) == 'ok'
+    assert len(attempts) == 3
+    assert clock.sleeps[0] >= 1.0 and clock.sleeps[-1] >= 2.0   # 1s、2s 起跳的指數退避
+    stats = guard.metrics.snapshot()['batch_get']
+    assert stats['calls'] == 3 and stats['errors'] == 2 and stats['rate_limited'] == 2
+
+
+def test_guard_gives_up_after_max_retries(clock):
+    guard = QuotaGuard(max_retries=2, clock=clock, sleep=clock.sleep)
+
+    def always():
+        raise RateLimited()
+
+    with pytest.raises(RateLimited):
+        guard.call('append_rows', 'write', always)
+    assert guard.metrics.snapshot()['append_rows']['calls'] == 3
+
+
+def test_guard_does_not_retry_other_errors(clock):
+    guard = QuotaGuard(clock=clock, sleep=clock.sleep)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError('bad range')
+
+    with pytest.raises(ValueError):
+        guard.call('batch_get', 'read', broken)
+    assert calls == [1] and clock.sleeps == []
+
+
+def test_guard_records_throttle_events(clock):
+    guard = QuotaGuard(reads_per_minute=60, burst=2, clock=clock, sleep=clock.sleep)
+    for _ in range(4):
+        guard.call('get_values', 'read', lambda: None)
+    stats = guard.metrics.snapshot()['get_values']
+    assert stats['calls'] == 4 and stats['throttled'] == 2 and stats['throttle_wait_s'] > 0
+    # 寫入有自己的桶,不受讀取影響
+    guard.call('append_rows', 'write', lambda: None)
+    assert 'throttled' in guard.metrics.snapshot()['append_rows']
+    assert guard.metrics.snapshot()['append_rows']['throttled'] == 0
+
+
+def test_metrics_rows_and_percentiles():
+    metrics = CallMetrics()
+    for seconds in [0.05] * 18 + [0.3, 3.0]:
+        metrics.record_call('batch_get', seconds)
+    row = metrics.rows()[0]
+    assert row['operation'] == 'batch_get' and row['calls'] == 20
+    assert row['p50_s'] == 0.1 and row['p95_s'] == 0.5
+
+
+def test_single_flight_merges_concurrent_calls():
+    flight = SingleFlight(CallMetrics())
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'frame'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('load', slow_load)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('load', slow_load)))
+                 for _ in range(4)]
+    for t in followers:
+        t.start()
+    while flight.metrics.snapshot().get('load', {}).get('merged', 0) < 4:
+        time.sleep(0.01)
+    release.set()
+    for t in [leader] + followers:
+        t.join()
+    assert calls == [1] and results == ['frame'] * 5
+    # 下一次呼叫重新執行
+    assert flight.do('load', lambda: 'again') == 'again'
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do('load', lambda: (_ for _ in ()).throw(ValueError('boom')))
+    assert flight.do('load', lambda: 1) == 1
+
+
+def test_metered_proxy_routes_calls(clock):
+    class Worksheet:
+        row_count = 7
+
+        def batch_get(self, ranges):
+            return [[r] for r in ranges]
+
+        def append_rows(self, rows):
+            return len(rows)
+
+        def title(self):
+            return 'x'
+
+    guard = QuotaGuard(clock=clock, sleep=clock.sleep)
+    ws = MeteredProxy(Worksheet(), guard, reads=['batch_get'], writes=['append_rows'])
+    assert ws.row_count == 7
+    assert ws.batch_get(['A1:B1']) == [['A1:B1']]
+    assert ws.append_rows([[1], [2]]) == 2
+    assert ws.title() == 'x'
+    assert set(guard.metrics.snapshot()) == {'batch_get', 'append_rows'}
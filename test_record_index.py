@@ -0,0 +1,59 @@
+"""
+record_index.py 單元測試(headless,不需 streamlit)。
+apply / sync / 快照等投影共同行為見 test_projection.py。
+執行:python -m pytest test_record_index.py -v
+"""
+
+import random
+
+import pandas as pd
+import pytest
+
+from record_index import RecordIndex
+from schema import COLUMNS, ensure_schema
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+def _frame(records):
+    return ensure_schema(pd.DataFrame(records, columns=COLUMNS))
+
+
+def _random_frame(rng, rows):
+    """rows 筆隨機記錄:10 個 QR、3 個批次(同一 QR 可能跨批次)。"""
+    return _frame([_rec(f'Q{rng.randint(0, 9)}', rng.choice(['b1', 'b2', 'b3']))
+                   for _ in range(rows)])
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_lookups_match_boolean_masks(seed):
+    rng = random.Random(seed)
+    df = _random_frame(rng, rng.randint(0, 50))
+    index = RecordIndex(df)
+    for qr in [f'Q{i}' for i in range(11)]:
+        assert df.iloc[index.qr_positions(df, qr)].equals(df[df['qr_id'] == qr])
+        first = df[df['qr_id'] == qr]['batch_name']
+        assert index.batch_of(df, qr) == (first.iloc[0] if len(first) else None)
+    for batch in ['b1', 'b2', 'b3', 'none']:
+        assert df.iloc[index.batch_positions(df, batch)].equals(df[df['batch_name'] == batch])
+
+
+def test_lookups_follow_a_rewritten_frame():
+    df = _random_frame(random.Random(0), 20)
+    index = RecordIndex(df)
+    rewritten = df.iloc[::-1].reset_index(drop=True)
+    assert rewritten.iloc[index.qr_positions(rewritten, 'Q1')].equals(
+        rewritten[rewritten['qr_id'] == 'Q1'])
+
+
+def test_positions_always_refer_to_the_callers_frame():
+    """別的 session 已把索引推進到較新版本,拿舊 frame 查詢仍得到舊 frame 內的位置。"""
+    old = _frame([_rec('A')])
+    new = _frame([_rec('A'), _rec('A')])
+    index = RecordIndex(new)
+    assert index.qr_positions(old, 'A') == [0]
+    assert index.qr_positions(new, 'A') == [0, 1]
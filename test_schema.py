@@ -8,7 +8,7 @@ import pytest
 
 import schema
 from schema import (
-    COLUMNS, ensure_schema, to_float, compute_mass_balance, threshold_color,
+    COLUMNS, ensure_schema, to_float, to_cell, compute_mass_balance, threshold_color, display_frame,
     STAGE_FACTORY_OUT, STAGE_TRANSPORT, STAGE_BACKEND_IN, STAGE_RECYCLE,
     STAGE_PRODUCT, STAGE_INITIAL,
 )
@@ -69,6 +69,48 @@ def test_ensure_schema_converts_nan_to_empty_string():
     assert mats == ['PP']
 
 
+def test_ensure_schema_fast_path_skips_conforming_frame():
+    df = ensure_schema(pd.DataFrame([{'qr_id': 'A', 'weight_kg': 1.5}]))
+    assert df.attrs[schema.SCHEMA_MARK] == 'str'
+    assert ensure_schema(df, copy=False) is df                 # 只讀:原物件直接沿用
+    copied = ensure_schema(df)
+    assert copied is not df
+    copied.loc[0, 'qr_id'] = 'B'                                # 預設 copy:改它不影響原 frame
+    assert df.loc[0, 'qr_id'] == 'A'
+    # 標記跟著篩選 / reset_index 傳遞
+    subset = df[df['qr_id'] == 'A'].reset_index(drop=True)
+    assert ensure_schema(subset, copy=False) is subset
+
+
+def test_ensure_schema_renormalizes_altered_frames():
+    df = ensure_schema(pd.DataFrame([{'qr_id': 'A'}]))
+    extra = df.assign(junk='x')                                 # 欄位變了 → 走完整正規化
+    assert list(ensure_schema(extra, copy=False).columns) == COLUMNS
+    typed = ensure_schema(df, typed=True)                       # 模式不同 → 轉換
+    assert ensure_schema(typed, copy=False).attrs[schema.SCHEMA_MARK] == 'str'
+    assert ensure_schema(typed, typed=True, copy=False) is typed
+    df.loc[0, 'notes'] = None                                   # 原地寫缺值:移除標記後重新正規化
+    df.attrs.pop(schema.SCHEMA_MARK)
+    assert ensure_schema(df).loc[0, 'notes'] == ''
+
+
+def test_compute_mass_balance_does_not_renormalize_conforming_frame(monkeypatch):
+    df = ensure_schema(pd.DataFrame([
+        _row(qr_id='A', batch_name='b1', stage=STAGE_FACTORY_OUT,
+             timestamp='2026-06-16 09:00:00', weight_kg='100'),
+        _row(qr_id='A', batch_name='b1', stage=STAGE_RECYCLE,
+             timestamp='2026-06-16 12:00:00', weight_kg='90'),
+        _row(qr_id='B', batch_name='b2', stage=STAGE_FACTORY_OUT,
+             timestamp='2026-06-16 09:00:00', weight_kg='50'),
+    ]))
+
+    def fail(*args, **kwargs):
+        raise AssertionError('conforming frame was normalized again')
+    monkeypatch.setattr(pd.DataFrame, 'reindex', fail)
+    assert compute_mass_balance(df, 'b1')['feed_kg'] == 100
+    assert compute_mass_balance(df, 'b2')['feed_kg'] == 50
+
+
 def test_roundtrip_append_then_load_keeps_new_columns():
     """模擬 append→reload:新欄不可在來回後消失(對應 A2 的回歸測試)。"""
     rec = {c: '' for c in COLUMNS}
@@ -81,6 +123,59 @@ def test_roundtrip_append_then_load_keeps_new_columns():
     assert df2.loc[0, 'data_tier'] == '實測(初級)'
 
 
+# ─── typed 模式 / display_frame ─────────────────────────────────
+def _typed_sample():
+    return pd.DataFrame([
+        {**{c: '' for c in COLUMNS}, 'qr_id': 'A1', 'stage': STAGE_FACTORY_OUT,
+         'timestamp': '2026-06-16 08:00:00', 'weight_kg': '1000.0', 'recycled_ratio': '27.5',
+         'material_type': 'PP', 'data_tier': '實測(初級)', 'is_elv_closedloop': '是'},
+        {**{c: '' for c in COLUMNS}, 'qr_id': 'A2', 'stage': '舊階段名',
+         'timestamp': '', 'weight_kg': '', 'material_type': ''},
+    ], columns=COLUMNS)
+
+
+def test_typed_mode_dtypes_and_fixed_categories():
+    out = ensure_schema(_typed_sample(), typed=True)
+    assert list(out.columns) == COLUMNS
+    assert str(out['weight_kg'].dtype) == 'Float64'
+    assert out['weight_kg'].tolist() == [1000.0, pd.NA]
+    assert pd.api.types.is_datetime64_any_dtype(out['timestamp'])
+    assert out['timestamp'].isna().tolist() == [False, True]
+    for col, fixed in schema.CATEGORY_COLUMNS.items():
+        assert list(out[col].cat.categories[:len(fixed)]) == fixed
+    assert out.loc[1, 'stage'] == '舊階段名'          # 選單外的舊值附加在後,不遺失
+    assert pd.isna(out.loc[1, 'material_type'])        # '' 為缺值
+    assert out['qr_id'].tolist() == ['A1', 'A2']
+
+
+def test_typed_mode_unparseable_values_become_missing():
+    df = _typed_sample()
+    df.loc[0, 'weight_kg'] = '約 5 公斤'
+    df.loc[0, 'timestamp'] = '昨天'
+    out = ensure_schema(df, typed=True)
+    assert pd.isna(out.loc[0, 'weight_kg']) and pd.isna(out.loc[0, 'timestamp'])
+
+
+def test_typed_frame_roundtrips_through_ensure_schema():
+    df = _typed_sample()
+    back = ensure_schema(ensure_schema(df, typed=True))
+    assert back.equals(ensure_schema(df))
+
+
+def test_display_frame_has_no_na_markers():
+    typed = ensure_schema(_typed_sample(), typed=True)
+    shown = display_frame(typed[['stage', 'timestamp', 'weight_kg', 'material_type']])
+    assert shown.loc[0].tolist() == [STAGE_FACTORY_OUT, '2026-06-16 08:00:00', '1000.0', 'PP']
+    assert shown.loc[1].tolist() == ['舊階段名', '', '', '']
+    assert display_frame(_typed_sample()).equals(_typed_sample())   # 字串 frame 原樣
+
+
+def test_typed_mode_is_smaller():
+    df = pd.concat([_typed_sample()] * 500, ignore_index=True)
+    typed = ensure_schema(df, typed=True)
+    assert typed.memory_usage(deep=True).sum() < df.memory_usage(deep=True).sum()
+
+
 # ─── to_float 邊界 ──────────────────────────────────────────────
 @pytest.mark.parametrize("value,expected", [
     ('', None), ('   ', None), ('nan', None), ('NaN', None), ('none', None),
@@ -96,6 +191,54 @@ def test_to_float_nan_float():
     assert to_float(float('nan')) is None
 
 
+def _random_cell(rng):
+    """to_float 會遇到的各種儲存格:數字字串、空白、nan / none、垃圾、數值、缺值。"""
+    number = rng.choice([rng.uniform(-1e6, 1e6), rng.randint(-1000, 1000),
+                         rng.uniform(0, 100), float(f'1e{rng.randint(-330, 330)}')])
+    return rng.choice([
+        str(number), repr(float(number)), f'{number:.3e}', f'  {number} ', f'+{abs(number)}',
+        '', ' ', 'nan', 'NaN', 'None', 'none', '-nan', 'inf', '-Infinity', '1_000', '１２',
+        '.5', '5.', '1e', 'e5', 'abc', '12kg', '--1', '0x10', '1,5',
+        number, float(number), None, float('nan'), True,
+    ])
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_to_float_series_matches_scalar_to_float(seed):
+    import math
+    import random
+    rng = random.Random(seed)
+    cells = [_random_cell(rng) for _ in range(300)]
+    if seed % 2:   # 一半只有字串(CSV / SQLite 讀回的樣子),走 Arrow 批次路徑
+        cells = ['' if c is None or isinstance(c, float) and math.isnan(c) else str(c)
+                 for c in cells]
+    series = pd.Series(cells, dtype=object, index=range(100, 400))
+    out = schema.to_float_series(series)
+    assert out.dtype == 'float64' and list(out.index) == list(series.index)
+    for cell, got in zip(cells, out):
+        expected = to_float(cell)
+        if expected is None or math.isnan(expected):
+            assert math.isnan(got), cell
+        else:
+            assert got == expected, cell
+
+
+def test_to_float_series_string_and_numeric_dtypes():
+    import math
+    assert schema.to_float_series(pd.Series(['1.5', '', 'x'], dtype='str')).tolist()[0] == 1.5
+    assert math.isnan(schema.to_float_series(pd.Series(['1.5', '', 'x']))[1])
+    assert schema.to_float_series(pd.Series([1, 2])).tolist() == [1.0, 2.0]
+    assert schema.to_float_series(pd.Series([], dtype=object)).empty
+
+
+@pytest.mark.parametrize("value,expected", [
+    (None, ''), (float('nan'), ''), ('', ''), ('abc', 'abc'),
+    (12.5, '12.5'), (100.0, '100.0'), (0, '0'),
+])
+def test_to_cell(value, expected):
+    assert to_cell(value) == expected
+
+
 # ─── recycled_ratio 邊界(透過 compute) ─────────────────────────
 def _row(**kw):
     base = {c: '' for c in COLUMNS}
@@ -185,6 +328,17 @@ def test_mass_balance_insufficient_data_returns_none():
     assert mb['recycled_content'] is None
 
 
+def test_mass_balance_same_on_typed_frame():
+    df = pd.DataFrame([
+        _row(batch_name='b', stage=STAGE_FACTORY_OUT,
+             timestamp='2026-06-16 08:00:00', weight_kg='1000', recycled_ratio='90'),
+        _row(batch_name='b', stage=STAGE_PRODUCT,
+             timestamp='2026-06-16 11:00:00', weight_kg='850',
+             recycled_ratio='27', data_tier='實測(初級)'),
+    ])
+    assert compute_mass_balance(ensure_schema(df, typed=True), 'b') == compute_mass_balance(df, 'b')
+
+
 def test_mass_balance_filters_by_batch():
     df = pd.DataFrame([
         _row(batch_name='b1', stage=STAGE_FACTORY_OUT,
@@ -195,6 +349,46 @@ def test_mass_balance_filters_by_batch():
     assert compute_mass_balance(df, 'b1')['feed_kg'] == 1000.0
 
 
+def _random_batch_frame(rng, rows):
+    """少量批次 / 時間點(大量同 timestamp)、重量與比率混入空值與無法轉換的值。"""
+    stages = [STAGE_INITIAL, STAGE_FACTORY_OUT, STAGE_TRANSPORT, STAGE_BACKEND_IN,
+              STAGE_RECYCLE, STAGE_PRODUCT, schema.STAGE_SALE, '舊階段']
+    cells = ['', '0', '100', '85.5', '1e3', ' 42 ', 'abc', 'nan', '-3', '27']
+    return pd.DataFrame([
+        _row(qr_id=f'Q{rng.randint(0, 9)}', batch_name=rng.choice(['b1', 'b2', 'b3', '']),
+             stage=rng.choice(stages),
+             timestamp=f'2026-06-{rng.randint(15, 16)} 0{rng.randint(8, 9)}:00:00',
+             weight_kg=rng.choice(cells), recycled_ratio=rng.choice(cells),
+             data_tier=rng.choice(['', '實測(初級)', '推估(二級)']))
+        for _ in range(rows)
+    ])
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_mass_balance_all_matches_per_batch(seed):
+    import random
+    rng = random.Random(seed)
+    df = _random_batch_frame(rng, rng.randint(0, 40))
+    batches = list(df['batch_name'].unique()) if len(df) else []
+    expected = {batch: compute_mass_balance(df, batch) for batch in batches}
+    assert schema.compute_mass_balance_all(df) == expected
+    # 指定批次(含不存在的)
+    assert (schema.compute_mass_balance_all(df, ['b1', 'none'])
+            == {'b1': compute_mass_balance(df, 'b1'), 'none': compute_mass_balance(df, 'none')})
+
+
+def test_mass_balance_same_timestamp_takes_later_row():
+    """同一 timestamp 的兩筆:以寫入順序較後者為準(單批次與全批次一致)。"""
+    df = pd.DataFrame([
+        _row(batch_name='b', stage=STAGE_FACTORY_OUT,
+             timestamp='2026-06-16 08:00:00', weight_kg='500'),
+        _row(batch_name='b', stage=STAGE_FACTORY_OUT,
+             timestamp='2026-06-16 08:00:00', weight_kg='1000'),
+    ])
+    assert compute_mass_balance(df, 'b')['feed_kg'] == 1000.0
+    assert schema.compute_mass_balance_all(df)['b']['feed_kg'] == 1000.0
+
+
 # ─── threshold_color(歐盟門檻) ────────────────────────────────
 @pytest.mark.parametrize("ratio,color", [
     (None, 'gray'), (0, 'red'), (14.9, 'red'),
@@ -0,0 +1,181 @@
+"""
+shard_store.py 按月分片 CSV 的單元測試(headless,不需 streamlit)。
+共同介面的行為另見 test_storage_backend.py。
+執行:python -m pytest test_shard_store.py -v
+"""
+
+import datetime
+import gzip
+import os
+
+import pandas as pd
+import pytest
+
+from schema import COLUMNS
+from shard_store import ShardedCsvStore, month_of
+
+
+def _rec(qr_id, timestamp='', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, timestamp=timestamp, **kw)
+    return base
+
+
+class MonthClock:
+    """可調的時鐘:set('2026-10') 之後「當月」就是 2026-10。"""
+
+    def __init__(self, month):
+        self.set(month)
+
+    def set(self, month):
+        self.now = datetime.datetime.strptime(month + '-15', '%Y-%m-%d').timestamp()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return MonthClock('2026-09')
+
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return ShardedCsvStore(str(tmp_path / 'data'), clock=clock)
+
+
+def _files(store):
+    return sorted(n for n in os.listdir(store.directory) if '.csv' in n and not n.endswith('.tmp'))
+
+
+def test_month_of():
+    assert month_of('2026-10-18 09:00:00') == '2026-10'
+    assert month_of('') is None and month_of('昨天') is None
+
+
+def test_append_writes_current_shard_and_manifest(store):
+    store.append_many([_rec('A1', '2026-09-02 08:00:00'), _rec('A2', '2026-09-20 17:30:00')])
+    store.append(_rec('A3'))
+    assert _files(store) == ['2026-09.csv']
+    entry = store.manifest()['shards']['2026-09']
+    assert entry == {'rows': 3, 'min_ts': '2026-09-02 08:00:00',
+                     'max_ts': '2026-09-20 17:30:00', 'compressed': False}
+
+
+def test_month_rollover_compresses_old_shard(store, clock):
+    store.append(_rec('A1', '2026-09-30 23:00:00'))
+    clock.set('2026-10')
+    store.append(_rec('A2', '2026-10-01 07:00:00'))
+    assert _files(store) == ['2026-09.csv.gz', '2026-10.csv']
+    with gzip.open(os.path.join(store.directory, '2026-09.csv.gz'), 'rt', encoding='utf-8-sig') as f:
+        assert f.readline().strip() == ','.join(COLUMNS)
+    shards = store.manifest()['shards']
+    assert shards['2026-09']['compressed'] and not shards['2026-10']['compressed']
+    assert store.load()['qr_id'].tolist() == ['A1', 'A2']
+
+    # 舊分片不可變:之後的 append 不再碰它
+    before = os.stat(os.path.join(store.directory, '2026-09.csv.gz')).st_mtime_ns
+    store.append(_rec('A3', '2026-10-02 07:00:00'))
+    assert os.stat(os.path.join(store.directory, '2026-09.csv.gz')).st_mtime_ns == before
+
+
+def test_load_range_opens_only_overlapping_shards(store, clock, monkeypatch):
+    for month, day in (('2026-07', '2026-07-10'), ('2026-08', '2026-08-10'), ('2026-09', '2026-09-10')):
+        clock.set(month)
+        store.append(_rec(f'Q{month}', f'{day} 10:00:00'))
+    assert store.shards_for_range('2026-08-01', '2026-08-31') == ['2026-08']
+
+    opened = []
+    original = ShardedCsvStore._read_file
+    monkeypatch.setattr(ShardedCsvStore, '_read_file',
+                        lambda self, name: opened.append(name) or original(self, name))
+    out = store.load_range(datetime.date(2026, 8, 1), datetime.date(2026, 8, 31))
+    assert out['qr_id'].tolist() == ['Q2026-08'] and opened == ['2026-08.csv.gz']
+
+
+def test_shard_missing_from_manifest_is_still_read(store):
+    store.append(_rec('A1', '2026-09-10 10:00:00'))
+    os.remove(store.manifest_path)
+    assert store.shards_for_range('2026-01-01', '2026-01-31') == ['2026-09']
+    assert store.load_range('2026-09-01', '2026-09-30')['qr_id'].tolist() == ['A1']
+    assert store.rebuild_manifest()['shards']['2026-09']['rows'] == 1
+
+
+def test_replace_all_reshards_by_timestamp(store):
+    store.append(_rec('OLD', '2026-09-01 00:00:00'))
+    df = pd.DataFrame([_rec('A1', '2026-07-31 10:00:00'), _rec('A2', '2026-09-01 10:00:00'),
+                       _rec('A3', '2026-07-01 09:00:00'), _rec('A4')], columns=COLUMNS)
+    store.replace_all(df)
+    assert _files(store) == ['2026-07.csv.gz', '2026-09.csv']
+    assert store.load()['qr_id'].tolist() == ['A1', 'A3', 'A2', 'A4']
+    shards = store.manifest()['shards']
+    assert shards['2026-07'] == {'rows': 2, 'min_ts': '2026-07-01 09:00:00',
+                                 'max_ts': '2026-07-31 10:00:00', 'compressed': True}
+    assert shards['2026-09']['rows'] == 2
+
+
+def test_replace_all_with_a_single_row(store):
+    store.replace_all(pd.DataFrame([_rec('A1', '2026-07-02 08:00:00')], columns=COLUMNS))
+    assert _files(store) == ['2026-07.csv.gz']
+    assert store.load()['qr_id'].tolist() == ['A1']
+
+
+def test_late_append_to_compressed_month_is_merged(store, clock):
+    store.append(_rec('A1', '2026-09-29 10:00:00'))
+    clock.set('2026-10')
+    store.compress_closed_shards()
+    # 另一個 process 換月前排隊的 append 在壓縮後才寫到 → 重開出新的 2026-09.csv
+    with open(os.path.join(store.directory, '2026-09.csv'), 'w', encoding='utf-8-sig') as f:
+        f.write(','.join(COLUMNS) + '\n' + ','.join(_rec('A2', '2026-09-30 23:59:00')[c]
+                                                   for c in COLUMNS) + '\n')
+    assert store.load()['qr_id'].tolist() == ['A1', 'A2']
+    assert store.compress_closed_shards() == ['2026-09']
+    assert _files(store) == ['2026-09.csv.gz']
+    assert store.manifest()['shards']['2026-09']['rows'] == 2
+    assert store.load()['qr_id'].tolist() == ['A1', 'A2']
+
+
+def _index_files(store):
+    return sorted(n for n in os.listdir(store.directory) if '.qrindex.db' in n)
+
+
+def test_compressing_a_shard_removes_its_qr_index(store, clock):
+    store.append_many([_rec('A1', '2026-09-29 10:00:00'), _rec('A2', '2026-09-29 11:00:00')])
+    assert store.get_history('A1')['qr_id'].tolist() == ['A1']   # 建出 2026-09 的索引
+    assert '2026-09.qrindex.db' in _index_files(store)
+    clock.set('2026-10')
+    assert store.compress_closed_shards() == ['2026-09']
+    assert _index_files(store) == []
+    assert store.get_history('A1')['qr_id'].tolist() == ['A1']   # 改從壓縮分片讀
+    assert _index_files(store) == []
+
+    clock.set('2026-11')
+    store.append(_rec('B1', '2026-11-01 08:00:00'))               # 沒查過的分片:壓縮時也不建索引
+    clock.set('2026-12')
+    assert store.compress_closed_shards() == ['2026-11']
+    assert _index_files(store) == []
+
+
+def test_replace_all_removes_indexes_of_rewritten_shards(store):
+    store.append(_rec('A1', '2026-09-02 08:00:00'))
+    store.get_history('A1')
+    store.replace_all(pd.DataFrame([_rec('A1', '2026-07-02 08:00:00'), _rec('A2', '2026-07-03 08:00:00')],
+                                   columns=COLUMNS))
+    assert _index_files(store) == []
+    assert store.get_history('A1')['timestamp'].tolist() == ['2026-07-02 08:00:00']
+
+
+def test_migrate_from_csv_once(store, tmp_path):
+    csv_path = str(tmp_path / 'plastic_trace_data.csv')
+    pd.DataFrame([_rec('A1', '2026-08-01 10:00:00'), _rec('A2', '2026-09-01 10:00:00')],
+                 columns=COLUMNS).to_csv(csv_path, index=False, encoding='utf-8-sig')
+    assert store.migrate_from_csv(csv_path) == 2
+    assert store.migrate_from_csv(csv_path) == 0
+    assert _files(store) == ['2026-08.csv.gz', '2026-09.csv']
+    assert store.stats()['rows'] == 2 and store.stats()['compressed'] == 1
+
+
+def test_version_changes_on_append(store):
+    v0 = store.version()
+    store.append(_rec('A1'))
+    assert store.version() != v0
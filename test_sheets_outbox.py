@@ -0,0 +1,172 @@
+"""
+sheets_outbox.py 純邏輯單元測試(headless,不需 streamlit / 網路)。
+執行:python -m pytest test_sheets_outbox.py -v
+"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from sheets_outbox import SheetsOutbox
+
+
+class FakeSheet:
+    """記錄每次 append_rows 的列;fail 次數內 raise(模擬 429)。"""
+
+    def __init__(self, fail=0):
+        self.calls = []
+        self.fail = fail
+
+    def append_rows(self, rows):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('429 quota exceeded')
+        self.calls.append(list(rows))
+
+    @property
+    def rows(self):
+        return [row for call in self.calls for row in call]
+
+
+@pytest.fixture
+def sheet():
+    return FakeSheet()
+
+
+@pytest.fixture
+def outbox(tmp_path, sheet):
+    box = SheetsOutbox(str(tmp_path / 'outbox.jsonl'), sheet.append_rows,
+                       base_delay=0.05, max_delay=0.2, linger=0.01, poll_interval=0.05)
+    yield box
+    box.stop()
+
+
+def test_enqueue_is_durable_and_visible(outbox):
+    outbox.enqueue([['A1', '王小明'], ['A2', '李大華']])
+    assert outbox.pending_rows() == [['A1', '王小明'], ['A2', '李大華']]
+    stats = outbox.stats()
+    assert stats['depth'] == 2 and stats['oldest_age'] >= 0
+    # 新的 outbox 物件(模擬 process 重啟)讀得到同樣的待送列
+    assert SheetsOutbox(outbox.path).pending_rows() == [['A1', '王小明'], ['A2', '李大華']]
+
+
+def test_drain_coalesces_into_one_call_and_truncates(outbox, sheet):
+    for i in range(5):
+        outbox.enqueue([[f'Q{i}']])
+    assert outbox.drain_once() == 5
+    assert sheet.calls == [[[f'Q{i}'] for i in range(5)]]
+    assert outbox.stats()['depth'] == 0
+    assert os.path.getsize(outbox.path) == 0   # 全部送完 → 截斷
+
+
+def test_drain_respects_max_batch(outbox, sheet):
+    outbox.max_batch = 2
+    outbox.enqueue([[str(i)] for i in range(5)])
+    assert outbox.drain()
+    assert [len(c) for c in sheet.calls] == [2, 2, 1]
+    assert sheet.rows == [[str(i)] for i in range(5)]
+
+
+def test_failure_keeps_rows_and_backs_off(outbox, sheet):
+    sheet.fail = 2
+    outbox.enqueue([['A1']])
+    assert not outbox.drain()
+    assert outbox.failures == 1 and '429' in outbox.last_error
+    first_delay = outbox.next_attempt - time.time()
+    assert not outbox.drain()
+    assert outbox.next_attempt - time.time() > first_delay * 0.5   # 指數退避
+    assert outbox.pending_rows() == [['A1']]
+
+    assert outbox.drain()
+    assert sheet.rows == [['A1']] and outbox.failures == 0 and outbox.last_error == ''
+
+
+def test_backoff_is_capped(outbox, sheet):
+    sheet.fail = 50
+    outbox.enqueue([['A1']])
+    for _ in range(10):
+        outbox.drain()
+    assert outbox.next_attempt - time.time() <= outbox.max_delay
+
+
+def test_rows_enqueued_during_send_are_kept(outbox, sheet):
+    outbox.enqueue([['A1']])
+
+    def send(rows):
+        outbox.enqueue([['A2']])   # 送出途中又有新列進來
+        sheet.append_rows(rows)
+
+    outbox.send = send
+    assert outbox.drain_once() == 1
+    assert outbox.pending_rows() == [['A2']]
+    outbox.send = sheet.append_rows
+    assert outbox.drain_once() == 1
+    assert sheet.rows == [['A1'], ['A2']]
+
+
+def test_crash_after_send_before_ack_resends(outbox, sheet, monkeypatch):
+    outbox.enqueue([['A1']])
+    monkeypatch.setattr(outbox, '_commit', lambda end: (_ for _ in ()).throw(OSError('crash')))
+    with pytest.raises(OSError):
+        outbox.drain_once()
+    restarted = SheetsOutbox(outbox.path, sheet.append_rows)
+    assert restarted.drain_once() == 1
+    assert sheet.rows == [['A1'], ['A1']]   # 至少一次:不漏,可能重複
+
+
+def test_partial_trailing_line_is_not_sent(outbox, sheet):
+    outbox.enqueue([['A1']])
+    with open(outbox.path, 'ab') as f:
+        f.write(b'{"t": 1, "row": ["A')
+    assert outbox.pending_rows() == [['A1']]
+    assert outbox.drain_once() == 1
+    assert sheet.rows == [['A1']]
+
+
+def test_stale_ack_beyond_size_resets(outbox, sheet):
+    outbox._write_ack(10_000)
+    outbox.enqueue([['A1']])
+    assert outbox.pending_rows() == [['A1']]
+
+
+def test_only_one_drainer_at_a_time(outbox, sheet):
+    outbox.enqueue([['A1']])
+    entered = threading.Event()
+    release = threading.Event()
+
+    def slow_send(rows):
+        entered.set()
+        release.wait(5)
+        sheet.append_rows(rows)
+
+    outbox.send = slow_send
+    t = threading.Thread(target=outbox.drain_once)
+    t.start()
+    entered.wait(5)
+    other = SheetsOutbox(outbox.path, sheet.append_rows)   # 另一個 process 的 outbox
+    assert other.drain_once() == 0
+    release.set()
+    t.join()
+    assert sheet.rows == [['A1']]
+
+
+def test_background_worker_drains_and_notifies(outbox, sheet):
+    sent = threading.Event()
+    outbox.on_sent = sent.set
+    outbox.start()
+    outbox.enqueue([['A1'], ['A2']])
+    assert sent.wait(5)
+    assert sheet.rows == [['A1'], ['A2']]
+    assert outbox.stats()['depth'] == 0 and outbox.stats()['running']
+
+
+def test_background_worker_retries_after_failure(outbox, sheet):
+    sheet.fail = 2
+    sent = threading.Event()
+    outbox.on_sent = sent.set
+    outbox.start()
+    outbox.enqueue([['A1']])
+    assert sent.wait(5)
+    assert sheet.rows == [['A1']] and outbox.failures == 0
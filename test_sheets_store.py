@@ -0,0 +1,409 @@
+"""
+sheets_store.py 純邏輯單元測試(headless,不需 streamlit / gspread / 網路)。
+執行:python -m pytest test_sheets_store.py -v
+"""
+
+import os
+import re
+import threading
+
+import pytest
+
+from schema import COLUMNS, to_cell
+from sheets_store import SheetsMirror, col_letter
+
+
+def _col_index(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - ord('A') + 1
+    return n
+
+
+class FakeWorksheet:
+    """最小的 gspread Worksheet 替身:values 是整張表(含表頭),回傳時去掉行尾空格。"""
+
+    def __init__(self, values=None, row_count=None):
+        self.values = [list(r) for r in (values or [])]
+        self.row_count = row_count if row_count is not None else max(len(self.values), 1)
+        self.requests = []
+
+    @staticmethod
+    def _trim(row):
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+    def _range(self, a1):
+        m = re.fullmatch(r'(\d+):(\d+)', a1)
+        if m:
+            r1, r2, c1, c2 = int(m[1]), int(m[2]), 1, None
+        else:
+            m = re.fullmatch(r'([A-Z]+)(\d+):([A-Z]+)(\d*)', a1)
+            r1, c1, c2 = int(m[2]), _col_index(m[1]), _col_index(m[3])
+            r2 = int(m[4]) if m[4] else len(self.values)
+        if r1 > len(self.values):
+            raise RuntimeError(f'Range {a1} exceeds grid limits')
+        rows = [self._trim(r[c1 - 1:c2]) for r in self.values[r1 - 1:r2]]
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def get_values(self):
+        self.requests.append('get_values')
+        return self._range(f'1:{len(self.values)}') if self.values else []
+
+    def batch_get(self, ranges):
+        self.requests.append(('batch_get', tuple(ranges)))
+        return [self._range(r) for r in ranges]
+
+    def batch_update(self, data):
+        self.requests.append(('batch_update', tuple(d['range'] for d in data)))
+        for d in data:
+            m = re.fullmatch(r'A(\d+):[A-Z]+(\d+)', d['range'])
+            r1, r2 = int(m[1]), int(m[2])
+            if r2 > self.row_count:
+                raise RuntimeError(f"Range {d['range']} exceeds grid limits")
+            assert len(d['values']) == r2 - r1 + 1
+            while len(self.values) < r2:
+                self.values.append([])
+            for i, row in enumerate(d['values']):
+                self.values[r1 - 1 + i] = list(row)
+
+    def resize(self, rows):
+        self.requests.append(('resize', rows))
+        self.row_count = rows
+        del self.values[rows:]
+
+
+def _row(qr_id, **kw):
+    rec = {c: '' for c in COLUMNS}
+    rec.update(qr_id=qr_id, **kw)
+    return [rec[c] for c in COLUMNS]
+
+
+@pytest.fixture
+def ws():
+    return FakeWorksheet([COLUMNS, _row('A1', weight_kg='12.5'), _row('A2')])
+
+
+def test_col_letter():
+    assert [col_letter(n) for n in (1, 16, 26, 27, 52)] == ['A', 'P', 'Z', 'AA', 'AZ']
+
+
+def test_first_load_is_full_fetch_of_strings(ws):
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    assert list(df.columns) == COLUMNS
+    assert df['qr_id'].tolist() == ['A1', 'A2']
+    assert df.loc[0, 'weight_kg'] == '12.5' and df.loc[1, 'weight_kg'] == ''
+    assert mirror.full_fetches == 1
+
+
+def test_appended_rows_fetched_incrementally(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    ws.values.append(_row('A3', notes='新'))
+    df = mirror.load()
+    assert df['qr_id'].tolist() == ['A1', 'A2', 'A3'] and df.loc[2, 'notes'] == '新'
+    assert mirror.full_fetches == 1 and mirror.incremental_fetches == 1
+    assert ws.requests[-1] == ('batch_get', ('1:1', 'A3:P'))
+
+
+def test_no_change_returns_same_rows_with_one_request(ws):
+    mirror = SheetsMirror(ws)
+    first = mirror.load()
+    assert mirror.load() is first
+    assert len(ws.requests) == 2
+
+
+def test_shrunk_sheet_falls_back_to_full_fetch(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    del ws.values[2]
+    assert mirror.load()['qr_id'].tolist() == ['A1']
+    assert mirror.full_fetches == 2
+
+
+def test_rewritten_last_row_falls_back_to_full_fetch(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    ws.values[1:] = [_row('B1'), _row('B2'), _row('B3')]
+    assert mirror.load()['qr_id'].tolist() == ['B1', 'B2', 'B3']
+    assert mirror.full_fetches == 2
+
+
+def test_header_change_falls_back_to_full_fetch():
+    old = COLUMNS[:11]
+    ws = FakeWorksheet([old, _row('A1')[:11]])
+    mirror = SheetsMirror(ws)
+    assert mirror.load()['batch_name'].tolist() == ['']   # 舊 11 欄表 → 補空欄
+    ws.values = [COLUMNS, _row('A1', batch_name='批次一')]
+    assert mirror.load()['batch_name'].tolist() == ['批次一']
+    assert mirror.full_fetches == 2
+
+
+def test_trailing_blank_cells_are_padded(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    ws.values.append(['A3'] + [''] * (len(COLUMNS) - 1))
+    df = mirror.load()
+    assert df.loc[2, 'qr_id'] == 'A3' and df.loc[2, 'notes'] == ''
+    assert mirror.incremental_fetches == 1
+
+
+def test_empty_sheet_and_header_only():
+    ws = FakeWorksheet([])
+    mirror = SheetsMirror(ws)
+    assert mirror.load().empty
+    ws.values = [COLUMNS]
+    assert mirror.load().empty
+    ws.values.append(_row('A1'))
+    assert mirror.load()['qr_id'].tolist() == ['A1']
+
+
+def test_reset_forces_full_fetch(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    mirror.reset()
+    mirror.load()
+    assert mirror.full_fetches == 2
+
+
+# ─── 差異儲存 ─────────────────────────────────────────────────
+
+def _frame(rows):
+    import pandas as pd
+    return pd.DataFrame([dict(zip(COLUMNS, r)) for r in rows], columns=COLUMNS)
+
+
+def _writes(ws):
+    return [r for r in ws.requests if r[0] in ('batch_update', 'resize')]
+
+
+def test_unchanged_save_sends_nothing(ws):
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    ws.requests.clear()
+    assert mirror.save(df) == 0
+    assert _writes(ws) == []
+
+
+def test_changed_rows_sent_as_runs_in_one_batch_update():
+    rows = [_row(f'Q{i}') for i in range(6)]
+    ws = FakeWorksheet([COLUMNS] + rows)
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    df.loc[1, 'notes'] = 'x'
+    df.loc[2, 'notes'] = 'y'
+    df.loc[5, 'notes'] = 'z'
+    ws.requests.clear()
+    assert mirror.save(df) == 3
+    assert _writes(ws) == [('batch_update', ('A3:P4', 'A7:P7'))]
+    assert SheetsMirror(ws).load().equals(df)
+
+
+def test_growing_resizes_then_writes_new_rows(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    grown = _frame([_row('A1', weight_kg='12.5'), _row('A2'), _row('A3'), _row('A4')])
+    ws.requests.clear()
+    assert mirror.save(grown) == 2
+    assert _writes(ws) == [('resize', 5), ('batch_update', ('A4:P5',))]
+    assert SheetsMirror(ws).load()['qr_id'].tolist() == ['A1', 'A2', 'A3', 'A4']
+
+
+def test_growing_within_grid_skips_resize():
+    ws = FakeWorksheet([COLUMNS, _row('A1')], row_count=1000)
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    ws.requests.clear()
+    mirror.save(_frame([_row('A1'), _row('A2')]))
+    assert _writes(ws) == [('batch_update', ('A3:P3',))]
+
+
+def test_shrinking_writes_then_resizes(ws):
+    mirror = SheetsMirror(ws)
+    mirror.load()
+    ws.requests.clear()
+    assert mirror.save(_frame([_row('B1')])) == 1
+    assert _writes(ws) == [('batch_update', ('A2:P2',)), ('resize', 2)]
+    assert SheetsMirror(ws).load()['qr_id'].tolist() == ['B1']
+
+
+def test_save_never_leaves_sheet_empty(ws):
+    """改寫途中讀者看到的列數不會掉到 0(舊做法 clear() 會)。"""
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    df.loc[0, 'notes'] = 'x'
+    seen = []
+    original = ws.batch_update
+
+    def spy(data):
+        seen.append(len(ws.values))
+        original(data)
+
+    ws.batch_update = spy
+    mirror.save(df)
+    assert seen == [3]
+
+
+def test_save_syncs_with_rows_appended_by_others(ws):
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    ws.values.append(_row('A3'))   # 別的 replica append 進來
+    df = _frame([_row('A1', weight_kg='12.5'), _row('A2'), _row('A3')])
+    ws.requests.clear()
+    assert mirror.save(df) == 0
+    assert _writes(ws) == []
+
+
+def test_full_rewrite_upgrades_old_header():
+    ws = FakeWorksheet([COLUMNS[:11], _row('A1')[:11], _row('A2')[:11]], row_count=1000)
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    ws.requests.clear()
+    assert mirror.save(df) == 2
+    assert _writes(ws) == [('batch_update', ('A1:P3',)), ('resize', 3)]
+    assert ws.values[0] == COLUMNS
+
+
+def test_explicit_full_rewrites_everything(ws):
+    mirror = SheetsMirror(ws)
+    df = mirror.load()
+    ws.requests.clear()
+    assert mirror.save(df, full=True) == 2
+    assert _writes(ws) == [('batch_update', ('A1:P3',))]
+    assert ws.requests[0] == ('batch_update', ('A1:P3',))   # full 不先讀
+
+
+def test_save_into_empty_sheet():
+    ws = FakeWorksheet([])
+    mirror = SheetsMirror(ws)
+    assert mirror.save(_frame([_row('A1'), _row('A2')])) == 2
+    assert SheetsMirror(ws).load()['qr_id'].tolist() == ['A1', 'A2']
+
+
+def test_save_stringifies_cells_like_to_cell():
+    """整表 astype(str) 與逐格 to_cell 結果相同:NaN / None → ''、float / int → str()。"""
+    import numpy as np
+    import pandas as pd
+    df = pd.DataFrame({'qr_id': ['A1', 'A2', 'A3', 'A4'],
+                       'weight_kg': [12.5, np.nan, None, 1e20],
+                       'recycled_ratio': [0.3, 1, None, float('nan')],
+                       'notes': [None, np.nan, 'x', '']})
+    ws = FakeWorksheet([])
+    SheetsMirror(ws).save(df)
+    cols = [COLUMNS.index(c) for c in ('qr_id', 'weight_kg', 'recycled_ratio', 'notes')]
+    written = [[row[i] if i < len(row) else '' for i in cols] for row in ws.values[1:]]
+    assert written == [['A1', '12.5', '0.3', ''], ['A2', '', '1.0', ''],
+                       ['A3', '', '', 'x'], ['A4', '1e+20', '', '']]
+    assert written == [[to_cell(v) for v in row]
+                       for row in df.itertuples(index=False, name=None)]
+
+
+# ─── 版本檢查 + 磁碟快取 ──────────────────────────────────────
+
+class Revision:
+    """模擬 Drive modifiedTime:測試改表後自行 bump。"""
+
+    def __init__(self):
+        self.value = 1
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return f'2025-01-01T00:00:{self.value:02d}Z'
+
+
+@pytest.fixture
+def rev():
+    return Revision()
+
+
+def test_unchanged_revision_skips_sheets_calls(ws, rev):
+    mirror = SheetsMirror(ws, revision=rev)
+    first = mirror.load()
+    ws.requests.clear()
+    assert mirror.load() is first
+    assert ws.requests == [] and mirror.revision_hits == 1
+
+
+def test_changed_revision_syncs_incrementally(ws, rev):
+    mirror = SheetsMirror(ws, revision=rev)
+    mirror.load()
+    ws.values.append(_row('A3'))
+    rev.value += 1
+    assert mirror.load()['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert mirror.incremental_fetches == 1
+
+
+def test_own_writes_mark_revision_stale(ws, rev):
+    mirror = SheetsMirror(ws, revision=rev)
+    mirror.load()
+    ws.values.append(_row('A3'))   # 自己 append,Drive 版本還沒跟上
+    mirror.mark_stale()
+    assert mirror.load()['qr_id'].tolist() == ['A1', 'A2', 'A3']
+
+
+def test_disk_cache_serves_cold_start_with_same_revision(ws, rev, tmp_path):
+    cache = str(tmp_path / 'sheets_cache.parquet')
+    SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1').load()
+    ws.requests.clear()
+
+    cold = SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1')
+    df = cold.load()
+    assert df['qr_id'].tolist() == ['A1', 'A2'] and df.loc[0, 'weight_kg'] == '12.5'
+    assert ws.requests == [] and cold.cache_loads == 1
+    # 從快取還原的鏡像仍能增量同步
+    ws.values.append(_row('A3'))
+    rev.value += 1
+    assert cold.load()['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert cold.full_fetches == 0 and cold.incremental_fetches == 1
+
+
+def test_disk_cache_ignored_when_revision_or_sheet_differs(ws, rev, tmp_path):
+    cache = str(tmp_path / 'sheets_cache.parquet')
+    SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1').load()
+    other = SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:2')
+    other.load()
+    assert other.cache_loads == 0 and other.full_fetches == 1
+
+    ws.values.append(_row('A3'))
+    rev.value += 1
+    cold = SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1')
+    assert cold.load()['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert cold.cache_loads == 0
+
+
+def test_concurrent_cold_starts_share_the_disk_cache(ws, rev, tmp_path):
+    cache = str(tmp_path / 'sheets_cache.parquet')
+    barrier = threading.Barrier(6)
+    frames, errors = [], []
+
+    def cold_start():
+        barrier.wait()
+        try:
+            frames.append(SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1').load())
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=cold_start) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and [f['qr_id'].tolist() for f in frames] == [['A1', 'A2']] * 6
+    assert os.listdir(tmp_path) == ['sheets_cache.parquet']   # 各自的暫存檔都已 rename 掉
+    cold = SheetsMirror(ws, cache_path=cache, revision=rev, cache_key='s:1')
+    assert cold.load()['qr_id'].tolist() == ['A1', 'A2'] and cold.cache_loads == 1
+
+
+def test_revision_failure_falls_back_to_fetch(ws, tmp_path):
+    def broken():
+        raise RuntimeError('drive quota')
+
+    cache = str(tmp_path / 'sheets_cache.parquet')
+    mirror = SheetsMirror(ws, cache_path=cache, revision=broken)
+    assert mirror.load()['qr_id'].tolist() == ['A1', 'A2']
+    assert not (tmp_path / 'sheets_cache.parquet').exists()
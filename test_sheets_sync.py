@@ -0,0 +1,112 @@
+"""
+sheets_sync.py 雜湊對帳單元測試,以及 DataManager 對帳同步到 FakeClient 的端到端測試
+(headless,不需網路 / Google 帳號)。
+執行:python -m pytest test_sheets_sync.py -v
+"""
+
+import pandas as pd
+import pytest
+
+from fake_sheets import FakeClient
+from quota import QuotaGuard
+from schema import COLUMNS
+from sheets_outbox import SheetsOutbox
+from sheets_sync import reconcile, row_hashes
+
+
+def _frame(*qr_ids, **kw):
+    rows = []
+    for qr_id in qr_ids:
+        row = {c: '' for c in COLUMNS}
+        row.update(qr_id=qr_id, **kw)
+        rows.append(row)
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def test_row_hashes_ignore_column_order_and_separate_cells():
+    df = _frame('A1', notes='x')
+    assert row_hashes(df) == row_hashes(df[list(reversed(COLUMNS))])
+    a = _frame('a|b', notes='c')
+    b = _frame('a', notes='|bc')
+    assert row_hashes(a) != row_hashes(b)
+
+
+def test_reconcile_reports_both_directions():
+    local = _frame('A1', 'A2', 'A3')
+    remote = _frame('A2', 'R9')
+    plan = reconcile(local, remote)
+    assert plan['to_append']['qr_id'].tolist() == ['A1', 'A3']
+    assert plan['missing_local']['qr_id'].tolist() == ['R9']
+    assert plan['matched'] == 1
+
+
+def test_reconcile_counts_duplicate_rows_as_multiset():
+    local = _frame('A1', 'A1', 'A1')
+    remote = _frame('A1')
+    plan = reconcile(local, remote)
+    assert len(plan['to_append']) == 2 and plan['matched'] == 1
+    assert reconcile(remote, local)['missing_local']['qr_id'].tolist() == ['A1', 'A1']
+
+
+def test_reconcile_edited_row_shows_on_both_sides():
+    plan = reconcile(_frame('A1', notes='新'), _frame('A1', notes='舊'))
+    assert plan['to_append'].loc[0, 'notes'] == '新'
+    assert plan['missing_local'].loc[0, 'notes'] == '舊'
+
+
+def test_reconcile_identical_is_noop():
+    df = _frame('A1', 'A2')
+    plan = reconcile(df, df.copy())
+    assert plan['to_append'].empty and plan['missing_local'].empty and plan['matched'] == 2
+
+
+# ─── DataManager._reconcile_to_sheets 對 FakeClient ─────────────────
+
+@pytest.fixture
+def dm(tmp_path):
+    from data_manager import DataManager
+    from google_sheets_manager import GoogleSheetsManager
+    client = FakeClient()
+    quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6, base_delay=0.001)
+    dm = DataManager.__new__(DataManager)   # 不跑 initialize(不連線、不碰工作目錄)
+    dm.sheets_manager = GoogleSheetsManager('db', quiet=True, client=client,
+                                            cache_path=None, quota=quota)
+    dm.outbox = SheetsOutbox(str(tmp_path / 'outbox.jsonl'))
+    dm.client = client
+    return dm
+
+
+def _sheet_rows(dm):
+    return dm.client.open('db').worksheet('履歷資料').get_values()[1:]
+
+
+def test_sync_appends_only_missing_rows_in_one_request(dm):
+    dm.sheets_manager.append_rows(_frame('A1', 'R9').values.tolist())
+    before = dm.client.requests['values_append']
+    plan = dm._reconcile_to_sheets(_frame('A1', 'A2', 'A3'))
+    assert dm.client.requests['values_append'] == before + 1
+    assert [r[0] for r in _sheet_rows(dm)] == ['A1', 'R9', 'A2', 'A3']
+    assert plan['missing_local']['qr_id'].tolist() == ['R9']
+    for op in ('values_clear', 'values_update', 'values_batchUpdate'):
+        assert dm.client.requests[op] == 0
+
+    # 再對帳一次:沒有差異就不寫
+    assert dm._reconcile_to_sheets(_frame('A1', 'A2', 'A3'))['to_append'].empty
+    assert dm.client.requests['values_append'] == before + 1
+
+
+def test_sync_skips_rows_still_in_outbox(dm):
+    dm.outbox.enqueue([_frame('A2').iloc[0].tolist()])
+    plan = dm._reconcile_to_sheets(_frame('A1', 'A2'))
+    assert plan['to_append']['qr_id'].tolist() == ['A1']
+    dm.outbox.send = dm.sheets_manager.append_rows
+    dm.outbox.drain_once()
+    assert sorted(r[0] for r in _sheet_rows(dm)) == ['A1', 'A2']
+
+
+def test_sync_read_failure_does_not_treat_sheet_as_empty(dm):
+    dm.client.error_rate = 1.0
+    with pytest.raises(Exception):
+        dm._reconcile_to_sheets(_frame('A1'))
+    dm.client.error_rate = 0.0
+    assert _sheet_rows(dm) == []
@@ -0,0 +1,122 @@
+"""
+sqlite_store.py 單元測試(headless,不需 streamlit)。
+執行:python -m pytest test_sqlite_store.py -v
+"""
+
+import sqlite3
+import threading
+
+import pandas as pd
+import pytest
+
+import sqlite_store
+from schema import COLUMNS, STAGE_FACTORY_OUT, STAGE_RECYCLE
+from sqlite_store import SqliteStore
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteStore(str(tmp_path / 'data.db'))
+
+
+def test_empty_store_loads_16_columns(store):
+    out = store.load()
+    assert out.empty and list(out.columns) == COLUMNS
+
+
+def test_wal_mode_and_indexes(store):
+    conn = sqlite3.connect(store.path)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    indexed = {r[0] for r in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")}
+    for col in ['qr_id', 'batch_name', 'stage', 'timestamp']:
+        assert any(f'("{col}")' in sql for sql in indexed)
+
+
+def test_append_keeps_order_and_stringifies(store):
+    store.append(_rec('A1', weight_kg=12.5))
+    store.append(_rec('A2', weight_kg=None))
+    out = store.load()
+    assert out['qr_id'].tolist() == ['A1', 'A2']
+    assert out.loc[0, 'weight_kg'] == '12.5'        # 與 Sheets str() 一致
+    assert out.loc[1, 'weight_kg'] == ''
+
+
+def test_history_and_batch_lookups(store):
+    store.append_many([
+        _rec('A1', 'b1', stage=STAGE_FACTORY_OUT),
+        _rec('B1', 'b2'),
+        _rec('A1', 'b1', stage=STAGE_RECYCLE),
+    ])
+    assert store.history('A1')['stage'].tolist() == [STAGE_FACTORY_OUT, STAGE_RECYCLE]
+    assert store.batch_rows('b2')['qr_id'].tolist() == ['B1']
+    assert store.history('NOPE').empty
+
+
+def test_query_plan_uses_index(store):
+    conn = sqlite3.connect(store.path)
+    plan = ' '.join(str(r) for r in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT * FROM records WHERE qr_id = ?', ('A1',)))
+    assert 'idx_records_qr_id' in plan
+
+
+def test_version_changes_on_append_and_replace(store):
+    v0 = store.version()
+    store.append(_rec('A1'))
+    v1 = store.version()
+    store.replace_all(pd.DataFrame(columns=COLUMNS))   # 清空也要換版本
+    v2 = store.version()
+    assert len({v0, v1, v2}) == 3
+    assert store.count() == 0
+
+
+def test_replace_all_migrates_old_frame(store):
+    store.replace_all(pd.DataFrame([{'qr_id': 'A1', 'weight_kg': 5}]))
+    out = store.load()
+    assert list(out.columns) == COLUMNS
+    assert out.loc[0, 'weight_kg'] == '5'
+
+
+def test_migrate_from_csv_once(store, tmp_path):
+    csv_path = str(tmp_path / 'data.csv')
+    pd.DataFrame([_rec('A1'), _rec('A2')], columns=COLUMNS).to_csv(
+        csv_path, index=False, encoding='utf-8-sig')
+    assert store.migrate_from_csv(csv_path) == 2
+    assert store.migrate_from_csv(csv_path) == 0      # 已有資料不重複匯入
+    assert store.load()['qr_id'].tolist() == ['A1', 'A2']
+
+
+def test_migrate_from_csv_rechecks_inside_the_write_transaction(store, tmp_path, monkeypatch):
+    csv_path = str(tmp_path / 'data.csv')
+    pd.DataFrame([_rec('A1'), _rec('A2')], columns=COLUMNS).to_csv(
+        csv_path, index=False, encoding='utf-8-sig')
+    other = SqliteStore(store.path)   # 另一個 process 的連線
+    reader = sqlite_store.CsvTailReader
+
+    class RacingReader(reader):
+        def read(self):
+            # 本 store 已確認資料庫為空、正在讀 CSV 時,另一個 process 搶先匯入
+            monkeypatch.setattr(sqlite_store, 'CsvTailReader', reader)
+            assert other.migrate_from_csv(csv_path) == 2
+            return super().read()
+    monkeypatch.setattr(sqlite_store, 'CsvTailReader', RacingReader)
+    assert store.migrate_from_csv(csv_path) == 0
+    assert store.load()['qr_id'].tolist() == ['A1', 'A2']
+
+
+def test_concurrent_appends_from_threads(store):
+    def worker(n):
+        for i in range(25):
+            store.append(_rec(f'T{n}-{i}'))
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store.count() == 100
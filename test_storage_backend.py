@@ -0,0 +1,148 @@
+"""
+StorageBackend 一致性測試:每個後端(CSV / SQLite / Google Sheets 替身)都要通過同一組測試。
+新增後端時把它加進 BACKENDS 即可(headless,不需網路 / Google 帳號)。
+執行:python -m pytest test_storage_backend.py -v
+"""
+
+import pandas as pd
+import pytest
+
+from schema import COLUMNS, STAGE_FACTORY_OUT, STAGE_RECYCLE
+from storage_backend import CsvBackend, SheetsBackend, StorageBackend
+
+
+def _rec(qr_id, batch='b', **kw):
+    base = {c: '' for c in COLUMNS}
+    base.update(qr_id=qr_id, batch_name=batch, **kw)
+    return base
+
+
+def _csv(tmp_path):
+    return CsvBackend(str(tmp_path / 'data.csv'))
+
+
+def _sqlite(tmp_path):
+    from sqlite_store import SqliteStore
+    return SqliteStore(str(tmp_path / 'data.db'))
+
+
+def _sharded(tmp_path):
+    from shard_store import ShardedCsvStore
+    return ShardedCsvStore(str(tmp_path / 'data'))
+
+
+def _sheets(tmp_path):
+    from fake_sheets import FakeClient
+    from google_sheets_manager import GoogleSheetsManager
+    from quota import QuotaGuard
+    quota = QuotaGuard(10 ** 6, 10 ** 6, burst=10 ** 6, base_delay=0.001)
+    return SheetsBackend(GoogleSheetsManager('db', quiet=True, client=FakeClient(),
+                                             cache_path=None, quota=quota))
+
+
+BACKENDS = {'csv': _csv, 'sqlite': _sqlite, 'sharded': _sharded, 'sheets': _sheets}
+
+
+@pytest.fixture(params=sorted(BACKENDS))
+def backend(request, tmp_path):
+    return BACKENDS[request.param](tmp_path)
+
+
+def _rewrite(backend, df):
+    """整表改寫(各後端對應 save_data 的路徑),用來測 load_since 的 reset。"""
+    if backend.name == 'csv':
+        df.to_csv(backend.path, index=False, encoding='utf-8-sig')
+    elif backend.name in ('sqlite', 'sharded'):
+        backend.replace_all(df)
+    else:
+        backend.manager.save_data(df)
+
+
+def test_is_storage_backend(backend):
+    assert isinstance(backend, StorageBackend) and backend.name
+
+
+def test_empty_load_has_schema(backend):
+    out = backend.load()
+    assert out.empty and list(out.columns) == COLUMNS
+    assert backend.stats()['rows'] == 0
+
+
+def test_append_keeps_order_and_stringifies(backend):
+    backend.append(_rec('A1', weight_kg=12.5))
+    backend.append_many([_rec('A2', weight_kg=None), {'qr_id': 'A3', 'notes': '逗號,與"引號"'}])
+    out = backend.load()
+    assert list(out.columns) == COLUMNS
+    assert out['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert out['weight_kg'].tolist() == ['12.5', '', '']
+    assert out.loc[2, 'notes'] == '逗號,與"引號"'
+    assert backend.stats()['rows'] == 3
+
+
+def test_lookups(backend):
+    backend.append_many([
+        _rec('A1', 'b1', stage=STAGE_FACTORY_OUT),
+        _rec('B1', 'b2'),
+        _rec('A1', 'b1', stage=STAGE_RECYCLE),
+    ])
+    history = backend.lookup_by_qr('A1')
+    assert history['stage'].tolist() == [STAGE_FACTORY_OUT, STAGE_RECYCLE]
+    assert list(history.index) == [0, 1]
+    assert backend.lookup_by_batch('b2')['qr_id'].tolist() == ['B1']
+    assert backend.lookup_by_qr('NOPE').empty
+    assert list(backend.lookup_by_qr('NOPE').columns) == COLUMNS
+    assert backend.get_history('A1').equals(history)
+    assert backend.get_history('NOPE').empty
+
+
+def test_get_history_sees_appends_and_rewrites(backend):
+    backend.append(_rec('A1', stage=STAGE_FACTORY_OUT))
+    assert len(backend.get_history('A1')) == 1
+    backend.append_many([_rec('A1', stage=STAGE_RECYCLE), _rec('B1')])
+    assert backend.get_history('A1')['stage'].tolist() == [STAGE_FACTORY_OUT, STAGE_RECYCLE]
+    _rewrite(backend, pd.DataFrame([_rec('B1'), _rec('A1', notes='改寫')]))
+    assert backend.get_history('A1')['notes'].tolist() == ['改寫']
+
+
+def test_rewrite_order(backend):
+    rows = [_rec('A1', timestamp='2026-10-02 08:00:00'), _rec('A2', timestamp='2026-09-30 08:00:00'),
+            _rec('A3', timestamp='2026-10-01 08:00:00'), _rec('A4', timestamp='2026-09-01 08:00:00')]
+    _rewrite(backend, pd.DataFrame(rows, columns=COLUMNS))
+    if backend.name == 'sharded':
+        # 按月分片:依月份重新分組,同月內保持寫入順序(見 shard_store 模組說明)
+        expected = ['A2', 'A4', 'A1', 'A3']
+    else:
+        expected = ['A1', 'A2', 'A3', 'A4']
+    assert backend.load()['qr_id'].tolist() == expected
+
+
+def test_load_range(backend):
+    backend.append_many([_rec('A1', timestamp='2026-09-30 23:59:59'),
+                         _rec('A2', timestamp='2026-10-01 00:00:00'),
+                         _rec('A3', timestamp='2026-10-18 12:00:00'),
+                         _rec('A4')])
+    assert backend.load_range('2026-10-01', '2026-10-18')['qr_id'].tolist() == ['A2', 'A3']
+    assert backend.load_range('2026-09-30', '2026-09-30')['qr_id'].tolist() == ['A1']
+    assert backend.load_range('2027-01-01', '2027-12-31').empty
+
+
+def test_load_since_returns_only_new_rows(backend):
+    first = backend.load_since()
+    assert first['rows'].empty and not first['reset']
+    backend.append_many([_rec('A1'), _rec('A2')])
+    step = backend.load_since(first['cursor'])
+    assert step['rows']['qr_id'].tolist() == ['A1', 'A2'] and not step['reset']
+    backend.append(_rec('A3'))
+    step = backend.load_since(step['cursor'])
+    assert step['rows']['qr_id'].tolist() == ['A3']
+    assert backend.load_since(step['cursor'])['rows'].empty
+
+
+def test_load_since_resets_after_rewrite(backend):
+    backend.append_many([_rec('A1'), _rec('A2')])
+    cursor = backend.load_since()['cursor']
+    _rewrite(backend, pd.DataFrame([_rec('A1'), _rec('A2', notes='改'), _rec('A3')],
+                                   columns=COLUMNS))
+    step = backend.load_since(cursor)
+    assert step['reset'] and step['rows']['qr_id'].tolist() == ['A1', 'A2', 'A3']
+    assert not backend.load_since(step['cursor'])['reset']